@@ -0,0 +1,190 @@
+import asyncio
+import json
+import time
+import uuid
+from feeder_utilities.serialization import decode_json
+
+
+class AioMessage(object):
+
+    """A delivered message, mirroring the parts of kombu's Message used by feeders.
+
+    `body` is the decoded JSON body and `properties` holds reply_to and
+    correlation_id.  ack(), reject() and requeue() are coroutines.
+
+    """
+
+    def __init__(self, body, headers, properties, ack, reject):
+        self.body = body
+        self.headers = headers or {}
+        self.properties = properties
+        self._ack = ack
+        self._reject = reject
+        self.acknowledged = False
+
+    @property
+    def payload(self):
+        return self.body
+
+    async def ack(self):
+        if not self.acknowledged:
+            self.acknowledged = True
+            await self._ack()
+
+    async def reject(self, requeue=False):
+        if not self.acknowledged:
+            self.acknowledged = True
+            await self._reject(requeue)
+
+    async def requeue(self):
+        await self.reject(requeue=True)
+
+
+class MemoryBroker(object):
+
+    """In-memory stand-in for RabbitMQ, for testing the asyncio worker and client.
+
+    Supports the default exchange (routing key is the queue name), direct
+    exchanges via bind(), prefetch limits and requeueing.  Bodies are JSON
+    encoded on publish, as they would be on the wire.
+
+    """
+
+    def __init__(self):
+        self.queues = {}
+        self.bindings = {}
+        self._consumers = {}
+
+    async def connect(self):
+        pass
+
+    async def close(self):
+        for tag in list(self._consumers):
+            await self.cancel(tag)
+
+    async def declare_queue(self, name=None, exclusive=False):
+        name = name or 'amq.gen-{}'.format(uuid.uuid4().hex)
+        self.queues.setdefault(name, asyncio.Queue())
+        return name
+
+    async def bind(self, queue_name, exchange, routing_key):
+        self.bindings.setdefault((exchange, routing_key), set()).add(queue_name)
+
+    def message_count(self, queue_name):
+        return self.queues[queue_name].qsize()
+
+    async def publish(self, body, exchange='', routing_key='', headers=None, correlation_id=None, reply_to=None,
+                      expiration=None):
+        if exchange:
+            queue_names = self.bindings.get((exchange, routing_key), ())
+        else:
+            queue_names = (routing_key,) if routing_key in self.queues else ()
+        encoded = json.dumps(body)
+        properties = {'correlation_id': correlation_id, 'reply_to': reply_to}
+        expires = time.time() + expiration if expiration is not None else None
+        for queue_name in queue_names:
+            self.queues[queue_name].put_nowait((encoded, dict(headers or {}), properties, expires))
+
+    async def consume(self, queue_name, callback, prefetch_count=None):
+        tag = uuid.uuid4().hex
+        self._consumers[tag] = asyncio.ensure_future(self._consume(queue_name, callback, prefetch_count))
+        return tag
+
+    async def cancel(self, tag):
+        task = self._consumers.pop(tag)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def _consume(self, queue_name, callback, prefetch_count):
+        queue = self.queues[queue_name]
+        unacked = asyncio.Semaphore(prefetch_count) if prefetch_count else None
+        while True:
+            if unacked:
+                await unacked.acquire()
+            delivery = await queue.get()
+
+            async def ack(unacked=unacked):
+                if unacked:
+                    unacked.release()
+
+            async def reject(requeue, delivery=delivery, unacked=unacked):
+                if requeue:
+                    queue.put_nowait(delivery)
+                if unacked:
+                    unacked.release()
+
+            encoded, headers, properties, expires = delivery
+            if expires is not None and expires <= time.time():
+                # Expired messages are dropped, as RabbitMQ does
+                if unacked:
+                    unacked.release()
+                continue
+            await callback(AioMessage(json.loads(encoded), headers, properties, ack, reject))
+
+
+class AioPikaBroker(object):
+
+    """RabbitMQ broker using aio-pika (install feeder-utilities[aio])."""
+
+    def __init__(self, url):
+        self.url = url
+        self._connection = None
+        self._channels = {}
+        self._queues = {}
+
+    async def connect(self):
+        import aio_pika
+        self._connection = await aio_pika.connect_robust(self.url)
+
+    async def close(self):
+        await self._connection.close()
+
+    async def _channel(self, prefetch_count=None):
+        # One channel per prefetch setting, QoS applies to the whole channel
+        if prefetch_count not in self._channels:
+            channel = await self._connection.channel()
+            if prefetch_count:
+                await channel.set_qos(prefetch_count=prefetch_count)
+            self._channels[prefetch_count] = channel
+        return self._channels[prefetch_count]
+
+    async def declare_queue(self, name=None, exclusive=False):
+        channel = await self._channel()
+        queue = await channel.declare_queue(name, exclusive=exclusive, auto_delete=exclusive, durable=not exclusive)
+        return queue.name
+
+    async def bind(self, queue_name, exchange, routing_key):
+        channel = await self._channel()
+        queue = await channel.get_queue(queue_name)
+        await queue.bind(exchange, routing_key=routing_key)
+
+    async def publish(self, body, exchange='', routing_key='', headers=None, correlation_id=None, reply_to=None,
+                      expiration=None):
+        import aio_pika
+        channel = await self._channel()
+        target = await channel.get_exchange(exchange) if exchange else channel.default_exchange
+        await target.publish(aio_pika.Message(json.dumps(body).encode('utf-8'), headers=headers or {},
+                                              content_type='application/json', correlation_id=correlation_id,
+                                              reply_to=reply_to, expiration=expiration),
+                             routing_key=routing_key)
+
+    async def consume(self, queue_name, callback, prefetch_count=None):
+        channel = await self._channel(prefetch_count)
+        queue = await channel.get_queue(queue_name)
+        self._queues[queue_name] = queue
+
+        async def on_message(message):
+            properties = {'correlation_id': message.correlation_id, 'reply_to': message.reply_to}
+            # Compressed messages (e.g. from publish_message with compression) are decompressed, but only JSON is read
+            await callback(AioMessage(decode_json(message.body, message.headers), message.headers, properties,
+                                      message.ack, lambda requeue: message.reject(requeue=requeue)))
+
+        tag = await queue.consume(on_message)
+        return (queue_name, tag)
+
+    async def cancel(self, tag):
+        queue_name, consumer_tag = tag
+        await self._queues[queue_name].cancel(consumer_tag)
@@ -0,0 +1,56 @@
+import asyncio
+import time
+import uuid
+from feeder_utilities.feeder_rpc_client import DEADLINE_HEADER, merge_chunk
+
+
+class AsyncFeederRpcClient(object):
+
+    """asyncio equivalent of feeder_utilities.feeder_rpc_client.FeederRpcClient.
+
+    One reply queue is declared and consumed for the life of the client, and
+    responses are matched to calls by correlation id, so any number of calls
+    can be outstanding at once.  Chunked responses are reassembled.
+
+    """
+
+    def __init__(self, broker, exchange, routing_key):
+        self.broker = broker
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.callback_queue = None
+        self._pending = {}
+
+    async def on_response(self, message):
+        await message.ack()
+        pending = self._pending.get(message.properties.get('correlation_id'))
+        if pending is None:
+            return
+        future, response = pending
+        response = merge_chunk(response, message.body)
+        if not response.get('success') or response.get('chunk', {'last': True})['last']:
+            response.pop('chunk', None)
+            if not future.done():
+                future.set_result(response)
+        else:
+            self._pending[message.properties['correlation_id']] = (future, response)
+
+    async def call(self, method, timeout=None, **params):
+        if self.callback_queue is None:
+            self.callback_queue = await self.broker.declare_queue(exclusive=True)
+            await self.broker.consume(self.callback_queue, self.on_response)
+        correlation_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._pending[correlation_id] = (future, None)
+        try:
+            publish_options = {}
+            if timeout is not None:
+                # Let the broker drop, and the feeder skip, a request nobody is waiting for any more
+                publish_options['expiration'] = timeout
+                publish_options['headers'] = {DEADLINE_HEADER: time.time() + timeout}
+            await self.broker.publish(dict(params, method=method), exchange=self.exchange,
+                                      routing_key=self.routing_key, reply_to=self.callback_queue,
+                                      correlation_id=correlation_id, **publish_options)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            del self._pending[correlation_id]
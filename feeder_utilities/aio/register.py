@@ -0,0 +1,35 @@
+from feeder_utilities.dependencies.register import republish_result
+from feeder_utilities.entry_ranges import EntryRangeSet
+from feeder_utilities.exceptions import RegisterException
+import json
+
+
+class AsyncRegister:
+
+    """asyncio equivalent of feeder_utilities.dependencies.register.Register using an aiohttp style session."""
+
+    def __init__(self, register_url, routing_key, requests):
+        self.register_url = register_url
+        self.routing_key = routing_key
+        self.requests = requests
+
+    async def max_entry(self):
+        async with self.requests.get(self.register_url + "/register") as response:
+            if response.status != 200:
+                raise RegisterException("Unable to retrieve register information, response was: {}, {}".format(
+                    response.status, await response.text()), response.status)
+            register_info = await response.json()
+        if 'total-entries' not in register_info:
+            raise RegisterException("Register response not recognised, did not contain 'total-entries'")
+        return register_info['total-entries']
+
+    async def republish_entries(self, entries):
+        entries = EntryRangeSet.coerce(entries)
+        async with self.requests.post(self.register_url + "/entries/republish",
+                                      data=json.dumps({"entries": list(entries), "routing_key": self.routing_key}),
+                                      headers={"Content-type": "application/json",
+                                               "Accept": "application/json"}) as response:
+            if response.status != 200:
+                raise RegisterException("Unable to republish enties, response was: {}, {}".format(
+                    response.status, await response.text()), response.status)
+            return republish_result(await response.json())
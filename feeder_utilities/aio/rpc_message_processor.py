@@ -0,0 +1,65 @@
+import asyncio
+import functools
+
+
+class _ThreadMessage(object):
+
+    """Gives a handler thread kombu style ack/reject/requeue on an AioMessage, run on the event loop."""
+
+    def __init__(self, message, loop):
+        self.message = message
+        self.body = message.body
+        self.headers = message.headers
+        self.properties = message.properties
+        self.loop = loop
+
+    @property
+    def payload(self):
+        return self.body
+
+    def _run(self, coroutine):
+        asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def ack(self):
+        self._run(self.message.ack())
+
+    def reject(self, requeue=False):
+        self._run(self.message.reject(requeue=requeue))
+
+    def requeue(self):
+        self._run(self.message.requeue())
+
+
+class AsyncRpcMessageProcessor(object):
+
+    """Answers feeder RPCs for an AsyncWorker with a feeder_utilities.rpc_message_processor.RpcMessageProcessor.
+
+    Pass process_rpc_message as the AsyncWorker's process_rpc_message_func.
+    The processor's methods are blocking, so each RPC is handled on a thread
+    (of `executor`, by default the event loop's) with a requests session
+    (`session`, by default from create_session()) carrying the message's
+    X-Trace-ID, while the message is acked or rejected and the responses are
+    published through `broker` on the event loop.  Responses are plain JSON,
+    whatever the caller accepts.
+
+    """
+
+    def __init__(self, processor, broker, session=None, executor=None):
+        from feeder_utilities.dependencies.session import create_session
+        self.processor = processor
+        self.broker = broker
+        self.session = session or create_session()
+        self.executor = executor
+
+    async def process_rpc_message(self, body, message, requests):
+        from feeder_utilities.dependencies.session import TracedSession
+        loop = asyncio.get_running_loop()
+
+        def publish_reply(rpc_response, reply_to, correlation_id, **publish_options):
+            asyncio.run_coroutine_threadsafe(
+                self.broker.publish(rpc_response, routing_key=reply_to, correlation_id=correlation_id), loop).result()
+
+        traced = TracedSession(self.session, requests.headers['X-Trace-ID'])
+        await loop.run_in_executor(self.executor, functools.partial(
+            self.processor.process_rpc_message, body, _ThreadMessage(message, loop), traced,
+            publish_reply=publish_reply))
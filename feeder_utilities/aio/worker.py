@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import uuid
+
+
+class AsyncTracedSession(object):
+
+    """Per-message view of a shared aiohttp.ClientSession adding the X-Trace-ID header to every request.
+
+    Methods return aiohttp's request context managers, so are used as
+    `async with requests.get(url) as response:`.
+
+    """
+
+    def __init__(self, session, trace_id):
+        self.session = session
+        self.headers = {'X-Trace-ID': trace_id}
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def request(self, method, url, **kwargs):
+        headers = dict(self.headers)
+        headers.update(kwargs.pop('headers', None) or {})
+        return self.session.request(method, url, headers=headers, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+
+class AsyncWorker(object):
+
+    """asyncio equivalent of feeder_utilities.dependencies.rabbitmq.Worker.
+
+    Consumes the named queues and RPC queues from `broker` (an AioPikaBroker,
+    or MemoryBroker in tests), awaiting the process_message_func and
+    process_rpc_message_func coroutines as `func(body, message, requests)`.
+    Up to max_concurrency main queue messages are processed at once; once that
+    many are in flight consumption waits for one to finish.  RPC messages are
+    handled as they arrive.  A message whose function raises is rejected
+    without requeueing (so dead-lettered) and the error logged.  `requests` wraps
+    the shared aiohttp `session` with the message's X-Trace-ID header; if no
+    session is given one is created for the run and closed when it ends.  Use
+    feeder_utilities.aio.rpc_message_processor.AsyncRpcMessageProcessor to
+    answer the feeder RPCs.
+
+    """
+
+    def __init__(self, logger, broker, queue_names, rpc_queue_names, process_message_func=None,
+                 process_rpc_message_func=None, max_concurrency=100, session=None):
+        self.logger = logger
+        self.broker = broker
+        self.queue_names = queue_names
+        self.rpc_queue_names = rpc_queue_names
+        self.process_message_func = process_message_func
+        self.process_rpc_message_func = process_rpc_message_func
+        self.max_concurrency = max_concurrency
+        self.session = session
+        self.in_flight = set()
+        self._semaphore = None
+        self._stopped = None
+        self.logger.info("Async worker created")
+
+    async def run(self):
+        own_session = self.session is None
+        if own_session:
+            import aiohttp
+            self.session = aiohttp.ClientSession()
+        try:
+            await self._run()
+        finally:
+            if own_session:
+                await self.session.close()
+                self.session = None
+
+    async def _run(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._stopped = asyncio.Event()
+        tags = []
+        for queue_name in self.queue_names:
+            tags.append(await self.broker.consume(queue_name, self.handle_message,
+                                                  prefetch_count=self.max_concurrency))
+        for queue_name in self.rpc_queue_names:
+            tags.append(await self.broker.consume(queue_name, self.handle_rpc_message))
+        self.logger.info("Running async worker...")
+        try:
+            await self._stopped.wait()
+        finally:
+            for tag in tags:
+                await self.broker.cancel(tag)
+            if self.in_flight:
+                await asyncio.wait(self.in_flight)
+
+    def stop(self):
+        self._stopped.set()
+
+    async def handle_message(self, message):
+        # Wait for a free slot before taking on another message
+        await self._semaphore.acquire()
+        task = asyncio.ensure_future(self._process(message, self.process_message_func, "message"))
+        self.in_flight.add(task)
+        task.add_done_callback(self._on_done)
+
+    def _on_done(self, task):
+        self.in_flight.discard(task)
+        self._semaphore.release()
+        if not task.cancelled() and task.exception():
+            self.logger.error("Failed to process message: {}".format(repr(task.exception())))
+
+    async def handle_rpc_message(self, message):
+        task = asyncio.ensure_future(self._process(message, self.process_rpc_message_func, "RPC message"))
+        task.add_done_callback(self._on_rpc_done)
+
+    def _on_rpc_done(self, task):
+        if not task.cancelled() and task.exception():
+            self.logger.error("Failed to process RPC message: {}".format(repr(task.exception())))
+
+    async def _process(self, message, func, description):
+        trace_id = message.headers.get("X-Trace-ID", uuid.uuid4().hex)
+        logger_adapter = logging.LoggerAdapter(self.logger, {"trace_id": trace_id})
+        logger_adapter.debug("Handling {}".format(description))
+        if func:
+            try:
+                await func(message.body, message, AsyncTracedSession(self.session, trace_id))
+            except Exception:
+                # Dead-letter it (to the error queue) so its prefetch slot is freed and consumption carries on
+                await message.reject(requeue=False)
+                raise
+        logger_adapter.debug("{} handled".format(description[0].upper() + description[1:]))
@@ -0,0 +1,76 @@
+import json
+import os
+import sqlite3
+import threading
+
+
+class FileCheckpointStore:
+    """Stores the last verified entry number as JSON in a local file.
+
+    The file is written to a temporary file and renamed into place so a crash
+    part way through never leaves a truncated checkpoint behind.
+
+    """
+
+    def __init__(self, path, name='integrity'):
+        self.path = path
+        self.name = name
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path) as checkpoint_file:
+                return json.load(checkpoint_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def get(self):
+        """Return the stored entry number, or None if nothing has been stored yet."""
+        with self._lock:
+            return self._read().get(self.name)
+
+    def set(self, entry):
+        with self._lock:
+            checkpoints = self._read()
+            checkpoints[self.name] = entry
+            temp_path = "{}.tmp".format(self.path)
+            with open(temp_path, 'w') as checkpoint_file:
+                json.dump(checkpoints, checkpoint_file)
+            os.replace(temp_path, self.path)
+
+
+class SqliteCheckpointStore:
+    """Stores the last verified entry number in a SQLite database."""
+
+    def __init__(self, path, name='integrity'):
+        self.path = path
+        self.name = name
+        self._lock = threading.Lock()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS checkpoints (name TEXT PRIMARY KEY, entry INTEGER NOT NULL)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path)
+
+    def get(self):
+        """Return the stored entry number, or None if nothing has been stored yet."""
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT entry FROM checkpoints WHERE name = ?", (self.name,)).fetchone()
+            finally:
+                conn.close()
+        return row[0] if row else None
+
+    def set(self, entry):
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("INSERT OR REPLACE INTO checkpoints (name, entry) VALUES (?, ?)", (self.name, entry))
+            finally:
+                conn.close()
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from feeder_utilities import metrics
+
+LOOKUPS = metrics.counter('feeder_dedup_lookups_total', 'Dedup cache lookups of message keys', ['result'])
+
+
+def message_id_key(body, message):
+    """Key on the message_id property (or header), None if the message has neither."""
+    return message.properties.get('message_id') or message.headers.get('message_id')
+
+
+def entry_number_key(body, message):
+    """Key on the entry_number in the message body, None if it has none."""
+    return body.get('entry_number') if isinstance(body, dict) else None
+
+
+def body_hash_key(body, message):
+    """Key on a hash of the decoded body, so the same content matches whatever the serialisation."""
+    return hashlib.sha256(json.dumps(body, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+class DedupCache(object):
+
+    """Remembers the keys of processed messages so duplicates can be skipped.
+
+    key_func(body, message) gives a message's key (see message_id_key,
+    entry_number_key and body_hash_key), messages with a key of None are never
+    skipped.  Keys are kept for ttl seconds, and at most max_size of them are
+    kept, the least recently seen being dropped first.  Give a store (e.g.
+    SqliteDedupStore) to keep the keys over restarts.
+
+    """
+
+    def __init__(self, key_func=body_hash_key, max_size=100000, ttl=3600, store=None):
+        self.key_func = key_func
+        self.max_size = max_size
+        self.ttl = ttl
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        # Key to expiry time, least recently seen first
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        if store is not None:
+            for key, expires in store.load(time.time(), max_size):
+                self._keys[key] = expires
+
+    def key(self, body, message):
+        key = self.key_func(body, message)
+        # Keys are stored as strings, so they compare the same after a restart
+        return None if key is None else str(key)
+
+    def seen(self, key):
+        """Return whether key has been added and not expired, counting the hit or miss."""
+        with self._lock:
+            expires = self._keys.get(key)
+            if expires is not None and expires <= time.time():
+                del self._keys[key]
+                expires = None
+            if expires is None:
+                self.misses += 1
+            else:
+                self._keys.move_to_end(key)
+                self.hits += 1
+        LOOKUPS.labels('miss' if expires is None else 'hit').inc()
+        return expires is not None
+
+    def add(self, key):
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._keys[key] = expires
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+        if self.store is not None:
+            self.store.add(key, expires)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self._keys), "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None}
+
+
+class SqliteDedupStore(object):
+
+    """Keeps dedup keys and their expiry times in a SQLite database.
+
+    Expired keys are deleted when the store is loaded and every prune_interval
+    keys added.
+
+    """
+
+    def __init__(self, path, prune_interval=1000):
+        self.path = path
+        self.prune_interval = prune_interval
+        self._added = 0
+        self._lock = threading.Lock()
+        # One connection for the life of the store, as keys are added for every message
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS dedup_keys (key TEXT PRIMARY KEY, expires REAL NOT NULL)")
+
+    def load(self, now, limit):
+        """Return up to limit (key, expires) pairs which haven't expired, soonest to expire first."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM dedup_keys WHERE expires <= ?", (now,))
+            rows = self._conn.execute("SELECT key, expires FROM dedup_keys ORDER BY expires DESC LIMIT ?",
+                                      (limit,)).fetchall()
+        return list(reversed(rows))
+
+    def add(self, key, expires):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO dedup_keys (key, expires) VALUES (?, ?)", (key, expires))
+            self._added += 1
+            if self._added % self.prune_interval == 0:
+                self._conn.execute("DELETE FROM dedup_keys WHERE expires <= ?", (time.time(),))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,5 +1,17 @@
+from concurrent.futures import ThreadPoolExecutor
+from feeder_utilities.entry_ranges import EntryRangeSet
 from feeder_utilities.exceptions import RegisterException
+from feeder_utilities.jobs import report_progress
+from feeder_utilities.rate_limit import TokenBucket
+from feeder_utilities import metrics
 import json
+import requests
+import time
+
+REQUESTS = metrics.counter('feeder_register_requests_total', 'Requests made to the register',
+                           ['operation', 'outcome'])
+REQUEST_SECONDS = metrics.histogram('feeder_register_request_seconds', 'Seconds taken by register requests',
+                                    ['operation'])
 
 
 class Register:
@@ -10,20 +22,110 @@ class Register:
         self.requests = requests
 
     def max_entry(self):
-        response = self.requests.get(self.register_url + "/register")
+        response = self._request('max_entry', 'get', self.register_url + "/register")
         if response.status_code != 200:
             raise RegisterException("Unable to retrieve register information, response was: {}, {}".format(
-                response.status_code, response.text))
+                response.status_code, response.text), response.status_code)
         register_info = response.json()
         if 'total-entries' not in register_info:
             raise RegisterException("Register response not recognised, did not contain 'total-entries'")
         return register_info['total-entries']
 
-    def republish_entries(self, entries):
-        response = self.requests.post(self.register_url + "/entries/republish",
-                                      data=json.dumps({"entries": entries, "routing_key": self.routing_key}),
-                                      headers={"Content-type": "application/json", "Accept": "application/json"})
+    def republish_entries(self, entries, chunk_size=None, max_workers=1, rate_limit=None, retries=3,
+                          backoff=1):
+        """Ask the register to republish entries, a list of entry numbers or an EntryRangeSet.
+
+        The entries_not_found and republished_entries in the register's response
+        are returned as EntryRangeSets.
+
+        With chunk_size, entries are posted in chunks of at most that many, with
+        up to max_workers requests in flight and at most rate_limit requests per
+        second.  A chunk which fails transiently (connection errors, timeouts and
+        5xx responses) is retried up to `retries` times, waiting backoff * 2^n
+        seconds between attempts, other failures are not retried.  The merged result also has
+        failed_entries (chunks which never succeeded) and per chunk timings, so a
+        partial fix is reported rather than lost.
+
+        """
+        entries = EntryRangeSet.coerce(entries)
+        if not chunk_size:
+            return self._republish(entries)
+
+        bucket = TokenBucket(rate_limit) if rate_limit else None
+        chunks_total = -(-len(entries) // chunk_size)
+        chunks = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for chunk in executor.map(lambda indexed: self._republish_chunk(indexed[0], indexed[1], bucket,
+                                                                            retries, backoff),
+                                      enumerate(entries.chunks(chunk_size))):
+                chunks.append(chunk)
+                report_progress(chunks_done=len(chunks), chunks_total=chunks_total)
+        result = {"entries_not_found": EntryRangeSet(), "republished_entries": EntryRangeSet(),
+                  "failed_entries": EntryRangeSet(), "chunks": []}
+        for chunk, chunk_result, timing in chunks:
+            if chunk_result is None:
+                result["failed_entries"] |= chunk
+            else:
+                result["entries_not_found"] |= chunk_result.get("entries_not_found", EntryRangeSet())
+                result["republished_entries"] |= chunk_result.get("republished_entries", EntryRangeSet())
+            result["chunks"].append(timing)
+        return result
+
+    def _republish_chunk(self, index, chunk, bucket, retries, backoff):
+        started = time.monotonic()
+        attempts = 0
+        while True:
+            attempts += 1
+            if bucket:
+                bucket.acquire()
+            try:
+                chunk_result = self._republish(chunk)
+                error = None
+                break
+            except Exception as e:
+                if attempts > retries or not is_transient(e):
+                    chunk_result = None
+                    error = repr(e)
+                    break
+                time.sleep(backoff * 2 ** (attempts - 1))
+        timing = {"index": index, "count": len(chunk), "attempts": attempts,
+                  "elapsed_seconds": round(time.monotonic() - started, 3)}
+        if error:
+            timing["error"] = error
+        return chunk, chunk_result, timing
+
+    def _request(self, operation, method, url, **kwargs):
+        """Make a request to the register, recording it in the register metrics."""
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            response = getattr(self.requests, method)(url, **kwargs)
+            if response.status_code == 200:
+                outcome = 'success'
+            return response
+        finally:
+            REQUEST_SECONDS.labels(operation).observe(time.perf_counter() - started)
+            REQUESTS.labels(operation, outcome).inc()
+
+    def _republish(self, entries):
+        response = self._request('republish', 'post', self.register_url + "/entries/republish",
+                                 data=json.dumps({"entries": list(entries), "routing_key": self.routing_key}),
+                                 headers={"Content-type": "application/json", "Accept": "application/json"})
         if response.status_code != 200:
             raise RegisterException("Unable to republish enties, response was: {}, {}".format(
-                response.status_code, response.text))
-        return response.json()
+                response.status_code, response.text), response.status_code)
+        return republish_result(response.json())
+
+
+def is_transient(exception):
+    """Whether a failed register request may succeed if retried."""
+    if isinstance(exception, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    return isinstance(exception, RegisterException) and (exception.status_code or 0) >= 500
+
+
+def republish_result(result):
+    for key in ('entries_not_found', 'republished_entries'):
+        if key in result:
+            result[key] = EntryRangeSet.coerce(result[key])
+    return result
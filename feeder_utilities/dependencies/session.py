@@ -0,0 +1,82 @@
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def create_session(pool_size=10, retries=3, backoff_factor=0.5, status_forcelist=(502, 503, 504)):
+    """Create a requests.Session with a connection pool sized for pool_size concurrent requests.
+
+    Idempotent requests are retried up to `retries` times with exponential
+    backoff on connection errors and the statuses in `status_forcelist`.  If
+    the status persists the last response is returned, as it would be without
+    retries, rather than raising.
+
+    """
+    retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=status_forcelist,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class TracedSession(object):
+
+    """Lightweight per-message view of a shared, long-lived requests.Session.
+
+    Every request made through it carries the message's X-Trace-ID header and,
+    if given, a default timeout, while connections come from the shared
+    session's pool.  Headers can be added per message via `headers` without
+    affecting the shared session; anything else is passed through to it.  The
+    number of requests made and the seconds spent in them are kept in
+    http_requests and http_seconds.
+
+    """
+
+    def __init__(self, session, trace_id, timeout=None):
+        self.session = session
+        self.headers = {'X-Trace-ID': trace_id}
+        self.timeout = timeout
+        self.http_requests = 0
+        self.http_seconds = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def request(self, method, url, **kwargs):
+        headers = dict(self.headers)
+        headers.update(kwargs.pop('headers', None) or {})
+        if self.timeout is not None:
+            kwargs.setdefault('timeout', self.timeout)
+        started = time.perf_counter()
+        try:
+            return self.session.request(method, url, headers=headers, **kwargs)
+        finally:
+            self.http_requests += 1
+            self.http_seconds += time.perf_counter() - started
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('GET', url, **kwargs)
+
+    def options(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('OPTIONS', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        return self.request('HEAD', url, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request('POST', url, data=data, json=json, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request('PUT', url, data=data, **kwargs)
+
+    def patch(self, url, data=None, **kwargs):
+        return self.request('PATCH', url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
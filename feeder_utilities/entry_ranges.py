@@ -0,0 +1,137 @@
+import bisect
+import itertools
+
+
+class EntryRangeSet(object):
+
+    """An immutable set of entry numbers stored as sorted, non-overlapping runs.
+
+    Memory, log output and the JSON form scale with the number of runs (gaps)
+    rather than the number of entries.  Runs are inclusive (start, end) pairs.
+
+        >>> missing = EntryRangeSet.from_entries([1, 2, 3, 7, 9, 10])
+        >>> str(missing)
+        '1-3,7,9-10'
+        >>> missing.to_json()
+        {'ranges': [[1, 3], [7, 7], [9, 10]], 'count': 6}
+
+    """
+
+    def __init__(self, ranges=()):
+        self._ranges = self._merge(sorted((int(start), int(end)) for start, end in ranges if start <= end))
+        self._starts = [start for start, _ in self._ranges]
+        self._count = sum(end - start + 1 for start, end in self._ranges)
+
+    @staticmethod
+    def _merge(ranges):
+        merged = []
+        for start, end in ranges:
+            if merged and start <= merged[-1][1] + 1:
+                if end > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        return merged
+
+    @classmethod
+    def from_entries(cls, entries):
+        """Build from an iterable of entry numbers, in any order."""
+        ranges = []
+        for entry in sorted(set(entries)):
+            if ranges and entry == ranges[-1][1] + 1:
+                ranges[-1][1] = entry
+            else:
+                ranges.append([entry, entry])
+        return cls(ranges)
+
+    @classmethod
+    def from_json(cls, data):
+        """Build from the to_json() form, or a plain list of entry numbers."""
+        if isinstance(data, dict):
+            return cls(data['ranges'])
+        return cls.from_entries(data)
+
+    @classmethod
+    def coerce(cls, entries):
+        """Return entries as an EntryRangeSet, accepting an EntryRangeSet, to_json() form or iterable of entries."""
+        if isinstance(entries, cls):
+            return entries
+        if entries is None:
+            return cls()
+        return cls.from_json(entries)
+
+    def to_json(self):
+        return {"ranges": [[start, end] for start, end in self._ranges], "count": self._count}
+
+    def ranges(self):
+        return list(self._ranges)
+
+    def chunks(self, size):
+        """Yield EntryRangeSets of at most size entries each, in order."""
+        chunk = []
+        remaining = size
+        for start, end in self._ranges:
+            while start <= end:
+                chunk_end = min(end, start + remaining - 1)
+                chunk.append((start, chunk_end))
+                remaining -= chunk_end - start + 1
+                start = chunk_end + 1
+                if not remaining:
+                    yield EntryRangeSet(chunk)
+                    chunk = []
+                    remaining = size
+        if chunk:
+            yield EntryRangeSet(chunk)
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(range(start, end + 1) for start, end in self._ranges)
+
+    def __len__(self):
+        return self._count
+
+    def __bool__(self):
+        return bool(self._ranges)
+
+    def __contains__(self, entry):
+        index = bisect.bisect_right(self._starts, entry) - 1
+        return index >= 0 and self._ranges[index][1] >= entry
+
+    def __eq__(self, other):
+        return isinstance(other, EntryRangeSet) and self._ranges == other._ranges
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(tuple(self._ranges))
+
+    def union(self, other):
+        return EntryRangeSet(self._ranges + EntryRangeSet.coerce(other)._ranges)
+
+    def difference(self, other):
+        other_ranges = EntryRangeSet.coerce(other)._ranges
+        result = []
+        index = 0
+        for start, end in self._ranges:
+            # Skip removed runs wholly before this one
+            while index < len(other_ranges) and other_ranges[index][1] < start:
+                index += 1
+            position = index
+            while start <= end and position < len(other_ranges) and other_ranges[position][0] <= end:
+                remove_start, remove_end = other_ranges[position]
+                if remove_start > start:
+                    result.append((start, remove_start - 1))
+                start = max(start, remove_end + 1)
+                position += 1
+            if start <= end:
+                result.append((start, end))
+        return EntryRangeSet(result)
+
+    __or__ = union
+    __sub__ = difference
+
+    def __str__(self):
+        return ",".join(str(start) if start == end else "{}-{}".format(start, end) for start, end in self._ranges)
+
+    def __repr__(self):
+        return "EntryRangeSet({!r})".format(self._ranges)
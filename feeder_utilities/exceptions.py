@@ -4,4 +4,16 @@ class RpcMessageProcessingException(Exception):
 
 
 class RegisterException(Exception):
+
+    def __init__(self, message, status_code=None):
+        super(RegisterException, self).__init__(message)
+        # Status of the register's response, when it was an error response
+        self.status_code = status_code
+
+
+class ErrorQueueException(Exception):
+    pass
+
+
+class RpcTimeoutException(Exception):
     pass
@@ -1,59 +1,397 @@
 import argparse
+import json
+import socket
 import sys
-from kombu import Connection, Producer, Consumer, Queue, uuid
+import time
+import uuid
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+from feeder_utilities.exceptions import RpcTimeoutException
+from feeder_utilities import serialization
+# kombu is imported where it is used, so the command line starts quickly and e.g. argument errors and --help don't
+# wait for it to load
 
-ALLOWED_METHODS = ['health', 'integrity_check', 'integrity_fix', 'dump_error_queue', 'requeue_errors', 'delete_errors']
+# Header carrying the time (seconds since the epoch) after which the caller no longer wants a response
+DEADLINE_HEADER = 'x-deadline'
+# Exit code of feeder-rpc-client when the feeder did not respond in time, as timeout(1) uses (argparse uses 2)
+TIMEOUT_EXIT_CODE = 124
+
+
+def is_last_response(response):
+    return not response.get('success') or response.get('chunk', {'last': True})['last']
+
+
+class _PendingCall(object):
+
+    def __init__(self, correlation_id, stream=False, timeout=None, target=None):
+        self.correlation_id = correlation_id
+        # Where the call was sent, for errors
+        self.target = target
+        self.timeout = timeout
+        # time.monotonic() deadline for the response, if any
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.future = Future()
+        # Streamed calls keep each response for iter_call, otherwise chunks are merged as they arrive
+        self.stream = stream
+        self.responses = deque()
+        self.response = None
+        self.sent_at = time.monotonic()
+        # Seconds from sending the call to its last response arriving
+        self.elapsed_seconds = None
 
 
 class FeederRpcClient(object):
 
-    def __init__(self, connection, exchange, routing_key):
+    """Client for the RPC methods of a feeder (or many feeders on the same broker).
+
+    One exclusive reply queue is declared and consumed for the life of the client,
+    and responses are matched to calls by correlation id, so any number of calls
+    can be outstanding at once.  The client is not thread safe, use one per thread.
+
+    """
+
+    def __init__(self, connection, exchange, routing_key, allowed_methods=None):
+        from kombu import Queue
         self.connection = connection
-        self.callback_queue = Queue(uuid(), exclusive=True, auto_delete=True)
+        # Methods which may be called, None (the default) sends any and leaves the feeder to reject unknown ones
+        self.allowed_methods = allowed_methods
+        self.callback_queue = Queue(uuid.uuid4().hex, exclusive=True, auto_delete=True)
         self.exchange = exchange
         self.routing_key = routing_key
-        self.response = None
-        self.correlation_id = None
+        self.pending = {}
+        self.producer = None
+        self.consumer = None
+        # Sent with each call so the feeder can reply with msgpack or compression, if it's configured to
+        self.accept = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        """Start consuming from the reply queue, done on the first call."""
+        if self.consumer is None:
+            from kombu import Producer, Consumer
+            self.accept = serialization.accept_header()
+            self.producer = Producer(self.connection)
+            self.consumer = Consumer(self.connection, on_message=self.on_response,
+                                     queues=[self.callback_queue], no_ack=True)
+            self.consumer.consume()
+
+    def close(self):
+        if self.consumer is not None:
+            self.consumer.cancel()
+            self.consumer = None
+            self.producer = None
 
     def on_response(self, message):
-        if message.properties['correlation_id'] == self.correlation_id:
-            self.response = message.payload
+        pending = self.pending.get(message.properties.get('correlation_id'))
+        if pending is None:
+            # Reply to a call which has already timed out, or to another client
+            return
+        if pending.stream:
+            pending.responses.append(message.payload)
+        else:
+            pending.response = merge_chunk(pending.response, message.payload)
+        if is_last_response(message.payload):
+            del self.pending[pending.correlation_id]
+            pending.elapsed_seconds = time.monotonic() - pending.sent_at
+            if pending.stream:
+                pending.future.set_result(message.payload)
+            else:
+                pending.response.pop('chunk', None)
+                pending.future.set_result(pending.response)
 
-    def call(self, method):
-        if method not in ALLOWED_METHODS:
+    def send(self, method, routing_key=None, exchange=None, timeout=None, **params):
+        """Send a call to the feeder without waiting, returning a concurrent.futures.Future for the response.
+
+        The future is completed while waiting for other calls (call, call_many or
+        wait) on this client, as the responses are consumed.  With a timeout the
+        request expires on the broker, and is skipped by the feeder, once it passes,
+        and the future fails with RpcTimeoutException.
+
+        """
+        return self._send(method, exchange, routing_key, params, timeout=timeout).future
+
+    def _send(self, method, exchange, routing_key, params, stream=False, timeout=None):
+        if self.allowed_methods is not None and method not in self.allowed_methods:
             raise Exception("Method '{}' not allowed".format(method))
-        self.response = None
-        self.correlation_id = uuid()
-        with Producer(self.connection) as producer:
-            producer.publish(
-                {'method': method},
-                exchange=self.exchange,
-                routing_key=self.routing_key,
-                declare=[self.callback_queue],
-                reply_to=self.callback_queue.name,
-                correlation_id=self.correlation_id,
-            )
-        with Consumer(self.connection,
-                      on_message=self.on_response,
-                      queues=[self.callback_queue], no_ack=True):
-            while self.response is None:
+        self.start()
+        publish_options = {'headers': {serialization.ACCEPT_HEADER: self.accept}}
+        if timeout is not None:
+            # The broker drops the request if it is still queued at the deadline, and the feeder
+            # skips it if it is picked up after the deadline (e.g. from a prefetched backlog)
+            publish_options['expiration'] = timeout
+            publish_options['headers'][DEADLINE_HEADER] = time.time() + timeout
+        target = self.routing_key if routing_key is None else routing_key
+        if exchange is not None:
+            target = '/'.join((exchange, target))
+        pending = _PendingCall(uuid.uuid4().hex, stream, timeout, target)
+        self.pending[pending.correlation_id] = pending
+        self.producer.publish(
+            dict(params, method=method),
+            exchange=self.exchange if exchange is None else exchange,
+            routing_key=self.routing_key if routing_key is None else routing_key,
+            reply_to=self.callback_queue.name,
+            correlation_id=pending.correlation_id,
+            **publish_options
+        )
+        return pending
+
+    def _timeout_exception(self, pending):
+        return RpcTimeoutException("No response from '{}' within {} seconds".format(pending.target, pending.timeout))
+
+    def _expire(self, pending):
+        """Stop waiting for a call, raising RpcTimeoutException."""
+        self.pending.pop(pending.correlation_id, None)
+        raise self._timeout_exception(pending)
+
+    def _fail_expired(self):
+        """Stop waiting for the calls whose deadline has passed, failing their futures with RpcTimeoutException."""
+        now = time.monotonic()
+        for pending in [pending for pending in self.pending.values()
+                        if pending.deadline is not None and pending.deadline <= now]:
+            del self.pending[pending.correlation_id]
+            pending.future.set_exception(self._timeout_exception(pending))
+
+    def _drain_until(self, done, deadline=None):
+        """Consume responses until done() is true, returns False if the deadline passed first.
+
+        Meanwhile any call on this client whose own deadline passes is failed, so e.g.
+        a timed out send() doesn't keep waiting for its response for ever.
+
+        """
+        while True:
+            self._fail_expired()
+            if done():
+                return True
+            now = time.monotonic()
+            if deadline is not None and deadline <= now:
+                return False
+            # Wake for the earliest deadline, ours or a pending call's
+            deadlines = [pending.deadline for pending in self.pending.values() if pending.deadline is not None]
+            if deadline is not None:
+                deadlines.append(deadline)
+            if not deadlines:
                 self.connection.drain_events()
-        return self.response
+                continue
+            try:
+                self.connection.drain_events(timeout=min(deadlines) - now)
+            except socket.timeout:
+                pass
+
+    def wait(self, futures, timeout=None):
+        """Wait for the futures returned by send, returns the set of those not done in time.
+
+        The futures of calls whose own timeout passes are done, failing with
+        RpcTimeoutException.
+
+        """
+        futures = list(futures)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waiting = set(futures)
+        calls = [pending for pending in self.pending.values() if pending.future in waiting]
+        if calls and all(pending.deadline is not None for pending in calls):
+            # Nothing to wait for once the last of the calls has timed out
+            latest = max(pending.deadline for pending in calls)
+            deadline = latest if deadline is None else min(deadline, latest)
+        self._drain_until(lambda: all(future.done() for future in futures), deadline)
+        return set(future for future in futures if not future.done())
+
+    def discover_methods(self, timeout=None):
+        """Ask the feeder which methods it provides (including its own) and only allow calling those."""
+        response = self.call('list_methods', timeout=timeout)
+        if not response['success']:
+            raise Exception("Failed to list feeder methods: {}".format(response['error']))
+        self.allowed_methods = response['result']['methods']
+        return self.allowed_methods
+
+    def call(self, method, timeout=None, **params):
+        """Call method on the feeder, any params are sent alongside it in the message body.
+
+        Chunked (streamed) responses are reassembled into a single response.  Raises
+        RpcTimeoutException if the whole response has not arrived within timeout
+        seconds.
+
+        """
+        pending = self._send(method, None, None, params, timeout=timeout)
+        if not self._drain_until(pending.future.done, pending.deadline):
+            self._expire(pending)
+        return pending.future.result()
+
+    def iter_call(self, method, timeout=None, **params):
+        """Call method on the feeder, yielding each response message as it arrives.
+
+        Methods which stream their result (e.g. dump_error_queue with chunk_size)
+        yield one response per chunk, otherwise the single response is yielded.
+        Raises RpcTimeoutException if the last response has not arrived within
+        timeout seconds.
+
+        """
+        pending = self._send(method, None, None, params, stream=True, timeout=timeout)
+        while True:
+            if not self._drain_until(lambda: pending.responses, pending.deadline):
+                self._expire(pending)
+            response = pending.responses.popleft()
+            yield response
+            if is_last_response(response):
+                break
+
+    def call_many(self, targets, method, timeout=None, **params):
+        """Call method on several feeders at once and gather their responses.
+
+        targets are routing keys on this client's exchange, or (exchange, routing_key)
+        tuples.  All calls are sent before waiting, so the whole call takes about as
+        long as the slowest feeder.  Returns a dict of target to response; a feeder
+        which has not responded within timeout seconds gets a failure response.
+
+        """
+        return OrderedDict((target, response) for target, (response, _) in
+                           self._call_many(targets, method, timeout, params).items())
+
+    def _call_many(self, targets, method, timeout, params):
+        """Returns a dict of target to (response, elapsed_seconds), elapsed_seconds is None on timeout."""
+        calls = OrderedDict()
+        for target in targets:
+            exchange, routing_key = target if isinstance(target, tuple) else (None, target)
+            calls[target] = self._send(method, exchange, routing_key, params, timeout=timeout)
+        deadline = max(pending.deadline for pending in calls.values()) if timeout is not None and calls else None
+        self._drain_until(lambda: all(pending.future.done() for pending in calls.values()), deadline)
+
+        responses = OrderedDict()
+        for target, pending in calls.items():
+            if not pending.future.done():
+                try:
+                    self._expire(pending)
+                except RpcTimeoutException as e:
+                    pending.future.set_exception(e)
+            try:
+                responses[target] = (pending.future.result(), pending.elapsed_seconds)
+            except RpcTimeoutException as e:
+                responses[target] = ({"success": False, "result": None, "error": {"error_message": str(e)}}, None)
+        return responses
+
+
+def read_fleet(fleet_file):
+    """Read feeders from a file of 'exchange routing_key' lines, blank lines and # comments are ignored."""
+    feeders = []
+    for line_number, line in enumerate(fleet_file, 1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        fields = line.split()
+        if len(fields) != 2:
+            raise ValueError("Line {} of fleet file should be 'exchange routing_key', got '{}'".format(
+                line_number, line))
+        feeders.append((fields[0], fields[1]))
+    return feeders
+
+
+def call_fleet(client, feeders, method, timeout=None, **params):
+    """Call method on every (exchange, routing_key) in feeders at once.
+
+    Returns a summary per feeder, in the order given: exchange, routing_key,
+    success, timed_out, elapsed_seconds, status (for health), error and result.
+
+    """
+    summaries = []
+    for (exchange, routing_key), (response, elapsed_seconds) in client._call_many(
+            feeders, method, timeout, params).items():
+        result = response.get('result')
+        error = response.get('error')
+        summaries.append({
+            "exchange": exchange,
+            "routing_key": routing_key,
+            "success": bool(response.get('success')),
+            "timed_out": elapsed_seconds is None,
+            "elapsed_seconds": None if elapsed_seconds is None else round(elapsed_seconds, 3),
+            "status": result.get('status') if method == 'health' and isinstance(result, dict) else None,
+            "error": error.get('error_message') if isinstance(error, dict) else error,
+            "result": result})
+    return summaries
+
+
+def format_fleet_table(summaries):
+    rows = [("EXCHANGE", "ROUTING KEY", "OK", "SECONDS", "STATUS / ERROR")]
+    for summary in summaries:
+        rows.append((summary["exchange"], summary["routing_key"],
+                     "yes" if summary["success"] else "no",
+                     "-" if summary["elapsed_seconds"] is None else "{:.3f}".format(summary["elapsed_seconds"]),
+                     summary["error"] or summary["status"] or ""))
+    widths = [max(len(row[column]) for row in rows) for column in range(4)]
+    return "\n".join("  ".join([value.ljust(width) for value, width in zip(row, widths)] + [row[4]]).rstrip()
+                     for row in rows)
+
+
+def fleet_exit_code(summaries, method):
+    """1 if any feeder failed (or is not healthy), TIMEOUT_EXIT_CODE if the only failures were timeouts, else 0."""
+    failed = [summary for summary in summaries
+              if not summary["success"] or (method == 'health' and summary["status"] != "OK")]
+    if not failed:
+        return 0
+    if all(summary["timed_out"] for summary in failed):
+        return TIMEOUT_EXIT_CODE
+    return 1
+
+
+def merge_chunk(response, chunk):
+    """Merge a chunked response into the response so far, extending any list results."""
+    if response is None or not chunk.get('success'):
+        return chunk
+    for key, value in (chunk.get('result') or {}).items():
+        if isinstance(value, list) and isinstance(response['result'].get(key), list):
+            response['result'][key].extend(value)
+        else:
+            response['result'][key] = value
+    response['chunk'] = chunk.get('chunk')
+    return response
+
+
+def parse_param(param):
+    name, sep, value = param.partition('=')
+    if not name or not sep:
+        raise argparse.ArgumentTypeError("Parameter '{}' must be in the form name=value".format(param))
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    return name, value
 
 
 def main():
 
     parser = argparse.ArgumentParser(description='Send feeder RPC commands')
-    parser.add_argument('-m', help='method to call on feeder, one of {}'.format(ALLOWED_METHODS), dest='method',
-                        required=True)
+    parser.add_argument('-m', help='method to call on feeder, e.g. health (list_methods lists the methods the feeder '
+                        'provides)', dest='method', required=True)
     parser.add_argument('-c', help='rabbitmq connection string', dest='connection', required=True)
-    parser.add_argument('-x', help='rabbitmq exchange name', dest='exchange', required=True)
-    parser.add_argument('-r', help='rabbitmq routing key', dest='routing_key', required=True)
+    parser.add_argument('-x', help='rabbitmq exchange name', dest='exchange')
+    parser.add_argument('-r', help='rabbitmq routing key', dest='routing_key')
+    parser.add_argument('-f', '--fleet', help="file of 'exchange routing_key' lines, calls the method on all of "
+                        "these feeders at once instead of -x/-r", dest='fleet', type=argparse.FileType('r'))
+    parser.add_argument('-o', help='fleet output format (default table)', dest='output', choices=['table', 'json'],
+                        default='table')
+    parser.add_argument('-t', help='seconds to wait for the feeder to respond, 0 to wait forever (default 60), exits '
+                        'with code {} if there is no response in time'.format(TIMEOUT_EXIT_CODE), dest='timeout',
+                        type=float, default=60)
+    parser.add_argument('-p', help='method parameter as name=value, value is parsed as JSON if possible '
+                        '(e.g. -p bulk=true -p batch_size=1000), may be repeated', dest='params',
+                        action='append', default=[], type=parse_param)
     args = parser.parse_args()
+    if args.fleet:
+        sys.exit(fleet_main(args))
+    if not args.exchange or not args.routing_key:
+        parser.error("-x and -r are required unless --fleet is given")
+    from kombu import Connection
     connection = Connection(args.connection)
     feeder_rpc = FeederRpcClient(connection, args.exchange, args.routing_key)
     print("Sending method request to feeder")
-    response = feeder_rpc.call(args.method)
+    try:
+        response = feeder_rpc.call(args.method, timeout=args.timeout or None, **dict(args.params))
+    except RpcTimeoutException as e:
+        print(e)
+        sys.exit(TIMEOUT_EXIT_CODE)
     print("Response from feeder was:")
     print(response)
     if not response['success']:
@@ -62,5 +400,21 @@ def main():
         sys.exit(1)
 
 
+def fleet_main(args):
+    from kombu import Connection
+    with args.fleet as fleet_file:
+        feeders = read_fleet(fleet_file)
+    with Connection(args.connection) as connection:
+        with FeederRpcClient(connection, None, None) as feeder_rpc:
+            summaries = call_fleet(feeder_rpc, feeders, args.method, timeout=args.timeout or None,
+                                   **dict(args.params))
+    if args.output == 'json':
+        for summary in summaries:
+            print(json.dumps(summary))
+    else:
+        print(format_fleet_table(summaries))
+    return fleet_exit_code(summaries, args.method)
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,121 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+_current = threading.local()
+
+
+def current_job():
+    """Return the Job running in this thread, or None outside of a background job."""
+    return getattr(_current, 'job', None)
+
+
+def report_progress(**counters):
+    """Update the progress counters of the job running in this thread, does nothing outside of a job."""
+    job = current_job()
+    if job is not None:
+        job.update_progress(**counters)
+
+
+class Job(object):
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    def __init__(self, method):
+        self.job_id = uuid.uuid4().hex
+        self.method = method
+        self.status = Job.QUEUED
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in (Job.SUCCEEDED, Job.FAILED)
+
+    def update_progress(self, **counters):
+        with self._lock:
+            self.progress.update(counters)
+
+    def run(self, func, *args):
+        _current.job = self
+        self.started_at = time.time()
+        self.status = Job.RUNNING
+        try:
+            self.result = func(*args)
+            self.status = Job.SUCCEEDED
+        except Exception as e:
+            self.error = {"error_message": "Exception occured: {}".format(repr(e))}
+            self.status = Job.FAILED
+            raise
+        finally:
+            self.finished_at = time.time()
+            _current.job = None
+
+    def to_json(self):
+        with self._lock:
+            progress = dict(self.progress)
+        return {"job_id": self.job_id, "method": self.method, "status": self.status, "progress": progress,
+                "error": self.error, "submitted_at": self.submitted_at, "started_at": self.started_at,
+                "finished_at": self.finished_at}
+
+
+class JobManager(object):
+
+    """Runs functions as background jobs on a thread pool, keeping their status and result.
+
+    Only the most recent max_finished finished jobs are kept; older ones are
+    forgotten as new jobs finish.
+
+    """
+
+    def __init__(self, logger, max_workers=1, max_finished=100):
+        self.logger = logger
+        self.max_finished = max_finished
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, method, func, *args):
+        job = Job(method)
+        with self._lock:
+            self.jobs[job.job_id] = job
+        self.logger.info("Starting background job {} for '{}'".format(job.job_id, method))
+        self._executor.submit(self._run, job, func, *args)
+        return job
+
+    def _run(self, job, func, *args):
+        try:
+            job.run(func, *args)
+            self.logger.info("Background job {} for '{}' succeeded".format(job.job_id, job.method))
+        except Exception:
+            self.logger.exception("Background job {} for '{}' failed".format(job.job_id, job.method))
+        finally:
+            self._forget_finished()
+
+    def _forget_finished(self):
+        with self._lock:
+            finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+            for job_id in finished[:max(len(finished) - self.max_finished, 0)]:
+                del self.jobs[job_id]
+
+    def get(self, job_id):
+        """Return the job, or None if there is no such job (or it has been forgotten)."""
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self.jobs.values())
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,291 @@
+import bisect
+import threading
+import time
+
+# Latency buckets (seconds) used by histograms unless others are given
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in labels) + '}'
+
+
+class _Metric(object):
+
+    """Base for metrics with optional labels.
+
+    A metric without labelnames is updated directly; one with labelnames is
+    updated through the child returned by labels(), e.g.
+    `counter.labels(consumer='rpc').inc()`.  Children are created on first use
+    and kept, so hot paths can hold on to them.
+
+    """
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        if len(values) != len(self.labelnames):
+            raise ValueError("Metric '{}' has labels {}".format(self.name, self.labelnames))
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _samples(self):
+        """Yield (labels, child) pairs, labels being a tuple of (name, value) pairs."""
+        with self._lock:
+            children = sorted(self._children.items())
+        for values, child in children:
+            yield tuple(zip(self.labelnames, values)), child
+
+    def expose(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name,
+                                                                                             self.type_name)]
+        for labels, child in self._samples():
+            lines.extend(child.expose(self.name, labels))
+        return lines
+
+    def to_json(self):
+        return {"type": self.type_name, "help": self.documentation,
+                "samples": [dict(child.to_json(), labels=dict(labels)) for labels, child in self._samples()]}
+
+    def _unlabelled(self):
+        if self.labelnames:
+            raise ValueError("Metric '{}' has labels {}, use labels()".format(self.name, self.labelnames))
+        return self._children[()]
+
+
+class _CounterChild(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def expose(self, name, labels):
+        return ['{}{} {}'.format(name, _format_labels(labels), _format_value(self.value))]
+
+    def to_json(self):
+        return {"value": self.value}
+
+
+class Counter(_Metric):
+
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._unlabelled().inc(amount)
+
+
+class _GaugeChild(_CounterChild):
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+
+class Gauge(_Metric):
+
+    type_name = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount=1):
+        self._unlabelled().inc(amount)
+
+    def dec(self, amount=1):
+        self._unlabelled().dec(amount)
+
+    def set(self, value):
+        self._unlabelled().set(value)
+
+
+class _HistogramChild(object):
+
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        # Observations per bucket (not cumulative), the last is for +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """Context manager observing the seconds taken by its block."""
+        return _Timer(self)
+
+    def _cumulative(self):
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = []
+        running = 0
+        for bound, bucket_count in zip(list(self.buckets) + [float('inf')], counts):
+            running += bucket_count
+            cumulative.append((bound, running))
+        return cumulative, total, count
+
+    def expose(self, name, labels):
+        cumulative, total, count = self._cumulative()
+        lines = ['{}_bucket{} {}'.format(name, _format_labels(labels + (('le', _format_value(float(bound))),)),
+                                         bucket_count)
+                 for bound, bucket_count in cumulative]
+        lines.append('{}_sum{} {}'.format(name, _format_labels(labels), _format_value(total)))
+        lines.append('{}_count{} {}'.format(name, _format_labels(labels), count))
+        return lines
+
+    def to_json(self):
+        cumulative, total, count = self._cumulative()
+        return {"buckets": [[_format_value(float(bound)), bucket_count] for bound, bucket_count in cumulative],
+                "sum": total, "count": count}
+
+
+class _Timer(object):
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class Histogram(_Metric):
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super(Histogram, self).__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._unlabelled().observe(value)
+
+    def time(self):
+        return self._unlabelled().time()
+
+
+class Registry(object):
+
+    """A set of metrics, exposed together in the Prometheus text format or as JSON."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.metrics = {}
+
+    def get_or_create(self, cls, name, documentation, labelnames=(), **kwargs):
+        """Return the metric called name, creating it if it doesn't exist yet."""
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError("Metric '{}' already exists with a different type or labels".format(name))
+            return metric
+
+    def expose(self):
+        """Return all the metrics in the Prometheus text exposition format."""
+        lines = []
+        for name in sorted(self.metrics):
+            lines.extend(self.metrics[name].expose())
+        return '\n'.join(lines) + '\n'
+
+    def to_json(self):
+        return {name: self.metrics[name].to_json() for name in sorted(self.metrics)}
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=(), registry=REGISTRY):
+    return registry.get_or_create(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=(), registry=REGISTRY):
+    return registry.get_or_create(Gauge, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+    return registry.get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def start_http_server(port, addr='127.0.0.1', registry=REGISTRY):
+    """Serve the registry's metrics in the Prometheus text format on a daemon thread, returns the server.
+
+    Every path returns the metrics; call the server's shutdown() to stop it.
+
+    """
+    # Imported here as only processes serving metrics need the HTTP server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            body = registry.expose().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((addr, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,103 @@
+import cProfile
+import logging
+import os
+import re
+import threading
+import time
+
+
+class SamplingProfiler(object):
+
+    """Profiles a sample of message handling with cProfile, dumping the stats to files in directory.
+
+    With `every` set, every Nth message is profiled.  With `threshold` set (in
+    seconds) every message is profiled but stats are only kept for those which
+    took at least that long; profiling every message makes them slower, so
+    only use it while investigating.  Only one message is profiled at a time
+    and at most max_dumps files are written, after which profiling stops.
+    Nothing is profiled until enabled, and all of these can be changed at run
+    time with configure() (e.g. through the `profiler` RPC method).
+
+    The files can be read with `python -m pstats <file>`.  A file which can't
+    be written is logged to `logger` and skipped, never failing the message.
+
+    """
+
+    def __init__(self, directory, every=None, threshold=None, max_dumps=100, enabled=False, logger=None):
+        self.directory = directory
+        self.logger = logger or logging.getLogger(__name__)
+        self.every = every
+        self.threshold = threshold
+        self.max_dumps = max_dumps
+        self.enabled = enabled
+        self.dumps = 0
+        self._count = 0
+        # Numbers the files, so ones written in the same second don't overwrite each other
+        self._sequence = 0
+        self._busy = threading.Lock()
+
+    def configure(self, enabled=None, every=None, threshold=None, directory=None, max_dumps=None):
+        """Change any of the given settings, returning the new status."""
+        if every is not None:
+            self.every = every or None
+        if threshold is not None:
+            self.threshold = threshold or None
+        if directory is not None:
+            self.directory = directory
+        if max_dumps is not None:
+            self.max_dumps = max_dumps
+            self.dumps = 0
+        if enabled is not None:
+            self.enabled = enabled
+            self._count = 0
+        return self.status()
+
+    def status(self):
+        return {"enabled": self.enabled, "every": self.every, "threshold": self.threshold,
+                "directory": self.directory, "max_dumps": self.max_dumps, "dumps": self.dumps}
+
+    def _selected(self):
+        if not self.enabled or self.dumps >= self.max_dumps:
+            return False
+        if self.threshold:
+            return True
+        if self.every:
+            self._count += 1
+            return self._count % self.every == 0
+        return False
+
+    def run(self, name, func, *args):
+        """Call func(*args), profiling it if it is one of the sampled calls.
+
+        name (e.g. the message's trace id) is used in the stats file name.
+
+        """
+        if not self._selected() or not self._busy.acquire(False):
+            return func(*args)
+        try:
+            profile = cProfile.Profile()
+            started = time.perf_counter()
+            profile.enable()
+            try:
+                return func(*args)
+            finally:
+                profile.disable()
+                elapsed = time.perf_counter() - started
+                if not self.threshold or elapsed >= self.threshold:
+                    self._dump(profile, name, elapsed)
+        finally:
+            self._busy.release()
+
+    def _dump(self, profile, name, elapsed):
+        self._sequence += 1
+        # name comes from the message (its trace id), so can't be allowed to leave the directory
+        path = os.path.join(self.directory, "{}-{}-{}-{}ms.prof".format(
+            time.strftime("%Y%m%dT%H%M%S"), self._sequence, re.sub(r'[^\w.-]', '_', name), int(elapsed * 1000)))
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(path)
+        except Exception:
+            self.logger.exception("Failed to write profile {}".format(path))
+            return None
+        self.dumps += 1
+        return path
@@ -0,0 +1,38 @@
+import threading
+import time
+
+
+class TokenBucket(object):
+
+    """Thread safe token bucket rate limiter.
+
+    Allows `rate` acquisitions per second on average, with bursts of up to
+    `capacity` (default: one second's worth).  acquire() blocks until a token
+    is available.
+
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _wait_time(self, tokens):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        # Allow for float rounding, or a sleep of the exact wait could leave us just short
+        if self._tokens >= tokens - 1e-9:
+            self._tokens = max(0.0, self._tokens - tokens)
+            return 0
+        return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        while True:
+            with self._lock:
+                wait = self._wait_time(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
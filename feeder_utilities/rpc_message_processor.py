@@ -1,14 +1,45 @@
+import time
+import types
 from feeder_utilities.health import FeederHealth
 from feeder_utilities.exceptions import RpcMessageProcessingException
-from feeder_utilities.dependencies.rabbitmq import ErrorQueueClient
-from feeder_utilities.dependencies import rabbitmq
-from feeder_utilities.dependencies.register import Register
+from feeder_utilities.entry_ranges import EntryRangeSet
+from feeder_utilities.feeder_rpc_client import DEADLINE_HEADER
+from feeder_utilities.jobs import JobManager
+from feeder_utilities import serialization
+from feeder_utilities import metrics
+# The rabbitmq and register dependencies are imported where they are used, so that importing this module doesn't load
+# kombu, amqp and requests
+
+
+def rpc_method(name=None, background=False):
+    """Decorator making an RpcMessageProcessor method (or a subclass's) the handler of an RPC method.
+
+    The handler is called with the message body and the requests session, and
+    returns the result to send back, or a generator of results to stream back in
+    chunks.  The RPC method name defaults to the function name.  With
+    background=True the method may be run as a background job, by calling it with
+    background=true in the message body.
+
+    """
+    def decorator(func):
+        func.rpc_method_name = name or func.__name__
+        func.rpc_method_background = background
+        return func
+    return decorator
+
+
+def ranges_to_json(result):
+    """Convert any EntryRangeSet values in the result dict to their JSON form."""
+    return {key: value.to_json() if isinstance(value, EntryRangeSet) else value for key, value in result.items()}
 
 
 class RpcMessageProcessor:
 
     def __init__(self, logger, app_name, integrity_check, rabbitmq_url, queue_name, rpc_queue_name, error_queue_name,
-                 register_url, routing_key):
+                 register_url, routing_key, health_cache_ttl=0, health_stale_ttl=0, republish_options=None,
+                 checkpoint_store=None, max_background_jobs=1, profiler=None, reply_serializer='json',
+                 reply_compression='zlib', reply_compress_threshold=serialization.DEFAULT_COMPRESS_THRESHOLD,
+                 throttle=None):
         self.logger = logger
         self.app_name = app_name
         self.integrity_check = integrity_check
@@ -18,82 +49,324 @@ class RpcMessageProcessor:
         self.error_queue_name = error_queue_name
         self.register_url = register_url
         self.routing_key = routing_key
+        self.health_cache_ttl = health_cache_ttl
+        self.health_stale_ttl = health_stale_ttl
+        self._health = None
+        self._error_queue_client = None
+        self.max_background_jobs = max_background_jobs
+        self._jobs = None
+        # RPC method name to handler, from the methods decorated with rpc_method.  Base classes are gone through
+        # first so a subclass's handler replaces the one it inherits for the same name.
+        self.methods = {}
+        self.background_methods = set()
+        for cls in reversed(type(self).__mro__):
+            for attribute, value in vars(cls).items():
+                name = getattr(value, 'rpc_method_name', None)
+                if name:
+                    self.register_method(name, getattr(self, attribute), value.rpc_method_background)
+        # Passed to Register.republish_entries, e.g. {"chunk_size": 1000, "max_workers": 4, "rate_limit": 5}
+        self.republish_options = republish_options or {}
+        # Optional feeder_utilities.checkpoint store of the last verified entry, enables incremental integrity checks
+        self.checkpoint_store = checkpoint_store
+        # Optional feeder_utilities.profiler.SamplingProfiler (shared with the Worker) controlled by the profiler method
+        self.profiler = profiler
+        # Replies are only sent with this serializer and compressed if the client accepts them, see reply_options
+        self.reply_serializer = reply_serializer
+        self.reply_compression = reply_compression
+        self.reply_compress_threshold = reply_compress_threshold
+        # Optional feeder_utilities.throttle.AdaptiveThrottle (shared with the Worker) reported by the health method
+        self.throttle = throttle
 
-    def startup_integrity_check(self, requests):
-        self.logger.info("Checking database integrity")
+    @property
+    def health(self):
+        # Kept for the life of the processor so its cached result is reused
+        if self._health is None:
+            self._health = FeederHealth(self.app_name, self.rabbitmq_url, self.queue_name, self.rpc_queue_name,
+                                        self.error_queue_name, cache_ttl=self.health_cache_ttl,
+                                        stale_ttl=self.health_stale_ttl, throttle=self.throttle)
+        return self._health
+
+    @property
+    def error_queue_client(self):
+        if self._error_queue_client is None:
+            from feeder_utilities.dependencies.rabbitmq import ErrorQueueClient
+            self._error_queue_client = ErrorQueueClient(self.logger, self.rabbitmq_url, self.queue_name,
+                                                        self.error_queue_name)
+        return self._error_queue_client
+
+    @property
+    def jobs(self):
+        # Created on first use, so processors which never run background jobs don't start a thread pool
+        if self._jobs is None:
+            self._jobs = JobManager(self.logger, max_workers=self.max_background_jobs)
+        return self._jobs
+
+    def register_method(self, name, handler, background=False):
+        """Register handler(body, requests) as the handler of RPC method name, replacing any existing handler.
+
+        The handler returns the result to send back, or a generator of results to
+        stream back in chunks.  background=True allows it to be run as a background
+        job, in which case it should return a single result.
+
+        """
+        self.methods[name] = handler
+        if background:
+            self.background_methods.add(name)
+        else:
+            self.background_methods.discard(name)
+
+    def find_missing_entries(self, requests, full=False):
+        """Return the EntryRangeSet of entries missing up to the register's max entry.
+
+        With a checkpoint_store only the entries after the last verified entry are
+        checked, using integrity_check.check_integrity_range(start, end) where the
+        integrity check provides it.  full=True checks every entry regardless.  The
+        checkpoint is then moved to the register's max entry if nothing is missing,
+        or to just before the first missing entry so the gap is checked again.
+
+        """
+        from feeder_utilities.dependencies.register import Register
         max_entry = Register(self.register_url, self.routing_key, requests).max_entry()
-        missing_entries = self.integrity_check.check_integrity(max_entry)
+        if self.checkpoint_store is None:
+            return EntryRangeSet.coerce(self.integrity_check.check_integrity(max_entry))
+
+        checkpoint = None if full else self.checkpoint_store.get()
+        start = (checkpoint or 0) + 1
+        if start > max_entry:
+            self.logger.info("No new entries since checkpoint {}".format(checkpoint))
+            return EntryRangeSet()
+        if start > 1 and hasattr(self.integrity_check, 'check_integrity_range'):
+            self.logger.info("Checking entries {} to {}".format(start, max_entry))
+            missing_entries = EntryRangeSet.coerce(self.integrity_check.check_integrity_range(start, max_entry))
+        else:
+            self.logger.info("Checking entries 1 to {}".format(max_entry))
+            missing_entries = EntryRangeSet.coerce(self.integrity_check.check_integrity(max_entry))
+
+        if missing_entries:
+            self.checkpoint_store.set(missing_entries.ranges()[0][0] - 1)
+        else:
+            self.checkpoint_store.set(max_entry)
+        return missing_entries
+
+    def startup_integrity_check(self, requests, full=False):
+        self.logger.info("Checking database integrity")
+        missing_entries = self.find_missing_entries(requests, full)
         result = None
         if missing_entries:
-            self.logger.error("Detected missing_entries: {}".format(missing_entries))
+            self.logger.error("Detected {} missing_entries: {}".format(len(missing_entries), missing_entries))
             self.logger.error("Requesting missing_entries from register")
-            result = Register(self.register_url,
-                              self.routing_key, requests).republish_entries(missing_entries)
+            result = self.republish_entries(missing_entries, requests)
+        return result
+
+    def republish_entries(self, missing_entries, requests):
+        from feeder_utilities.dependencies.register import Register
+        result = Register(self.register_url, self.routing_key, requests).republish_entries(
+            missing_entries, **self.republish_options)
+        if result.get("failed_entries"):
+            self.logger.error("Failed to republish {} missing_entries: {}".format(
+                len(result["failed_entries"]), result["failed_entries"]))
         return result
 
-    def process_rpc_message(self, body, message, requests):
+    def error_queue_page(self, offset, limit):
+        error_messages = list(self.error_queue_client.iter_messages(offset, limit))
+        next_offset = None
+        if limit is not None and len(error_messages) == limit:
+            next_offset = offset + limit
+        return {"error_messages": error_messages, "offset": offset, "next_offset": next_offset}
+
+    def error_queue_chunks(self, chunk_size, offset, limit):
+        chunk = []
+        sent = 0
+        for error_message in self.error_queue_client.iter_messages(offset, limit):
+            chunk.append(error_message)
+            if len(chunk) >= chunk_size:
+                yield {"error_messages": chunk}
+                sent += len(chunk)
+                chunk = []
+        if chunk or not sent:
+            yield {"error_messages": chunk}
+        self.logger.info("Streamed {} error messages".format(sent + len(chunk)))
+
+    def reply_options(self, message):
+        """publish_message options for the replies to message, from what its client accepts (plain JSON if not said)."""
+        serializer, compression = serialization.negotiate((message.headers or {}).get(serialization.ACCEPT_HEADER),
+                                                          self.reply_serializer, self.reply_compression)
+        options = {}
+        if serializer != 'json':
+            options['serializer'] = serializer
+        if compression:
+            options.update(compression=compression, compress_threshold=self.reply_compress_threshold)
+        return options
+
+    def publish_reply(self, rpc_response, reply_to, correlation_id, **publish_options):
+        """Publish a response message to the caller's reply queue."""
+        from feeder_utilities.dependencies.rabbitmq import publish_message
+        publish_message(self.logger, rpc_response, self.rabbitmq_url, '', reply_to, correlation_id=correlation_id,
+                        **publish_options)
+
+    def publish_chunks(self, chunks, reply_to, correlation_id, publish_reply=None, **publish_options):
+        """Publish each result from the chunks generator as its own response message.
+
+        Each response carries {"chunk": {"index": n, "last": bool}} so the client
+        knows when the stream has ended; an empty stream is sent as a single empty
+        last chunk.  publish_reply is as for process_rpc_message.
+
+        """
+        publish_reply = publish_reply or self.publish_reply
+        index = 0
+        result = next(chunks, {})
+        while True:
+            following = next(chunks, None)
+            rpc_response = {"success": True, "result": result, "error": None,
+                            "chunk": {"index": index, "last": following is None}}
+            self.logger.info("Publishing rpc response chunk {}".format(index))
+            publish_reply(rpc_response, reply_to, correlation_id, **publish_options)
+            if following is None:
+                break
+            result = following
+            index += 1
+
+    @rpc_method('health')
+    def rpc_health(self, body, requests):
+        self.logger.info("Processing health check message")
+        rpc_result = self.health.generate_health_msg()
+        if 'status' in rpc_result and rpc_result['status'] == 'BAD':
+            self.logger.error("Feeder reporting BAD status: {}".format(rpc_result))
+        return rpc_result
+
+    @rpc_method('integrity_check', background=True)
+    def rpc_integrity_check(self, body, requests):
+        self.logger.info("Detecting gaps in entry sequence")
+        missing_entries = self.find_missing_entries(requests, body.get('full', False))
+        if missing_entries:
+            self.logger.error("Detected {} missing_entries: {}".format(len(missing_entries), missing_entries))
+        return {"missing_entries": missing_entries.to_json()}
+
+    @rpc_method('integrity_fix', background=True)
+    def rpc_integrity_fix(self, body, requests):
+        self.logger.info("Fixing database integrity")
+        missing_entries = self.find_missing_entries(requests, body.get('full', False))
+        if not missing_entries:
+            self.logger.info("No missing entries detected")
+            return ranges_to_json({"entries_not_found": EntryRangeSet(), "republished_entries": EntryRangeSet()})
+        self.logger.error("Detected {} missing_entries: {}".format(len(missing_entries), missing_entries))
+        self.logger.error("Requesting missing_entries from register")
+        return ranges_to_json(self.republish_entries(missing_entries, requests))
+
+    @rpc_method('dump_error_queue')
+    def rpc_dump_error_queue(self, body, requests):
+        if body.get('chunk_size'):
+            self.logger.info("Streaming contents of error queue")
+            return self.error_queue_chunks(body['chunk_size'], body.get('offset', 0), body.get('limit'))
+        if 'offset' in body or 'limit' in body:
+            self.logger.info("Dumping page of error queue")
+            rpc_result = self.error_queue_page(body.get('offset', 0), body.get('limit'))
+            self.logger.info("Dumping {} error messages".format(len(rpc_result['error_messages'])))
+            return rpc_result
+        self.logger.info("Dumping contents of error queue")
+        rpc_result = {"error_messages": self.error_queue_client.retrieve_messages()}
+        self.logger.info("Dumping {} error messages".format(len(rpc_result)))
+        return rpc_result
+
+    @rpc_method('requeue_errors', background=True)
+    def rpc_requeue_errors(self, body, requests):
+        if body.get('bulk'):
+            self.logger.info("Bulk requeuing contents of error queue")
+            return self.error_queue_client.bulk_requeue_messages(batch_size=body.get('batch_size'))
+        self.logger.info("Requeuing contents of error queue")
+        rpc_result = {"requeued_messages": self.error_queue_client.requeue_messages()}
+        self.logger.info("Requeued {} error messages".format(len(rpc_result)))
+        return rpc_result
+
+    @rpc_method('delete_errors', background=True)
+    def rpc_delete_errors(self, body, requests):
+        self.logger.info("Deleting contents of error queue")
+        rpc_result = {"deleted_messages": self.error_queue_client.delete_messages()}
+        self.logger.info("Deleted {} error messages".format(len(rpc_result)))
+        return rpc_result
+
+    @rpc_method('list_methods')
+    def rpc_list_methods(self, body, requests):
+        return {"methods": sorted(self.methods)}
+
+    @rpc_method('metrics')
+    def rpc_metrics(self, body, requests):
+        return metrics.REGISTRY.to_json()
+
+    @rpc_method('profiler')
+    def rpc_profiler(self, body, requests):
+        # The dump directory can't be changed remotely, only where the feeder was configured to write to
+        if self.profiler is None:
+            raise RpcMessageProcessingException("No profiler configured")
+        return self.profiler.configure(enabled=body.get('enabled'), every=body.get('every'),
+                                       threshold=body.get('threshold'), max_dumps=body.get('max_dumps'))
+
+    def get_job(self, body):
+        if not body.get('job_id'):
+            raise RpcMessageProcessingException("Message body must contain job_id")
+        job = self.jobs.get(body['job_id'])
+        if job is None:
+            raise RpcMessageProcessingException("Unknown job '{}'".format(body['job_id']))
+        return job
+
+    @rpc_method('job_status')
+    def rpc_job_status(self, body, requests):
+        if not body.get('job_id'):
+            return {"jobs": [job.to_json() for job in self.jobs.list()]}
+        return self.get_job(body).to_json()
+
+    @rpc_method('job_result')
+    def rpc_job_result(self, body, requests):
+        job = self.get_job(body)
+        return dict(job.to_json(), result=job.result)
+
+    def process_rpc_message(self, body, message, requests, publish_reply=None):
+        """Handle an RPC message, publishing the response(s) to its reply_to queue.
+
+        publish_reply(rpc_response, reply_to, correlation_id, **publish_options)
+        publishes each response, by default publish_reply (through the
+        process-wide EmitterPool).
+
+        """
+        publish_reply = publish_reply or self.publish_reply
         self.logger.info("Processing rpc message")
 
         reply_to = message.properties.get('reply_to', None)
         correlation_id = message.properties.get('correlation_id', None)
 
+        deadline = (message.headers or {}).get(DEADLINE_HEADER)
         if not reply_to or not correlation_id:
             self.logger.error("Message must have reply_to and correlation_id")
             message.reject()
+        elif isinstance(deadline, (int, float)) and deadline < time.time():
+            # The caller has given up waiting, so don't do the work or send a response
+            self.logger.warning("Skipping rpc message '{}', its deadline passed {:.1f} seconds ago".format(
+                body.get('method'), time.time() - deadline))
+            message.ack()
         else:
+            reply_options = self.reply_options(message)
             try:
                 rpc_response = None
                 if 'method' not in body or not body['method']:
                     raise RpcMessageProcessingException("Message body must contain method name")
-                if body['method'] == 'health':
-                    self.logger.info("Processing health check message")
-                    rpc_result = FeederHealth(self.app_name, self.rabbitmq_url, self.queue_name, self.rpc_queue_name,
-                                              self.error_queue_name).generate_health_msg()
-                    if 'status' in rpc_result and rpc_result['status'] == 'BAD':
-                        self.logger.error("Feeder reporting BAD status: {}".format(rpc_result))
-                elif body['method'] == 'integrity_check':
-                    self.logger.info("Detecting gaps in entry sequence")
-                    max_entry = Register(self.register_url, self.routing_key, requests).max_entry()
-                    rpc_result = {"missing_entries": self.integrity_check.check_integrity(max_entry)}
-                    if rpc_result["missing_entries"]:
-                        self.logger.error("Detected missing_entries: {}".format(rpc_result))
-                elif body['method'] == 'integrity_fix':
-                    self.logger.info("Fixing database integrity")
-                    max_entry = Register(self.register_url, self.routing_key, requests).max_entry()
-                    missing_entries = self.integrity_check.check_integrity(max_entry)
-                    if missing_entries:
-                        self.logger.error("Detected missing_entries: {}".format(missing_entries))
-                        self.logger.error("Requesting missing_entries from register")
-                        rpc_result = Register(self.register_url,
-                                              self.routing_key, requests).republish_entries(missing_entries)
-                    else:
-                        self.logger.info("No missing entries detected")
-                        rpc_result = {"entries_not_found": [], "republished_entries": []}
-                elif body['method'] == 'dump_error_queue':
-                    self.logger.info("Dumping contents of error queue")
-                    rpc_result = {
-                        "error_messages": ErrorQueueClient(self.logger, self.rabbitmq_url, self.queue_name,
-                                                           self.error_queue_name).retrieve_messages()}
-                    self.logger.info("Dumping {} error messages".format(len(rpc_result)))
-                elif body['method'] == 'requeue_errors':
-                    self.logger.info("Requeuing contents of error queue")
-                    rpc_result = {
-                        "requeued_messages": ErrorQueueClient(self.logger, self.rabbitmq_url, self.queue_name,
-                                                              self.error_queue_name).requeue_messages()}
-                    self.logger.info("Requeued {} error messages".format(len(rpc_result)))
-                elif body['method'] == 'delete_errors':
-                    self.logger.info("Deleting contents of error queue")
-                    rpc_result = {
-                        "deleted_messages": ErrorQueueClient(self.logger, self.rabbitmq_url, self.queue_name,
-                                                             self.error_queue_name).delete_messages()}
-                    self.logger.info("Deleted {} error messages".format(len(rpc_result)))
-                else:
+                handler = self.methods.get(body['method'])
+                if handler is None:
                     raise RpcMessageProcessingException("Unknown method '{}'".format(body['method']))
+                if body.get('background'):
+                    if body['method'] not in self.background_methods:
+                        raise RpcMessageProcessingException(
+                            "Method '{}' can't be run in the background".format(body['method']))
+                    job = self.jobs.submit(body['method'], handler, body, requests)
+                    rpc_result = {"job_id": job.job_id, "status": job.status}
+                else:
+                    rpc_result = handler(body, requests)
 
-                rpc_response = {"success": True, "result": rpc_result, "error": None}
-                self.logger.info("Publishing rpc response message")
-                rabbitmq.publish_message(self.logger, rpc_response, self.rabbitmq_url, '', reply_to,
-                                         correlation_id=correlation_id)
+                if isinstance(rpc_result, types.GeneratorType):
+                    self.publish_chunks(rpc_result, reply_to, correlation_id, publish_reply, **reply_options)
+                else:
+                    rpc_response = {"success": True, "result": rpc_result, "error": None}
+                    self.logger.info("Publishing rpc response message")
+                    publish_reply(rpc_response, reply_to, correlation_id, **reply_options)
                 message.ack()
 
             except Exception as e:
@@ -104,7 +377,6 @@ class RpcMessageProcessor:
                     "error": {
                         "error_message": "Exception occured: {}".format(
                             repr(e))}}
-                rabbitmq.publish_message(self.logger, rpc_response, self.rabbitmq_url, '', reply_to,
-                                         correlation_id=correlation_id)
+                publish_reply(rpc_response, reply_to, correlation_id, **reply_options)
                 self.logger.error("Failure message sent to queue '{}'".format(reply_to))
                 message.reject()
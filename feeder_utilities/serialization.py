@@ -0,0 +1,117 @@
+"""Message serialisation: a faster JSON implementation, msgpack, and compression of large bodies.
+
+kombu's serializer and compression registries do the encoding and decoding,
+so these work with every kombu producer and consumer.  A Worker consumes
+json and msgpack by default, and decompresses compressed messages, so
+consumers can be upgraded before publishers start sending anything but plain
+JSON.  RPC replies are negotiated: FeederRpcClient lists the content types it
+can decode in the ACCEPT_HEADER, and the feeder only uses msgpack or
+compression when they are listed, so older clients keep getting plain JSON.
+
+"""
+import importlib.util
+import json
+
+ACCEPT_HEADER = 'x-accept'
+
+# Serializers a Worker consumes by default
+DEFAULT_ACCEPT = ('json', 'msgpack')
+
+# Bodies larger than this are compressed where compression is enabled without a threshold
+DEFAULT_COMPRESS_THRESHOLD = 64 * 1024
+
+CONTENT_TYPES = {'json': 'application/json', 'msgpack': 'application/x-msgpack'}
+
+# kombu's compression content types, which are what the message's compression header holds
+COMPRESSION_TYPES = {'zlib': 'application/x-gzip', 'bzip2': 'application/x-bz2', 'lzma': 'application/x-lzma',
+                     'zstd': 'application/zstd'}
+
+
+def install_fast_json():
+    """Make kombu encode and decode JSON with orjson, for every producer and consumer in this process.
+
+    The messages are the same JSON, so this makes no difference to other
+    feeders.  Returns False (leaving kombu's JSON implementation in place) if
+    orjson isn't installed.
+
+    """
+    try:
+        import orjson
+    except ImportError:
+        return False
+    from kombu.serialization import register
+
+    def dumps(obj):
+        # str() anything else, as kombu's JSON encoder does for dates, decimals and UUIDs
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    register('json', dumps, orjson.loads, content_type=CONTENT_TYPES['json'], content_encoding='utf-8')
+    return True
+
+
+def accept_header():
+    """The ACCEPT_HEADER value listing the content types, and compressions, kombu can decode in this process."""
+    from kombu.compression import encoders
+    content_types = [CONTENT_TYPES['json']]
+    if importlib.util.find_spec('msgpack'):
+        content_types.insert(0, CONTENT_TYPES['msgpack'])
+    return ', '.join(content_types + sorted(encoders()))
+
+
+def negotiate(accept, serializer='json', compression=None):
+    """Return the (serializer, compression) to reply with, given the ACCEPT_HEADER of a request.
+
+    serializer and compression are used if the request accepts them, otherwise
+    json and no compression, which is all a request without the header gets.
+
+    """
+    accepted = set(content_type.strip() for content_type in accept.split(',')) if isinstance(accept, str) else set()
+    if CONTENT_TYPES.get(serializer) not in accepted:
+        serializer = 'json'
+    if COMPRESSION_TYPES.get(compression) not in accepted:
+        compression = None
+    return serializer, compression
+
+
+def encode(body, serializer='json', compression=None, compress_threshold=None):
+    """Serialise body for Producer.publish, compressing it if it's larger than compress_threshold bytes.
+
+    Returns the encoded body and the publish keyword arguments describing it.
+
+    """
+    from kombu.serialization import dumps
+    content_type, content_encoding, payload = dumps(body, serializer=serializer)
+    if isinstance(payload, str):
+        payload = payload.encode(content_encoding)
+    options = {'content_type': content_type, 'content_encoding': content_encoding}
+    if compression:
+        threshold = DEFAULT_COMPRESS_THRESHOLD if compress_threshold is None else compress_threshold
+        if len(payload) > threshold:
+            # Compressed by kombu, which adds the compression header
+            options['compression'] = compression
+    return payload, options
+
+
+def decompress(body, content_type):
+    """Decompress a body by its compression header, for consumers which don't use kombu."""
+    if content_type == COMPRESSION_TYPES['zlib']:
+        import zlib
+        return zlib.decompress(body)
+    if content_type == COMPRESSION_TYPES['bzip2']:
+        import bz2
+        return bz2.decompress(body)
+    if content_type == COMPRESSION_TYPES['lzma']:
+        import lzma
+        return lzma.decompress(body)
+    if content_type == COMPRESSION_TYPES['zstd']:
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(body)
+    raise ValueError("Unknown compression '{}'".format(content_type))
+
+
+def decode_json(body, headers):
+    """Decode a JSON body, decompressing it first if its headers say it is compressed."""
+    compression = (headers or {}).get('compression')
+    if compression:
+        body = decompress(body, compression)
+    return json.loads(body.decode('utf-8'))
@@ -0,0 +1,75 @@
+import threading
+import time
+from feeder_utilities import metrics
+
+LIMIT = metrics.gauge('feeder_throttle_limit', 'Unacked main queue messages allowed by the AdaptiveThrottle')
+
+
+class AdaptiveThrottle(object):
+
+    """Adapts how many main queue messages a Worker may have unacked to how the downstream services are coping.
+
+    Additive increase, multiplicative decrease: after every `window` messages
+    the limit is raised by `increase` if their mean handler time was at most
+    target_latency seconds and at most max_error_rate of them failed, and is
+    otherwise multiplied by `decrease`, staying between min_limit and max_limit.
+    If at least pause_error_rate of a window failed, the main queue is paused
+    for pause_seconds and then resumed at min_limit.  A message failed if the
+    message function raised, or rejected or requeued it.
+
+    """
+
+    def __init__(self, target_latency, min_limit=1, max_limit=100, initial_limit=None, increase=1, decrease=0.5,
+                 window=20, max_error_rate=0.05, pause_error_rate=0.5, pause_seconds=10):
+        self.target_latency = target_latency
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        self.max_error_rate = max_error_rate
+        self.pause_error_rate = pause_error_rate
+        self.pause_seconds = pause_seconds
+        self.limit = initial_limit or min_limit
+        self.paused_until = None
+        # Mean latency and error rate of the last full window
+        self.latency = None
+        self.error_rate = None
+        self._count = 0
+        self._errors = 0
+        self._total_seconds = 0.0
+        self._lock = threading.Lock()
+        LIMIT.set(self.limit)
+
+    @property
+    def paused(self):
+        return self.paused_until is not None and time.monotonic() < self.paused_until
+
+    def record(self, seconds, error=False):
+        """Record a handled message's handler time, and whether it failed."""
+        with self._lock:
+            self._count += 1
+            self._total_seconds += seconds
+            if error:
+                self._errors += 1
+            if self._count >= self.window:
+                self._adjust()
+
+    def _adjust(self):
+        self.latency = self._total_seconds / self._count
+        self.error_rate = self._errors / self._count
+        self._count = 0
+        self._errors = 0
+        self._total_seconds = 0.0
+        if self.error_rate >= self.pause_error_rate:
+            self.limit = self.min_limit
+            self.paused_until = time.monotonic() + self.pause_seconds
+        elif self.latency <= self.target_latency and self.error_rate <= self.max_error_rate:
+            self.limit = min(self.limit + self.increase, self.max_limit)
+        else:
+            self.limit = max(int(self.limit * self.decrease), self.min_limit)
+        LIMIT.set(self.limit)
+
+    def status(self):
+        return {"limit": self.limit, "min_limit": self.min_limit, "max_limit": self.max_limit, "paused": self.paused,
+                "latency": None if self.latency is None else round(self.latency, 6), "error_rate": self.error_rate}
@@ -36,7 +36,12 @@ setup(
 
     packages=find_packages(exclude=['contrib', 'docs', 'tests']),
 
-    install_requires=['kombu==3.0.35', ''],
+    install_requires=['kombu==3.0.35', 'requests'],
+
+    extras_require={
+        'aio': ['aio-pika', 'aiohttp'],
+        'fast': ['orjson', 'msgpack']
+    },
 
     test_suite='nose.collector',
     tests_require=['nose', 'coverage'],
@@ -0,0 +1,68 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+from feeder_utilities.aio.broker import MemoryBroker
+from feeder_utilities.aio.feeder_rpc_client import AsyncFeederRpcClient
+from feeder_utilities.feeder_rpc_client import DEADLINE_HEADER
+
+
+class TestAsyncFeederRpcClient(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.broker = MemoryBroker()
+        await self.broker.declare_queue("rpc_queue")
+        await self.broker.bind("rpc_queue", "rpc_exchange", "rpc_key")
+        self.client = AsyncFeederRpcClient(self.broker, "rpc_exchange", "rpc_key")
+
+    async def serve(self, respond):
+        async def on_request(message):
+            await message.ack()
+            for response in respond(message.body):
+                await self.broker.publish(response, routing_key=message.properties["reply_to"],
+                                          correlation_id=message.properties["correlation_id"])
+        return await self.broker.consume("rpc_queue", on_request)
+
+    async def test_concurrent_calls(self):
+        await self.serve(lambda body: [{"success": True, "result": body["n"], "error": None}])
+        responses = await asyncio.gather(*[self.client.call("health", timeout=1, n=n) for n in range(10)])
+        self.assertEqual([response["result"] for response in responses], list(range(10)))
+
+    async def test_chunked_call(self):
+        await self.serve(lambda body: [
+            {"success": True, "result": {"error_messages": [1]}, "error": None, "chunk": {"index": 0, "last": False}},
+            {"success": True, "result": {"error_messages": [2]}, "error": None, "chunk": {"index": 1, "last": True}}])
+        response = await self.client.call("dump_error_queue", timeout=1, chunk_size=1)
+        self.assertEqual(response, {"success": True, "result": {"error_messages": [1, 2]}, "error": None})
+
+    async def test_timeout(self):
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.client.call("health", timeout=0.01)
+
+    async def test_feeder_method_sent(self):
+        await self.serve(lambda body: [{"success": False, "result": None,
+                                        "error": {"error_message": "Unknown method '{}'".format(body["method"])}}])
+        response = await self.client.call("reindex", timeout=1)
+        self.assertEqual(response["error"]["error_message"], "Unknown method 'reindex'")
+
+    async def test_timeout_sets_deadline(self):
+        requests = []
+
+        async def on_request(message):
+            requests.append(message)
+            await message.ack()
+            await self.broker.publish({"success": True, "result": None, "error": None},
+                                      routing_key=message.properties["reply_to"],
+                                      correlation_id=message.properties["correlation_id"])
+        await self.broker.consume("rpc_queue", on_request)
+        with patch("feeder_utilities.aio.feeder_rpc_client.time.time", return_value=100):
+            await self.client.call("health", timeout=1)
+        self.assertEqual(requests[0].headers, {DEADLINE_HEADER: 101})
+
+    async def test_timeout_expires_unconsumed_request(self):
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.client.call("health", timeout=0.01)
+        # Nobody consumed the request before its expiration, so it is dropped instead of answered late
+        requests = []
+        await self.serve(lambda body: requests.append(body) or [])
+        await asyncio.sleep(0.05)
+        self.assertEqual(requests, [])
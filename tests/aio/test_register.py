@@ -0,0 +1,58 @@
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import MagicMock
+from feeder_utilities.aio.register import AsyncRegister
+from feeder_utilities.exceptions import RegisterException
+
+
+class MockResponse(object):
+
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def json(self):
+        return self.body
+
+    async def text(self):
+        return str(self.body)
+
+
+class TestAsyncRegister(IsolatedAsyncioTestCase):
+
+    async def test_max_entry_ok(self):
+        mock_requests = MagicMock()
+        mock_requests.get.return_value = MockResponse(200, {"total-entries": 1})
+        response = await AsyncRegister("register_url", "routing_key", mock_requests).max_entry()
+        self.assertEqual(response, 1)
+
+    async def test_max_entry_500(self):
+        mock_requests = MagicMock()
+        mock_requests.get.return_value = MockResponse(500, {})
+        with self.assertRaises(RegisterException) as exc:
+            await AsyncRegister("register_url", "routing_key", mock_requests).max_entry()
+        self.assertRegex(str(exc.exception), r".*Unable to retrieve register information.*")
+
+    async def test_max_entry_invalid(self):
+        mock_requests = MagicMock()
+        mock_requests.get.return_value = MockResponse(200, {"total-lywrong": 1})
+        with self.assertRaises(RegisterException):
+            await AsyncRegister("register_url", "routing_key", mock_requests).max_entry()
+
+    async def test_republish_entries_ok(self):
+        mock_requests = MagicMock()
+        mock_requests.post.return_value = MockResponse(200, {"some-kind": "of-response"})
+        response = await AsyncRegister("register_url", "routing_key", mock_requests).republish_entries([1])
+        self.assertEqual(response, {"some-kind": "of-response"})
+
+    async def test_republish_entries_500(self):
+        mock_requests = MagicMock()
+        mock_requests.post.return_value = MockResponse(500, {})
+        with self.assertRaises(RegisterException) as exc:
+            await AsyncRegister("register_url", "routing_key", mock_requests).republish_entries([1])
+        self.assertRegex(str(exc.exception), r".*Unable to republish enties.*")
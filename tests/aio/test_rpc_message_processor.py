@@ -0,0 +1,63 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import MagicMock, patch
+from feeder_utilities.aio.broker import MemoryBroker
+from feeder_utilities.aio.feeder_rpc_client import AsyncFeederRpcClient
+from feeder_utilities.aio.rpc_message_processor import AsyncRpcMessageProcessor
+from feeder_utilities.aio.worker import AsyncWorker
+from feeder_utilities.rpc_message_processor import RpcMessageProcessor
+
+
+class TestAsyncRpcMessageProcessor(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.broker = MemoryBroker()
+        await self.broker.declare_queue("queue")
+        await self.broker.declare_queue("rpc_queue")
+        await self.broker.bind("rpc_queue", "rpc_exchange", "rpc_key")
+        self.processor = RpcMessageProcessor(MagicMock(), "app_name", "integrity_check", "rabbitmq_url", "queue",
+                                             "rpc_queue", "error_queue", "register_url", "routing_key")
+        self.session = MagicMock()
+        rpc_processor = AsyncRpcMessageProcessor(self.processor, self.broker, session=self.session)
+        self.worker = AsyncWorker(MagicMock(), self.broker, ["queue"], ["rpc_queue"], None,
+                                  rpc_processor.process_rpc_message, session=MagicMock())
+        self.worker_task = asyncio.ensure_future(self.worker.run())
+        self.client = AsyncFeederRpcClient(self.broker, "rpc_exchange", "rpc_key")
+
+    async def asyncTearDown(self):
+        self.worker.stop()
+        await self.worker_task
+
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    @patch("feeder_utilities.rpc_message_processor.FeederHealth")
+    async def test_health(self, mock_health, mock_publish):
+        mock_health.return_value.generate_health_msg.return_value = {"status": "OK"}
+        response = await self.client.call("health", timeout=5)
+        self.assertEqual(response, {"success": True, "result": {"status": "OK"}, "error": None})
+        # Replied through the broker, not a kombu connection
+        mock_publish.assert_not_called()
+        self.assertEqual(self.broker.message_count("rpc_queue"), 0)
+
+    async def test_streamed(self):
+        self.processor.register_method("count", lambda body, requests: ({"n": n} for n in range(3)))
+        response = await self.client.call("count", timeout=5)
+        self.assertTrue(response["success"])
+        self.assertEqual(response["result"], {"n": 2})
+
+    async def test_unknown_method_rejected(self):
+        response = await self.client.call("acab", timeout=5)
+        self.assertFalse(response["success"])
+        self.assertEqual(response["error"]["error_message"],
+                         "Exception occured: RpcMessageProcessingException(\"Unknown method 'acab'\")")
+
+    async def test_trace_header_on_requests(self):
+        traces = []
+
+        def handler(body, requests):
+            traces.append(requests.headers)
+            return {}
+
+        self.processor.register_method("trace", handler)
+        await self.client.call("trace", timeout=5)
+        self.assertEqual(len(traces), 1)
+        self.assertIn("X-Trace-ID", traces[0])
@@ -0,0 +1,114 @@
+import asyncio
+import sys
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock, MagicMock, patch
+from feeder_utilities.aio.broker import MemoryBroker
+from feeder_utilities.aio.worker import AsyncWorker, AsyncTracedSession
+
+
+class TestAsyncWorker(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        # aiohttp, for the session the worker creates when not given one
+        self.aiohttp = MagicMock()
+        self.aiohttp.ClientSession.return_value.close = AsyncMock()
+        modules = patch.dict(sys.modules, {"aiohttp": self.aiohttp})
+        modules.start()
+        self.addCleanup(modules.stop)
+        self.broker = MemoryBroker()
+        await self.broker.declare_queue("queue")
+        await self.broker.declare_queue("rpc_queue")
+
+    async def run_worker(self, worker, until):
+        task = asyncio.ensure_future(worker.run())
+        for _ in range(200):
+            await asyncio.sleep(0.005)
+            if until():
+                break
+        worker.stop()
+        await task
+
+    async def test_processes_concurrently_up_to_limit(self):
+        in_flight = []
+        peak = []
+        processed = []
+
+        async def process(body, message, requests):
+            in_flight.append(body)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.remove(body)
+            processed.append(body["n"])
+            await message.ack()
+
+        worker = AsyncWorker(MagicMock(), self.broker, ["queue"], ["rpc_queue"], process, max_concurrency=5)
+        for n in range(20):
+            await self.broker.publish({"n": n}, routing_key="queue")
+        await self.run_worker(worker, lambda: len(processed) == 20)
+        self.assertEqual(sorted(processed), list(range(20)))
+        self.assertEqual(max(peak), 5)
+
+    async def test_creates_and_closes_session(self):
+        sessions = []
+
+        async def process(body, message, requests):
+            sessions.append(requests.session)
+            await message.ack()
+
+        worker = AsyncWorker(MagicMock(), self.broker, ["queue"], ["rpc_queue"], process)
+        await self.broker.publish({"n": 1}, routing_key="queue")
+        await self.run_worker(worker, lambda: sessions)
+        self.assertEqual(sessions, [self.aiohttp.ClientSession.return_value])
+        self.aiohttp.ClientSession.return_value.close.assert_awaited_once_with()
+        self.assertIsNone(worker.session)
+
+    async def test_given_session_not_closed(self):
+        session = MagicMock()
+        worker = AsyncWorker(MagicMock(), self.broker, ["queue"], ["rpc_queue"], session=session)
+        await self.run_worker(worker, lambda: True)
+        self.assertIs(worker.session, session)
+        session.close.assert_not_called()
+        self.aiohttp.ClientSession.assert_not_called()
+
+    async def test_rpc_messages_and_trace_header(self):
+        received = []
+
+        async def process_rpc(body, message, requests):
+            received.append((body, message.properties["reply_to"], requests.headers))
+            await message.ack()
+
+        worker = AsyncWorker(MagicMock(), self.broker, ["queue"], ["rpc_queue"], None, process_rpc)
+        await self.broker.publish({"method": "health"}, routing_key="rpc_queue", headers={"X-Trace-ID": "trace"},
+                                  reply_to="reply", correlation_id="corr")
+        await self.run_worker(worker, lambda: received)
+        self.assertEqual(received, [({"method": "health"}, "reply", {"X-Trace-ID": "trace"})])
+
+    async def test_failed_message_is_logged(self):
+        logger = MagicMock()
+        failed = []
+        processed = []
+
+        async def process(body, message, requests):
+            if body["n"] < 2:
+                failed.append(message)
+                raise ValueError("bad")
+            processed.append(body["n"])
+            await message.ack()
+
+        worker = AsyncWorker(logger, self.broker, ["queue"], ["rpc_queue"], process, max_concurrency=2)
+        for n in range(5):
+            await self.broker.publish({"n": n}, routing_key="queue")
+        await self.run_worker(worker, lambda: len(processed) == 3)
+        self.assertEqual(logger.error.call_count, 2)
+        self.assertTrue(all(message.acknowledged for message in failed))
+        self.assertEqual(sorted(processed), [2, 3, 4])
+        self.assertEqual(self.broker.message_count("queue"), 0)
+
+
+class TestAsyncTracedSession(IsolatedAsyncioTestCase):
+
+    async def test_adds_trace_header(self):
+        session = MagicMock()
+        AsyncTracedSession(session, "trace").post("url", data="{}", headers={"Accept": "application/json"})
+        session.request.assert_called_once_with("POST", "url", headers={"X-Trace-ID": "trace",
+                                                                        "Accept": "application/json"}, data="{}")
@@ -0,0 +1,628 @@
+from unittest import TestCase
+from unittest.mock import ANY, patch, MagicMock
+import threading
+import time
+from feeder_utilities.dependencies import rabbitmq
+from feeder_utilities.dedup import DedupCache, entry_number_key
+from feeder_utilities.exceptions import ErrorQueueException
+from feeder_utilities.throttle import AdaptiveThrottle
+from kombu import Connection, Producer, Queue
+from amqp.exceptions import NotFound
+
+
+class TestEmitterPool(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.mock_emitter_class = MagicMock(side_effect=lambda *args, **kwargs: MagicMock())
+        self.logger = MagicMock()
+
+    def test_reuses_emitter_for_same_key(self):
+        pool = rabbitmq.EmitterPool(emitter_class=self.mock_emitter_class)
+        pool.send_message(self.logger, {"a": 1}, "url", "exchange", "key")
+        pool.send_message(self.logger, {"a": 2}, "url", "exchange", "key")
+        self.mock_emitter_class.assert_called_once_with(self.logger, "url", "exchange", None, None,
+                                                        exchange_type="direct")
+        self.assertEqual(len(pool), 1)
+
+    def test_shared_across_routing_keys(self):
+        pool = rabbitmq.EmitterPool(emitter_class=self.mock_emitter_class)
+        # e.g. RPC replies, each to a client's own reply_to queue
+        pool.send_message(self.logger, {}, "url", "", "reply-1")
+        pool.send_message(self.logger, {}, "url", "", "reply-2")
+        self.assertEqual(len(pool), 1)
+        emitter = pool._emitters[("url", "", None, None, "direct")].emitter
+        self.assertEqual([call[1]["routing_key"] for call in emitter.send_message.call_args_list],
+                         ["reply-1", "reply-2"])
+
+    def test_separate_emitters_per_key(self):
+        pool = rabbitmq.EmitterPool(emitter_class=self.mock_emitter_class)
+        pool.send_message(self.logger, {}, "url", "exchange", "key")
+        pool.send_message(self.logger, {}, "url", "other-exchange", "key")
+        pool.send_message(self.logger, {}, "url", "exchange", "key", queue_name="queue")
+        pool.send_message(self.logger, {}, "url", "exchange", "other-key", queue_name="queue")
+        self.assertEqual(self.mock_emitter_class.call_count, 4)
+        self.assertEqual(len(pool), 4)
+
+    def test_evicts_least_recently_used(self):
+        pool = rabbitmq.EmitterPool(max_size=2, emitter_class=self.mock_emitter_class)
+        pool.send_message(self.logger, {}, "url", "one", "key")
+        first = pool._emitters[("url", "one", None, None, "direct")].emitter
+        pool.send_message(self.logger, {}, "url", "two", "key")
+        pool.send_message(self.logger, {}, "url", "three", "key")
+        self.assertEqual(len(pool), 2)
+        first.release.assert_called_once()
+
+    @patch("feeder_utilities.dependencies.rabbitmq.time")
+    def test_evicts_idle(self, mock_time):
+        pool = rabbitmq.EmitterPool(idle_timeout=10, emitter_class=self.mock_emitter_class)
+        mock_time.monotonic.return_value = 100
+        pool.send_message(self.logger, {}, "url", "one", "key")
+        first = pool._emitters[("url", "one", None, None, "direct")].emitter
+        mock_time.monotonic.return_value = 111
+        pool.send_message(self.logger, {}, "url", "two", "key")
+        first.release.assert_called_once()
+        self.assertEqual(list(pool._emitters), [("url", "two", None, None, "direct")])
+
+    def test_reaps_idle_without_checkout(self):
+        pool = rabbitmq.EmitterPool(idle_timeout=0.05, emitter_class=self.mock_emitter_class)
+        pool.send_message(self.logger, {}, "url", "exchange", "key")
+        emitter = pool._emitters[("url", "exchange", None, None, "direct")].emitter
+        reaper = pool._reaper
+        reaper.join(timeout=5)
+        self.assertFalse(reaper.is_alive())
+        emitter.release.assert_called_once()
+        self.assertEqual(len(pool), 0)
+        self.assertIsNone(pool._reaper)
+
+    def test_discards_emitter_on_failure(self):
+        pool = rabbitmq.EmitterPool(emitter_class=self.mock_emitter_class)
+        pool.send_message(self.logger, {}, "url", "exchange", "key")
+        broken = pool._emitters[("url", "exchange", None, None, "direct")].emitter
+        broken.send_message.side_effect = ConnectionError("gone")
+        with self.assertRaises(ConnectionError):
+            pool.send_message(self.logger, {}, "url", "exchange", "key")
+        broken.release.assert_called_once()
+        self.assertEqual(len(pool), 0)
+        pool.send_message(self.logger, {}, "url", "exchange", "key")
+        self.assertEqual(self.mock_emitter_class.call_count, 2)
+
+    def test_release_all(self):
+        pool = rabbitmq.EmitterPool(emitter_class=self.mock_emitter_class)
+        pool.send_message(self.logger, {}, "url", "exchange", "key")
+        emitter = pool._emitters[("url", "exchange", None, None, "direct")].emitter
+        pool.release_all()
+        emitter.release.assert_called_once()
+        self.assertEqual(len(pool), 0)
+
+
+class TestPublishMessage(TestCase):
+
+    @patch("feeder_utilities.dependencies.rabbitmq._emitter_pool")
+    def test_publish_pooled(self, mock_pool):
+        logger = MagicMock()
+        rabbitmq.publish_message(logger, {"a": 1}, "url", "", "reply", correlation_id="corr")
+        mock_pool.send_message.assert_called_once_with(logger, {"a": 1}, "url", "", "reply", queue_name=None,
+                                                       exchange_type="direct", serializer="json", headers=None,
+                                                       correlation_id="corr", compression=None,
+                                                       compress_threshold=None)
+
+    def test_publish_compressed(self):
+        body = {"a": "x" * 200}
+        rabbitmq.publish_message(MagicMock(), body, "memory://", "", "test-publish-compressed",
+                                 queue_name="test-publish-compressed", pooled=False, compression="zlib",
+                                 compress_threshold=100)
+        rabbitmq.publish_message(MagicMock(), {"a": 1}, "memory://", "", "test-publish-compressed",
+                                 queue_name="test-publish-compressed", pooled=False, compression="zlib",
+                                 compress_threshold=100)
+        with Connection("memory://") as conn:
+            queue = conn.SimpleQueue("test-publish-compressed")
+            message = queue.get(timeout=1)
+            self.assertEqual(message.headers["compression"], "application/x-gzip")
+            self.assertEqual(message.payload, body)
+            message = queue.get(timeout=1)
+            self.assertNotIn("compression", message.headers)
+            self.assertEqual(message.payload, {"a": 1})
+            queue.close()
+
+    def test_pooled_replies_share_emitter(self):
+        pool = rabbitmq.EmitterPool()
+        self.addCleanup(pool.release_all)
+        with Connection("memory://") as conn:
+            queues = [conn.SimpleQueue("test-pooled-reply-{}".format(number)) for number in range(2)]
+            for number, queue in enumerate(queues):
+                pool.send_message(MagicMock(), {"n": number}, "memory://", "", queue.queue.name,
+                                  correlation_id="corr")
+            self.assertEqual(len(pool), 1)
+            for number, queue in enumerate(queues):
+                message = queue.get(timeout=1)
+                self.assertEqual(message.payload, {"n": number})
+                self.assertEqual(message.properties["correlation_id"], "corr")
+                queue.close()
+
+    @patch("feeder_utilities.dependencies.rabbitmq.Emitter")
+    @patch("feeder_utilities.dependencies.rabbitmq._emitter_pool")
+    def test_publish_unpooled(self, mock_pool, mock_emitter):
+        rabbitmq.publish_message(MagicMock(), {"a": 1}, "url", "", "reply", pooled=False)
+        mock_pool.send_message.assert_not_called()
+        mock_emitter.return_value.__enter__.return_value.send_message.assert_called_once()
+
+
+class TestErrorQueueClientBulkRequeue(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.url = "memory://"
+        with Connection(self.url) as conn:
+            channel = conn.channel()
+            for name in ("bulk_error_queue", "bulk_queue"):
+                Queue(name)(channel).declare()
+                channel.queue_purge(name)
+            producer = Producer(channel, routing_key="bulk_error_queue")
+            for number in range(25):
+                producer.publish({"entry_number": number}, serializer="json",
+                                 headers={"X-Trace-ID": "trace-{}".format(number)},
+                                 message_id="message-{}".format(number), correlation_id="corr")
+
+    def test_bulk_requeue(self):
+        client = rabbitmq.ErrorQueueClient(MagicMock(), self.url, "bulk_queue", "bulk_error_queue")
+        result = client.bulk_requeue_messages(batch_size=10, confirm=False)
+        self.assertEqual(result["requeued_count"], 25)
+        self.assertEqual(result["batches"], 3)
+        self.assertIn("messages_per_second", result)
+        self.assertEqual(rabbitmq.get_queue_count(self.url, "bulk_error_queue"), 0)
+        self.assertEqual(rabbitmq.get_queue_count(self.url, "bulk_queue"), 25)
+        with Connection(self.url) as conn:
+            message = Queue("bulk_queue")(conn.channel()).get()
+            self.assertEqual(message.payload, {"entry_number": 0})
+            self.assertEqual(message.headers["X-Trace-ID"], "trace-0")
+            self.assertEqual(message.properties["message_id"], "message-0")
+            self.assertEqual(message.properties["correlation_id"], "corr")
+
+
+class TestErrorQueueClientIterMessages(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.url = "memory://"
+        with Connection(self.url) as conn:
+            channel = conn.channel()
+            Queue("iter_error_queue")(channel).declare()
+            channel.queue_purge("iter_error_queue")
+            producer = Producer(channel, routing_key="iter_error_queue")
+            for number in range(10):
+                producer.publish({"entry_number": number}, serializer="json", headers={"number": number})
+        self.client = rabbitmq.ErrorQueueClient(MagicMock(), self.url, "queue", "iter_error_queue")
+
+    def test_iter_messages_page(self):
+        messages = list(self.client.iter_messages(offset=2, limit=3))
+        self.assertEqual(messages, [{"body": {"entry_number": number}, "headers": {"number": number}}
+                                    for number in (2, 3, 4)])
+        self.assertEqual(rabbitmq.get_queue_count(self.url, "iter_error_queue"), 10)
+
+    def test_iter_messages_page_prefetch(self):
+        qos = rabbitmq.Consumer.qos
+        with patch.object(rabbitmq.Consumer, "qos", autospec=True, side_effect=qos) as mock_qos:
+            self.assertEqual(len(list(self.client.iter_messages(offset=2, limit=3))), 3)
+        mock_qos.assert_called_once_with(ANY, prefetch_count=5)
+
+    def test_iter_messages_closed_early(self):
+        messages = self.client.iter_messages()
+        next(messages)
+        messages.close()
+        self.assertEqual(rabbitmq.get_queue_count(self.url, "iter_error_queue"), 10)
+        self.assertEqual(len(list(self.client.iter_messages())), 10)
+
+
+class TestPublishConfirms(TestCase):
+
+    def test_tracks_acks(self):
+        confirms = rabbitmq._PublishConfirms(MagicMock())
+        for _ in range(4):
+            confirms.on_publish()
+        confirms.on_ack(1, False)
+        self.assertEqual(confirms.outstanding, {2, 3, 4})
+        confirms.on_ack(3, True)
+        self.assertEqual(confirms.outstanding, {4})
+
+    def test_wait_raises_on_nack(self):
+        confirms = rabbitmq._PublishConfirms(MagicMock())
+        confirms.on_publish()
+        conn = MagicMock()
+        conn.drain_events.side_effect = lambda timeout: confirms.on_nack(1, False)
+        with self.assertRaises(ErrorQueueException):
+            confirms.wait(conn, 1)
+
+
+class TestWorker(TestCase):
+
+    @patch("feeder_utilities.dependencies.rabbitmq.Consumer")
+    def test_get_consumers_prefetch(self, mock_consumer):
+        consumers = [MagicMock(), MagicMock()]
+        mock_consumer.side_effect = consumers
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [], prefetch_count=10, rpc_prefetch_count=1)
+        self.assertEqual(worker.get_consumers(None, MagicMock()), consumers)
+        consumers[0].qos.assert_called_once_with(prefetch_count=10)
+        consumers[1].qos.assert_called_once_with(prefetch_count=1)
+
+    @patch("feeder_utilities.dependencies.rabbitmq.Consumer")
+    def test_get_consumers_no_prefetch(self, mock_consumer):
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [])
+        worker.get_consumers(None, MagicMock())
+        mock_consumer.return_value.qos.assert_not_called()
+
+    def test_consume_virtual_transport(self):
+        handled = []
+
+        def process(body, message, requests):
+            handled.append(body)
+            message.ack()
+            worker.should_stop = True
+
+        queue = Queue("test-worker-memory", routing_key="test-worker-memory")
+        rpc_queue = Queue("test-worker-memory-rpc", routing_key="test-worker-memory-rpc")
+        with Connection("memory://") as conn:
+            Producer(conn.default_channel).publish({"a": 1}, routing_key=queue.name, declare=[queue])
+            worker = rabbitmq.Worker(MagicMock(), Connection("memory://", transport_options={"polling_interval": 0}),
+                                     [queue], [rpc_queue], process)
+            worker.run()
+        self.assertEqual(handled, [{"a": 1}])
+        self.assertTrue(worker.rpc_channel.closed)
+
+    def test_rpc_thread_not_blocked_by_main_queue(self):
+        rpc_handled = threading.Event()
+        handled = []
+
+        def process(body, message, requests):
+            # Blocks the main consumer until the RPC has been handled
+            handled.append(rpc_handled.wait(5))
+            message.ack()
+            worker.should_stop = True
+
+        def process_rpc(body, message, requests):
+            message.ack()
+            rpc_handled.set()
+
+        queue = Queue("test-worker-rpc-thread", routing_key="test-worker-rpc-thread")
+        rpc_queue = Queue("test-worker-rpc-thread-rpc", routing_key="test-worker-rpc-thread-rpc")
+        with Connection("memory://") as conn:
+            producer = Producer(conn.default_channel)
+            producer.publish({"a": 1}, routing_key=queue.name, declare=[queue])
+            producer.publish({"method": "health"}, routing_key=rpc_queue.name, declare=[rpc_queue])
+            worker = rabbitmq.Worker(MagicMock(), Connection("memory://", transport_options={"polling_interval": 0}),
+                                     [queue], [rpc_queue], process, process_rpc, rpc_thread=True)
+            worker.run()
+        self.assertEqual(handled, [True])
+        self.assertIsNone(worker.rpc_channel)
+        self.assertIsNone(worker._rpc_thread)
+
+    @patch("feeder_utilities.dependencies.rabbitmq.Consumer")
+    def test_rpc_thread_consumers(self, mock_consumer):
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [], rpc_prefetch_count=1, rpc_thread=True)
+        self.assertEqual(worker.get_consumers(None, MagicMock()), [mock_consumer.return_value])
+        rpc_channel = MagicMock()
+        rpc_consumer = rabbitmq._RpcConsumer(worker).get_consumers(None, rpc_channel)[0]
+        self.assertEqual(mock_consumer.call_args[0][0], rpc_channel)
+        rpc_consumer.qos.assert_called_with(prefetch_count=1)
+
+    def test_rpc_thread_error_reraised(self):
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [], rpc_thread=True)
+        worker._rpc_consumer = MagicMock()
+        worker._rpc_consumer.run.side_effect = ValueError("bad")
+        worker._run_rpc_consumer()
+        with self.assertRaises(ValueError):
+            worker.on_iteration()
+
+    def batch_message(self, delivery_tag):
+        message = MagicMock(delivery_tag=delivery_tag, acknowledged=False)
+        message.headers = {}
+        return message
+
+    def test_batch_by_size_multiple_ack(self):
+        process_batch = MagicMock()
+        connection = MagicMock()
+        connection.transport.driver_type = 'amqp'
+        worker = rabbitmq.Worker(MagicMock(), connection, [], [], process_batch_func=process_batch, batch_size=2)
+        messages = [self.batch_message(1), self.batch_message(2)]
+        worker.handle_message({"a": 1}, messages[0])
+        process_batch.assert_not_called()
+        worker.handle_message({"a": 2}, messages[1])
+        self.assertEqual(process_batch.call_args[0][0], [({"a": 1}, messages[0]), ({"a": 2}, messages[1])])
+        messages[1].channel.basic_ack.assert_called_once_with(2, multiple=True)
+        messages[0].channel.basic_ack.assert_not_called()
+
+    def test_batch_skips_settled_messages(self):
+        def process_batch(batch, requests):
+            batch[1][1].acknowledged = True
+
+        connection = MagicMock()
+        connection.transport.driver_type = 'amqp'
+        worker = rabbitmq.Worker(MagicMock(), connection, [], [], process_batch_func=process_batch, batch_size=2)
+        messages = [self.batch_message(1), self.batch_message(2)]
+        worker.handle_message({"a": 1}, messages[0])
+        worker.handle_message({"a": 2}, messages[1])
+        messages[0].channel.basic_ack.assert_called_once_with(1, multiple=True)
+
+    @patch("feeder_utilities.dependencies.rabbitmq.time.monotonic")
+    def test_batch_by_time_virtual_transport(self, mock_monotonic):
+        process_batch = MagicMock()
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [], process_batch_func=process_batch, batch_size=10,
+                                 batch_timeout=2)
+        messages = [self.batch_message(1), self.batch_message(2)]
+        mock_monotonic.return_value = 100
+        worker.handle_message({"a": 1}, messages[0])
+        worker.handle_message({"a": 2}, messages[1])
+        mock_monotonic.return_value = 101.9
+        worker.on_iteration()
+        process_batch.assert_not_called()
+        mock_monotonic.return_value = 102
+        worker.on_iteration()
+        self.assertEqual(len(process_batch.call_args[0][0]), 2)
+        for message in messages:
+            message.ack.assert_called_once_with()
+        worker.on_iteration()
+        process_batch.assert_called_once()
+
+    def test_batch_error_not_acked(self):
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [],
+                                 process_batch_func=MagicMock(side_effect=ValueError("bad")), batch_size=1)
+        message = self.batch_message(1)
+        with self.assertRaises(ValueError):
+            worker.handle_message({"a": 1}, message)
+        message.ack.assert_not_called()
+        message.channel.basic_ack.assert_not_called()
+        self.assertEqual(worker._batch, [])
+
+    def test_batch_with_max_workers(self):
+        with self.assertRaises(ValueError):
+            rabbitmq.Worker(MagicMock(), MagicMock(), [], [], process_batch_func=MagicMock(), max_workers=2)
+
+    def test_consume_batches_virtual_transport(self):
+        batches = []
+
+        def process_batch(batch, requests):
+            batches.append([body for body, message in batch])
+            if sum(len(batch) for batch in batches) == 3:
+                worker.should_stop = True
+
+        queue = Queue("test-worker-batch", routing_key="test-worker-batch")
+        with Connection("memory://") as conn:
+            producer = Producer(conn.default_channel)
+            for number in range(3):
+                producer.publish({"a": number}, routing_key=queue.name, declare=[queue])
+            worker = rabbitmq.Worker(MagicMock(), Connection("memory://", transport_options={"polling_interval": 0}),
+                                     [queue], [Queue("test-worker-batch-rpc")], process_batch_func=process_batch,
+                                     batch_size=2, batch_timeout=0.01)
+            worker.run()
+        self.assertEqual(batches, [[{"a": 0}, {"a": 1}], [{"a": 2}]])
+
+    def test_dedup_skips_processed_messages(self):
+        process = MagicMock()
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [], process, dedup=DedupCache(entry_number_key))
+        first, duplicate, other = MagicMock(), MagicMock(), MagicMock()
+        worker.handle_message({"entry_number": 1}, first)
+        worker.handle_message({"entry_number": 1}, duplicate)
+        worker.handle_message({"entry_number": 2}, other)
+        self.assertEqual([call[0][0] for call in process.call_args_list], [{"entry_number": 1}, {"entry_number": 2}])
+        duplicate.ack.assert_called_once_with()
+        self.assertEqual(worker.dedup.stats()["hits"], 1)
+
+    def test_dedup_not_added_when_rejected_or_failed(self):
+        def process(body, message, requests):
+            if body["action"] == "reject":
+                message.reject()
+            elif body["action"] == "fail":
+                raise ValueError("bad")
+
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [], process, dedup=DedupCache(entry_number_key))
+        message = MagicMock()
+        worker.handle_message({"entry_number": 1, "action": "reject"}, message)
+        message.reject.assert_called_once_with()
+        with self.assertRaises(ValueError):
+            worker.handle_message({"entry_number": 2, "action": "fail"}, MagicMock())
+        self.assertFalse(worker.dedup.seen("1"))
+        self.assertFalse(worker.dedup.seen("2"))
+
+    def test_dedup_batch(self):
+        process_batch = MagicMock()
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [], process_batch_func=process_batch, batch_size=3,
+                                 dedup=DedupCache(entry_number_key))
+        worker.dedup.add("1")
+        messages = [self.batch_message(1), self.batch_message(2), self.batch_message(3)]
+        for message in messages:
+            worker.handle_message({"entry_number": 1 if message.delivery_tag < 3 else 2}, message)
+        self.assertEqual([body for body, message in process_batch.call_args[0][0]], [{"entry_number": 2}])
+        for message in messages:
+            message.ack.assert_called_once_with()
+        self.assertTrue(worker.dedup.seen("2"))
+
+    @patch("feeder_utilities.dependencies.rabbitmq.Consumer")
+    def test_throttle_prefetch(self, mock_consumer):
+        consumers = [MagicMock(), MagicMock()]
+        mock_consumer.side_effect = consumers
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [], prefetch_count=10,
+                                 throttle=AdaptiveThrottle(1, initial_limit=3))
+        worker.get_consumers(None, MagicMock())
+        consumers[0].qos.assert_called_once_with(prefetch_count=3)
+        consumers[1].qos.assert_not_called()
+
+    def test_throttle_records_failures(self):
+        def process(body, message, requests):
+            if body["action"] == "requeue":
+                message.requeue()
+            elif body["action"] == "fail":
+                raise ValueError("bad")
+            else:
+                message.ack()
+
+        throttle = AdaptiveThrottle(60, initial_limit=4, window=3)
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [], process, throttle=throttle)
+        worker.handle_message({"action": "ack"}, MagicMock())
+        worker.handle_message({"action": "requeue"}, MagicMock())
+        with self.assertRaises(ValueError):
+            worker.handle_message({"action": "fail"}, MagicMock())
+        self.assertAlmostEqual(throttle.error_rate, 2 / 3)
+        self.assertTrue(throttle.paused)
+
+    @patch("feeder_utilities.dependencies.rabbitmq.Consumer")
+    def test_throttle_applied_on_iteration(self, mock_consumer):
+        consumer = MagicMock()
+        mock_consumer.side_effect = [consumer, MagicMock()]
+        throttle = MagicMock(limit=2, paused=False)
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [], throttle=throttle)
+        worker.get_consumers(None, MagicMock())
+        consumer.qos.reset_mock()
+        worker.on_iteration()
+        consumer.qos.assert_not_called()
+
+        throttle.limit = 4
+        worker.on_iteration()
+        consumer.qos.assert_called_once_with(prefetch_count=4)
+
+        throttle.paused = True
+        throttle.error_rate = 0.5
+        worker.on_iteration()
+        worker.on_iteration()
+        consumer.cancel.assert_called_once_with()
+        consumer.consume.assert_not_called()
+
+        throttle.paused = False
+        worker.on_iteration()
+        consumer.consume.assert_called_once_with()
+
+    def test_throttle_with_batch(self):
+        with self.assertRaises(ValueError):
+            rabbitmq.Worker(MagicMock(), MagicMock(), [], [], process_batch_func=MagicMock(),
+                            throttle=AdaptiveThrottle(1))
+
+    def test_handle_message_serial(self):
+        process = MagicMock()
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [], process)
+        message = MagicMock()
+        worker.handle_message({"a": 1}, message)
+        self.assertEqual(process.call_args[0][:2], ({"a": 1}, message))
+
+    def test_handle_message_metrics(self):
+        handled = rabbitmq.MESSAGES.labels("main", "success").value
+        failed = rabbitmq.MESSAGES.labels("rpc", "error").value
+        observed = rabbitmq.MESSAGE_SECONDS.labels("main").count
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [], MagicMock(),
+                                 MagicMock(side_effect=ValueError("bad")))
+        worker.handle_message({"a": 1}, MagicMock())
+        with self.assertRaises(ValueError):
+            worker.handle_rpc_message({"a": 1}, MagicMock())
+        self.assertEqual(rabbitmq.MESSAGES.labels("main", "success").value, handled + 1)
+        self.assertEqual(rabbitmq.MESSAGES.labels("rpc", "error").value, failed + 1)
+        self.assertEqual(rabbitmq.MESSAGE_SECONDS.labels("main").count, observed + 1)
+
+    def test_on_message_stage_timings(self):
+        decoded = rabbitmq.STAGE_SECONDS.labels("main", "decode").count
+        acked = rabbitmq.STAGE_SECONDS.labels("main", "ack").count
+        logger = MagicMock()
+
+        def process(body, message, requests):
+            message.ack()
+
+        worker = rabbitmq.Worker(logger, MagicMock(), [], [], process)
+        message = MagicMock()
+        message.headers = {"X-Trace-ID": "trace"}
+        message.decode.return_value = {"a": 1}
+        worker.on_message(message)
+        message.ack.assert_called_once()
+        self.assertEqual(rabbitmq.STAGE_SECONDS.labels("main", "decode").count, decoded + 1)
+        self.assertEqual(rabbitmq.STAGE_SECONDS.labels("main", "ack").count, acked + 1)
+        logged = [call[0][1] for call in logger.log.call_args_list]
+        timings = [msg for msg in logged if msg.startswith("Message stage timings: ")]
+        self.assertEqual(len(timings), 1)
+        self.assertRegex(timings[0], r"decode=\S+s, handler=\S+s, http=\S+s, ack=\S+s \(0 HTTP requests\)")
+
+    def test_on_message_decode_error(self):
+        process = MagicMock()
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [], process)
+        message = MagicMock()
+        message.decode.side_effect = ValueError("not json")
+        with self.assertRaises(ValueError):
+            worker.on_message(message)
+        process.assert_not_called()
+
+    def test_handle_message_profiler(self):
+        process = MagicMock()
+        profiler = MagicMock()
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [], process, profiler=profiler)
+        message = MagicMock()
+        message.headers = {"X-Trace-ID": "trace"}
+        worker.handle_message({"a": 1}, message)
+        self.assertEqual(profiler.run.call_args[0][:4], ("main-trace", process, {"a": 1}, message))
+
+    def test_handle_message_concurrent_acks_on_connection_thread(self):
+        threads = []
+
+        def process(body, message, requests):
+            threads.append(threading.current_thread())
+            message.ack()
+
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [], process, max_workers=2)
+        message = MagicMock()
+        message.headers = {}
+        worker.handle_message({"a": 1}, message)
+        worker.shutdown()
+        self.assertNotEqual(threads, [threading.current_thread()])
+        message.ack.assert_not_called()
+        worker.on_iteration()
+        message.ack.assert_called_once()
+
+    def test_handle_message_concurrent_reraises_on_connection_thread(self):
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [], MagicMock(side_effect=ValueError("bad")),
+                                 max_workers=2)
+        worker.handle_message({"a": 1}, MagicMock())
+        worker.shutdown()
+        with self.assertRaises(ValueError):
+            worker.on_iteration()
+
+    def test_handle_message_concurrent_ordered_by_key(self):
+        processed = []
+
+        def process(body, message, requests):
+            time.sleep(0.001 * (5 - body["n"]))
+            processed.append((body["key"], body["n"]))
+
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [], process, max_workers=4,
+                                 ordering_key_func=lambda body, message: body["key"])
+        for n in range(5):
+            for key in ("a", "b"):
+                worker.handle_message({"key": key, "n": n}, MagicMock())
+        worker.shutdown()
+        for key in ("a", "b"):
+            self.assertEqual([n for k, n in processed if k == key], list(range(5)))
+
+    def test_handle_message_shares_session(self):
+        sessions = []
+        shared = MagicMock()
+        worker = rabbitmq.Worker(MagicMock(), MagicMock(), [], [], lambda body, message, requests: sessions.append(
+            requests), session=shared)
+        for trace_id in ("one", "two"):
+            message = MagicMock()
+            message.headers = {"X-Trace-ID": trace_id}
+            worker.handle_message({}, message)
+        self.assertEqual([traced.headers for traced in sessions], [{"X-Trace-ID": "one"}, {"X-Trace-ID": "two"}])
+        self.assertTrue(all(traced.session is shared for traced in sessions))
+
+
+class TestGetQueueCounts(TestCase):
+
+    @patch("feeder_utilities.dependencies.rabbitmq.Connection")
+    def test_single_connection(self, mock_connection):
+        conn = mock_connection.return_value.__enter__.return_value
+        conn.channel.return_value.queue_declare.side_effect = [("queue", 1, 0), ("rpc_queue", 2, 0),
+                                                               NotFound()]
+        counts = rabbitmq.get_queue_counts("url", ["queue", "rpc_queue", "error_queue"],
+                                           optional_queue_names=["error_queue"])
+        self.assertEqual(counts, {"queue": 1, "rpc_queue": 2, "error_queue": None})
+        mock_connection.assert_called_once()
+
+    @patch("feeder_utilities.dependencies.rabbitmq.Connection")
+    def test_missing_required_queue(self, mock_connection):
+        conn = mock_connection.return_value.__enter__.return_value
+        conn.channel.return_value.queue_declare.side_effect = NotFound()
+        with self.assertRaises(NotFound):
+            rabbitmq.get_queue_counts("url", ["queue"])
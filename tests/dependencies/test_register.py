@@ -1,6 +1,9 @@
 from unittest import TestCase
-from unittest.mock import MagicMock
+import json
+import requests
+from unittest.mock import MagicMock, patch
 from feeder_utilities.dependencies import register
+from feeder_utilities.entry_ranges import EntryRangeSet
 from feeder_utilities.exceptions import RegisterException
 
 
@@ -25,6 +28,19 @@ class TestRegister(TestCase):
             register.Register("register_url", "routing_key", mock_requests).max_entry()
         self.assertRegex(str(exc.exception), r".*Unable to retrieve register information.*")
 
+    def test_max_entry_metrics(self):
+        succeeded = register.REQUESTS.labels("max_entry", "success").value
+        failed = register.REQUESTS.labels("max_entry", "error").value
+        mock_requests = MagicMock()
+        mock_requests.get.return_value.status_code = 200
+        mock_requests.get.return_value.json.return_value = {"total-entries": 1}
+        register.Register("register_url", "routing_key", mock_requests).max_entry()
+        mock_requests.get.return_value.status_code = 500
+        with self.assertRaises(RegisterException):
+            register.Register("register_url", "routing_key", mock_requests).max_entry()
+        self.assertEqual(register.REQUESTS.labels("max_entry", "success").value, succeeded + 1)
+        self.assertEqual(register.REQUESTS.labels("max_entry", "error").value, failed + 1)
+
     def test_max_entry_invalid(self):
         mock_requests = MagicMock()
         mock_response = MagicMock()
@@ -45,6 +61,19 @@ class TestRegister(TestCase):
         response = register.Register("register_url", "routing_key", mock_requests).republish_entries([1])
         self.assertEqual(response, {"some-kind": "of-response"})
 
+    def test_republish_entries_ranges(self):
+        mock_requests = MagicMock()
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"entries_not_found": [3], "republished_entries": [1, 2]}
+        mock_requests.post.return_value = mock_response
+        response = register.Register("register_url", "routing_key", mock_requests).republish_entries(
+            EntryRangeSet([(1, 3)]))
+        self.assertEqual(json.loads(mock_requests.post.call_args[1]["data"]),
+                         {"entries": [1, 2, 3], "routing_key": "routing_key"})
+        self.assertEqual(response, {"entries_not_found": EntryRangeSet([(3, 3)]),
+                                    "republished_entries": EntryRangeSet([(1, 2)])})
+
     def test_republish_entries_500(self):
         mock_requests = MagicMock()
         mock_response = MagicMock()
@@ -54,3 +83,92 @@ class TestRegister(TestCase):
         with self.assertRaises(RegisterException) as exc:
             register.Register("register_url", "routing_key", mock_requests).republish_entries([1])
         self.assertRegex(str(exc.exception), r".*Unable to republish enties.*")
+
+    def mock_republish_response(self, status_code=200):
+        def post(url, data, headers):
+            entries = json.loads(data)["entries"]
+            mock_response = MagicMock()
+            mock_response.status_code = status_code
+            mock_response.json.return_value = {"entries_not_found": [entry for entry in entries if entry > 8],
+                                               "republished_entries": [entry for entry in entries if entry <= 8]}
+            return mock_response
+        return post
+
+    @patch("feeder_utilities.dependencies.register.report_progress")
+    def test_republish_entries_chunked(self, mock_report_progress):
+        mock_requests = MagicMock()
+        mock_requests.post.side_effect = self.mock_republish_response()
+        response = register.Register("register_url", "routing_key", mock_requests).republish_entries(
+            EntryRangeSet([(1, 10)]), chunk_size=4, max_workers=2)
+        self.assertEqual(sorted(json.loads(call[1]["data"])["entries"]
+                                for call in mock_requests.post.call_args_list),
+                         [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10]])
+        self.assertEqual(response["republished_entries"], EntryRangeSet([(1, 8)]))
+        self.assertEqual(response["entries_not_found"], EntryRangeSet([(9, 10)]))
+        self.assertEqual(response["failed_entries"], EntryRangeSet())
+        self.assertEqual([(chunk["index"], chunk["count"], chunk["attempts"]) for chunk in response["chunks"]],
+                         [(0, 4, 1), (1, 4, 1), (2, 2, 1)])
+        mock_report_progress.assert_called_with(chunks_done=3, chunks_total=3)
+
+    @patch("feeder_utilities.dependencies.register.time.sleep")
+    def test_republish_entries_chunked_retries(self, mock_sleep):
+        mock_requests = MagicMock()
+        responses = [self.mock_republish_response(500), self.mock_republish_response()]
+        mock_requests.post.side_effect = lambda *args, **kwargs: responses.pop(0)(*args, **kwargs)
+        response = register.Register("register_url", "routing_key", mock_requests).republish_entries(
+            [1, 2], chunk_size=4, backoff=2)
+        self.assertEqual(response["republished_entries"], EntryRangeSet([(1, 2)]))
+        self.assertEqual(response["chunks"][0]["attempts"], 2)
+        mock_sleep.assert_called_once_with(2)
+
+    @patch("feeder_utilities.dependencies.register.time.sleep")
+    def test_republish_entries_chunked_partial_failure(self, mock_sleep):
+        mock_requests = MagicMock()
+        mock_republish = self.mock_republish_response()
+        mock_failure = self.mock_republish_response(500)
+        mock_requests.post.side_effect = lambda url, data, headers: (
+            mock_failure if json.loads(data)["entries"][0] == 5 else mock_republish)(url, data, headers)
+        response = register.Register("register_url", "routing_key", mock_requests).republish_entries(
+            EntryRangeSet([(1, 8)]), chunk_size=4, retries=1)
+        self.assertEqual(response["republished_entries"], EntryRangeSet([(1, 4)]))
+        self.assertEqual(response["failed_entries"], EntryRangeSet([(5, 8)]))
+        self.assertEqual(response["chunks"][1]["attempts"], 2)
+        self.assertRegex(response["chunks"][1]["error"], r".*Unable to republish enties.*")
+
+    @patch("feeder_utilities.dependencies.register.time.sleep")
+    def test_republish_entries_chunked_client_error_not_retried(self, mock_sleep):
+        mock_requests = MagicMock()
+        mock_requests.post.side_effect = self.mock_republish_response(400)
+        response = register.Register("register_url", "routing_key", mock_requests).republish_entries(
+            [1, 2], chunk_size=4, retries=3)
+        self.assertEqual(response["failed_entries"], EntryRangeSet([(1, 2)]))
+        self.assertEqual(response["chunks"][0]["attempts"], 1)
+        self.assertRegex(response["chunks"][0]["error"], r".*Unable to republish enties.*")
+        mock_sleep.assert_not_called()
+
+    @patch("feeder_utilities.dependencies.register.time.sleep")
+    def test_republish_entries_chunked_connection_error_retried(self, mock_sleep):
+        mock_requests = MagicMock()
+        responses = [requests.exceptions.ConnectionError("refused"), requests.exceptions.Timeout("slow")]
+        republish = self.mock_republish_response()
+
+        def post(*args, **kwargs):
+            if responses:
+                raise responses.pop(0)
+            return republish(*args, **kwargs)
+
+        mock_requests.post.side_effect = post
+        response = register.Register("register_url", "routing_key", mock_requests).republish_entries(
+            [1, 2], chunk_size=4, backoff=1)
+        self.assertEqual(response["republished_entries"], EntryRangeSet([(1, 2)]))
+        self.assertEqual(response["chunks"][0]["attempts"], 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    @patch("feeder_utilities.dependencies.register.TokenBucket")
+    def test_republish_entries_rate_limited(self, mock_bucket):
+        mock_requests = MagicMock()
+        mock_requests.post.side_effect = self.mock_republish_response()
+        register.Register("register_url", "routing_key", mock_requests).republish_entries(
+            EntryRangeSet([(1, 8)]), chunk_size=4, rate_limit=5)
+        mock_bucket.assert_called_once_with(5)
+        self.assertEqual(mock_bucket.return_value.acquire.call_count, 2)
@@ -0,0 +1,82 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import TestCase
+from unittest.mock import MagicMock
+from feeder_utilities.dependencies import session
+from feeder_utilities.dependencies.register import Register
+from feeder_utilities.exceptions import RegisterException
+
+
+class UnavailableStub(BaseHTTPRequestHandler):
+
+    """Answers every request with a 503, counting them in the server's `requests`."""
+
+    def do_GET(self):
+        self.server.requests += 1
+        self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestCreateSession(TestCase):
+
+    def test_pool_and_retries(self):
+        http_session = session.create_session(pool_size=20, retries=5)
+        adapter = http_session.get_adapter("https://register")
+        self.assertEqual(adapter._pool_maxsize, 20)
+        self.assertEqual(adapter.max_retries.total, 5)
+
+    def test_persistent_status_returns_response(self):
+        server = HTTPServer(("127.0.0.1", 0), UnavailableStub)
+        server.requests = 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = "http://127.0.0.1:{}".format(server.server_port)
+
+        http_session = session.create_session(retries=2, backoff_factor=0)
+        self.assertEqual(http_session.get(url).status_code, 503)
+        self.assertEqual(server.requests, 3)
+        with self.assertRaises(RegisterException):
+            Register(url, "routing_key", http_session).max_entry()
+
+
+class TestTracedSession(TestCase):
+
+    def test_adds_trace_header(self):
+        shared = MagicMock()
+        traced = session.TracedSession(shared, "trace")
+        traced.get("http://register/register")
+        shared.request.assert_called_once_with("GET", "http://register/register", headers={"X-Trace-ID": "trace"},
+                                               allow_redirects=True)
+
+    def test_merges_request_headers_and_timeout(self):
+        shared = MagicMock()
+        traced = session.TracedSession(shared, "trace", timeout=5)
+        traced.headers["X-Extra"] = "extra"
+        traced.post("http://register/entries/republish", data="{}", headers={"Content-type": "application/json"})
+        shared.request.assert_called_once_with("POST", "http://register/entries/republish",
+                                               headers={"X-Trace-ID": "trace", "X-Extra": "extra",
+                                                        "Content-type": "application/json"},
+                                               data="{}", json=None, timeout=5)
+
+    def test_counts_requests(self):
+        traced = session.TracedSession(MagicMock(), "trace")
+        traced.get("http://register/register")
+        traced.get("http://register/register")
+        self.assertEqual(traced.http_requests, 2)
+        self.assertGreaterEqual(traced.http_seconds, 0)
+
+    def test_does_not_modify_shared_session(self):
+        shared = MagicMock()
+        shared.headers = {}
+        session.TracedSession(shared, "one").headers["X-Extra"] = "extra"
+        self.assertEqual(shared.headers, {})
+
+    def test_passes_through(self):
+        shared = MagicMock()
+        traced = session.TracedSession(shared, "trace")
+        self.assertIs(traced.cookies, shared.cookies)
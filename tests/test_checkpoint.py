@@ -0,0 +1,71 @@
+import os
+import sqlite3
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from feeder_utilities.checkpoint import FileCheckpointStore, SqliteCheckpointStore
+
+
+class TestFileCheckpointStore(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "checkpoint.json")
+
+    def test_get_empty(self):
+        self.assertIsNone(FileCheckpointStore(self.path).get())
+
+    def test_set_get(self):
+        FileCheckpointStore(self.path).set(10)
+        self.assertEqual(FileCheckpointStore(self.path).get(), 10)
+
+    def test_names_independent(self):
+        FileCheckpointStore(self.path, name='a').set(1)
+        FileCheckpointStore(self.path, name='b').set(2)
+        self.assertEqual(FileCheckpointStore(self.path, name='a').get(), 1)
+        self.assertEqual(FileCheckpointStore(self.path, name='b').get(), 2)
+
+    def test_corrupt_file(self):
+        with open(self.path, 'w') as checkpoint_file:
+            checkpoint_file.write("{not json")
+        store = FileCheckpointStore(self.path)
+        self.assertIsNone(store.get())
+        store.set(3)
+        self.assertEqual(store.get(), 3)
+
+
+class TestSqliteCheckpointStore(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "checkpoint.db")
+
+    def test_get_empty(self):
+        self.assertIsNone(SqliteCheckpointStore(self.path).get())
+
+    def test_set_get(self):
+        store = SqliteCheckpointStore(self.path)
+        store.set(10)
+        store.set(12)
+        self.assertEqual(SqliteCheckpointStore(self.path).get(), 12)
+
+    def test_connections_closed(self):
+        connections = []
+        real_connect = sqlite3.connect
+
+        def connect(path):
+            connections.append(real_connect(path))
+            return connections[-1]
+
+        with patch("feeder_utilities.checkpoint.sqlite3.connect", side_effect=connect):
+            store = SqliteCheckpointStore(self.path)
+            store.set(3)
+            self.assertEqual(store.get(), 3)
+        self.assertEqual(len(connections), 3)
+        for conn in connections:
+            with self.assertRaises(sqlite3.ProgrammingError):
+                conn.execute("SELECT 1")
@@ -0,0 +1,110 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from feeder_utilities import dedup
+
+
+class TestKeyFunctions(TestCase):
+
+    def test_message_id_key(self):
+        message = MagicMock()
+        message.properties = {"message_id": "abc"}
+        message.headers = {}
+        self.assertEqual(dedup.message_id_key({}, message), "abc")
+        message.properties = {}
+        message.headers = {"message_id": "def"}
+        self.assertEqual(dedup.message_id_key({}, message), "def")
+        message.headers = {}
+        self.assertIsNone(dedup.message_id_key({}, message))
+
+    def test_entry_number_key(self):
+        self.assertEqual(dedup.entry_number_key({"entry_number": 5}, MagicMock()), 5)
+        self.assertIsNone(dedup.entry_number_key({"other": 5}, MagicMock()))
+        self.assertIsNone(dedup.entry_number_key([5], MagicMock()))
+
+    def test_body_hash_key_ignores_key_order(self):
+        self.assertEqual(dedup.body_hash_key({"a": 1, "b": 2}, MagicMock()),
+                         dedup.body_hash_key({"b": 2, "a": 1}, MagicMock()))
+        self.assertNotEqual(dedup.body_hash_key({"a": 1}, MagicMock()), dedup.body_hash_key({"a": 2}, MagicMock()))
+
+
+class TestDedupCache(TestCase):
+
+    def test_key_is_string(self):
+        cache = dedup.DedupCache(dedup.entry_number_key)
+        self.assertEqual(cache.key({"entry_number": 5}, MagicMock()), "5")
+        self.assertIsNone(cache.key({}, MagicMock()))
+
+    def test_seen_and_stats(self):
+        cache = dedup.DedupCache()
+        self.assertFalse(cache.seen("a"))
+        cache.add("a")
+        self.assertTrue(cache.seen("a"))
+        self.assertTrue(cache.seen("a"))
+        self.assertEqual(cache.stats(), {"size": 1, "hits": 2, "misses": 1, "hit_rate": 0.6667})
+
+    def test_no_lookups_stats(self):
+        self.assertIsNone(dedup.DedupCache().stats()["hit_rate"])
+
+    @patch("feeder_utilities.dedup.time")
+    def test_ttl(self, mock_time):
+        cache = dedup.DedupCache(ttl=10)
+        mock_time.time.return_value = 100
+        cache.add("a")
+        mock_time.time.return_value = 109
+        self.assertTrue(cache.seen("a"))
+        mock_time.time.return_value = 110
+        self.assertFalse(cache.seen("a"))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_least_recently_seen_dropped(self):
+        cache = dedup.DedupCache(max_size=2)
+        cache.add("a")
+        cache.add("b")
+        cache.seen("a")
+        cache.add("c")
+        self.assertTrue(cache.seen("a"))
+        self.assertFalse(cache.seen("b"))
+        self.assertTrue(cache.seen("c"))
+
+
+class TestSqliteDedupStore(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "dedup.db")
+
+    def test_keys_kept_over_restart(self):
+        store = dedup.SqliteDedupStore(self.path)
+        cache = dedup.DedupCache(store=store)
+        cache.add("a")
+        cache.add("b")
+        store.close()
+
+        store = dedup.SqliteDedupStore(self.path)
+        self.addCleanup(store.close)
+        cache = dedup.DedupCache(store=store)
+        self.assertTrue(cache.seen("a"))
+        self.assertTrue(cache.seen("b"))
+        self.assertFalse(cache.seen("c"))
+
+    def test_load_skips_expired_and_limits(self):
+        store = dedup.SqliteDedupStore(self.path)
+        self.addCleanup(store.close)
+        store.add("expired", 50)
+        store.add("old", 150)
+        store.add("new", 200)
+        store.add("newest", 300)
+        self.assertEqual(store.load(100, 2), [("new", 200), ("newest", 300)])
+        self.assertEqual(store.load(0, 10), [("old", 150), ("new", 200), ("newest", 300)])
+
+    @patch("feeder_utilities.dedup.time")
+    def test_prune(self, mock_time):
+        store = dedup.SqliteDedupStore(self.path, prune_interval=2)
+        self.addCleanup(store.close)
+        mock_time.time.return_value = 100
+        store.add("expired", 50)
+        store.add("live", 150)
+        self.assertEqual(store._conn.execute("SELECT key FROM dedup_keys").fetchall(), [("live",)])
@@ -0,0 +1,62 @@
+from unittest import TestCase
+from feeder_utilities.entry_ranges import EntryRangeSet
+
+
+class TestEntryRangeSet(TestCase):
+
+    def test_from_entries(self):
+        entries = EntryRangeSet.from_entries([10, 3, 1, 2, 7, 9, 2])
+        self.assertEqual(entries.ranges(), [(1, 3), (7, 7), (9, 10)])
+        self.assertEqual(list(entries), [1, 2, 3, 7, 9, 10])
+        self.assertEqual(len(entries), 6)
+        self.assertEqual(str(entries), "1-3,7,9-10")
+
+    def test_merges_overlapping_and_adjacent_ranges(self):
+        self.assertEqual(EntryRangeSet([(5, 8), (1, 3), (4, 4), (7, 12)]).ranges(), [(1, 12)])
+
+    def test_empty(self):
+        entries = EntryRangeSet()
+        self.assertFalse(entries)
+        self.assertEqual(len(entries), 0)
+        self.assertEqual(list(entries), [])
+        self.assertEqual(entries.to_json(), {"ranges": [], "count": 0})
+
+    def test_contains(self):
+        entries = EntryRangeSet([(1, 3), (10, 20)])
+        self.assertIn(1, entries)
+        self.assertIn(15, entries)
+        self.assertNotIn(0, entries)
+        self.assertNotIn(4, entries)
+        self.assertNotIn(21, entries)
+
+    def test_json_round_trip(self):
+        entries = EntryRangeSet([(1, 1000000), (1000005, 1000005)])
+        self.assertEqual(entries.to_json(), {"ranges": [[1, 1000000], [1000005, 1000005]], "count": 1000001})
+        self.assertEqual(EntryRangeSet.from_json(entries.to_json()), entries)
+        self.assertEqual(EntryRangeSet.from_json([1, 2, 5]), EntryRangeSet([(1, 2), (5, 5)]))
+
+    def test_coerce(self):
+        entries = EntryRangeSet([(1, 2)])
+        self.assertIs(EntryRangeSet.coerce(entries), entries)
+        self.assertEqual(EntryRangeSet.coerce([2, 1]), entries)
+        self.assertEqual(EntryRangeSet.coerce({"ranges": [[1, 2]], "count": 2}), entries)
+        self.assertEqual(EntryRangeSet.coerce(None), EntryRangeSet())
+
+    def test_union(self):
+        self.assertEqual((EntryRangeSet([(1, 3), (10, 12)]) | EntryRangeSet([(4, 5), (11, 20)])).ranges(),
+                         [(1, 5), (10, 20)])
+
+    def test_difference(self):
+        entries = EntryRangeSet([(1, 10), (20, 30)])
+        self.assertEqual((entries - EntryRangeSet([(3, 4), (8, 22), (30, 40)])).ranges(),
+                         [(1, 2), (5, 7), (23, 29)])
+        self.assertEqual((entries - [1, 2, 3]).ranges(), [(4, 10), (20, 30)])
+        self.assertEqual((entries - EntryRangeSet([(0, 100)])).ranges(), [])
+        self.assertEqual((entries - EntryRangeSet()).ranges(), entries.ranges())
+
+    def test_chunks(self):
+        entries = EntryRangeSet([(1, 5), (8, 8), (10, 13)])
+        self.assertEqual([chunk.ranges() for chunk in entries.chunks(4)],
+                         [[(1, 4)], [(5, 5), (8, 8), (10, 11)], [(12, 13)]])
+        self.assertEqual([chunk.ranges() for chunk in entries.chunks(10)], [[(1, 5), (8, 8), (10, 13)]])
+        self.assertEqual(list(EntryRangeSet().chunks(4)), [])
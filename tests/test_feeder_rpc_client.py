@@ -1,12 +1,19 @@
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
+from collections import OrderedDict
 from feeder_utilities import feeder_rpc_client
+import argparse
+import io
+import json
+import socket
 import sys
+import time
+from feeder_utilities.exceptions import RpcTimeoutException
 
 
 class TestFeederRpcClient(TestCase):
 
-    @patch('feeder_utilities.feeder_rpc_client.Queue')
+    @patch('kombu.Queue')
     def setUp(self, mock_queue):
         TestCase.setUp(self)
         self.connection = MagicMock()
@@ -15,73 +22,386 @@ class TestFeederRpcClient(TestCase):
         self.client = feeder_rpc_client.FeederRpcClient(self.connection, self.exchange, self.routing_key)
 
     def test_on_response_correlation_match(self):
-        self.assertIsNone(self.client.response)
+        pending = feeder_rpc_client._PendingCall("aardvark")
+        self.client.pending["aardvark"] = pending
         message = MagicMock()
         message.properties = {"correlation_id": "aardvark"}
         message.payload = {"a": "payload"}
-        self.client.correlation_id = "aardvark"
         self.client.on_response(message)
-        self.assertEqual({"a": "payload"}, self.client.response)
+        self.assertEqual({"a": "payload"}, pending.future.result())
+        self.assertEqual(self.client.pending, {})
 
     def test_on_response_correlation_no_match(self):
-        self.assertIsNone(self.client.response)
+        pending = feeder_rpc_client._PendingCall("aardvark")
+        self.client.pending["aardvark"] = pending
         message = MagicMock()
         message.properties = {"correlation_id": "notaardvark"}
         message.payload = {"a": "payload"}
-        self.client.correlation_id = "aardvark"
         self.client.on_response(message)
-        self.assertIsNone(self.client.response)
+        self.assertFalse(pending.future.done())
 
-    def test_call_not_allowed(self):
+    @patch('kombu.Queue')
+    def test_call_not_allowed(self, mock_queue):
+        client = feeder_rpc_client.FeederRpcClient(self.connection, self.exchange, self.routing_key,
+                                                   allowed_methods=["health"])
         with self.assertRaises(Exception) as exc:
-            self.client.call("acab")
+            client.call("acab")
         self.assertEqual(str(exc.exception), "Method 'acab' not allowed")
 
-    @patch('feeder_utilities.feeder_rpc_client.Producer')
-    @patch('feeder_utilities.feeder_rpc_client.Consumer')
+    @patch('kombu.Producer')
+    @patch('kombu.Consumer')
+    def test_call_feeder_method(self, mock_consumer, mock_producer):
+        # No local allow-list by default, the feeder rejects methods it doesn't provide
+        self.connection.drain_events = self.mock_drain
+        self.client.call("reindex")
+        self.assertEqual(mock_producer.return_value.publish.call_args[0][0], {"method": "reindex"})
+
+    @patch('kombu.Producer')
+    @patch('kombu.Consumer')
     def test_call_ok(self, mock_consumer, mock_producer):
         self.connection.drain_events = self.mock_drain
         response = self.client.call("health")
-        mock_producer.return_value.__enter__.return_value.publish.assert_called()
+        mock_producer.return_value.publish.assert_called()
         self.assertEqual({"a": "payload"}, response)
 
-    def mock_drain(self):
+    @patch('kombu.Producer')
+    @patch('kombu.Consumer')
+    def test_call_params(self, mock_consumer, mock_producer):
+        self.connection.drain_events = self.mock_drain
+        self.client.call("requeue_errors", bulk=True)
+        publish = mock_producer.return_value.publish
+        self.assertEqual(publish.call_args[0][0], {"method": "requeue_errors", "bulk": True})
+
+    @patch('kombu.Producer')
+    @patch('kombu.Consumer')
+    def test_call_chunked(self, mock_consumer, mock_producer):
+        chunks = [{"success": True, "result": {"error_messages": [1, 2]}, "chunk": {"index": 0, "last": False}},
+                  {"success": True, "result": {"error_messages": [3]}, "chunk": {"index": 1, "last": True}}]
+        self.connection.drain_events = lambda: self.mock_drain(chunks.pop(0))
+        response = self.client.call("dump_error_queue", chunk_size=2)
+        self.assertEqual({"success": True, "result": {"error_messages": [1, 2, 3]}}, response)
+
+    @patch('kombu.Producer')
+    @patch('kombu.Consumer')
+    def test_iter_call_chunked(self, mock_consumer, mock_producer):
+        chunks = [{"success": True, "result": {"error_messages": [1, 2]}, "chunk": {"index": 0, "last": False}},
+                  {"success": True, "result": {"error_messages": [3]}, "chunk": {"index": 1, "last": True}}]
+        expected = list(chunks)
+        self.connection.drain_events = lambda: self.mock_drain(chunks.pop(0))
+        self.assertEqual(list(self.client.iter_call("dump_error_queue", chunk_size=2)), expected)
+
+    @patch('kombu.Producer')
+    @patch('kombu.Consumer')
+    def test_discover_methods(self, mock_consumer, mock_producer):
+        self.connection.drain_events = lambda: self.mock_drain(
+            {"success": True, "result": {"methods": ["health", "reindex"]}, "error": None})
+        self.assertEqual(self.client.discover_methods(), ["health", "reindex"])
+        self.assertEqual(mock_producer.return_value.publish.call_args[0][0], {"method": "list_methods"})
+        self.client.call("reindex")
+        self.assertEqual(mock_producer.return_value.publish.call_args[0][0], {"method": "reindex"})
+        with self.assertRaises(Exception):
+            self.client.call("acab")
+
+    def test_parse_param(self):
+        self.assertEqual(feeder_rpc_client.parse_param("bulk=true"), ("bulk", True))
+        self.assertEqual(feeder_rpc_client.parse_param("batch_size=10"), ("batch_size", 10))
+        self.assertEqual(feeder_rpc_client.parse_param("name=abc"), ("name", "abc"))
+
+    def test_parse_param_invalid(self):
+        with self.assertRaises(argparse.ArgumentTypeError):
+            feeder_rpc_client.parse_param("bulk")
+
+    def mock_drain(self, payload=None, timeout=None):
         message = MagicMock()
-        message.properties = {"correlation_id": self.client.correlation_id}
-        message.payload = {"a": "payload"}
+        message.properties = {"correlation_id": next(iter(self.client.pending))}
+        message.payload = payload or {"a": "payload"}
         self.client.on_response(message)
 
+    @patch('kombu.Producer')
+    @patch('kombu.Consumer')
+    def test_reply_queue_reused(self, mock_consumer, mock_producer):
+        self.connection.drain_events = self.mock_drain
+        self.client.call("health")
+        self.client.call("health")
+        mock_consumer.assert_called_once()
+        mock_consumer.return_value.consume.assert_called_once()
+        self.assertEqual(mock_producer.return_value.publish.call_count, 2)
+
+    @patch('kombu.Producer')
+    @patch('kombu.Consumer')
+    def test_call_many(self, mock_consumer, mock_producer):
+        publish = mock_producer.return_value.publish
+
+        def drain_events(timeout=None):
+            # Respond to the calls in reverse order
+            for call in reversed(publish.call_args_list):
+                message = MagicMock()
+                message.properties = {"correlation_id": call[1]["correlation_id"]}
+                message.payload = {"success": True, "result": {"feeder": call[1]["routing_key"]}, "error": None}
+                self.client.on_response(message)
+
+        self.connection.drain_events = drain_events
+        responses = self.client.call_many(["feeder1", ("other_exchange", "feeder2")], "health", timeout=5)
+        self.assertEqual(list(responses), ["feeder1", ("other_exchange", "feeder2")])
+        self.assertEqual(responses["feeder1"]["result"], {"feeder": "feeder1"})
+        self.assertEqual(responses[("other_exchange", "feeder2")]["result"], {"feeder": "feeder2"})
+        self.assertEqual(publish.call_args_list[0][1]["exchange"], self.exchange)
+        self.assertEqual(publish.call_args_list[1][1]["exchange"], "other_exchange")
+        self.assertEqual(self.client.pending, {})
+
+    @patch('feeder_utilities.feeder_rpc_client.time')
+    @patch('kombu.Producer')
+    @patch('kombu.Consumer')
+    def test_call_many_timeout(self, mock_consumer, mock_producer, mock_time):
+        mock_time.monotonic.return_value = 100
+        publish = mock_producer.return_value.publish
+
+        def drain_events(timeout=None):
+            message = MagicMock()
+            message.properties = {"correlation_id": publish.call_args_list[0][1]["correlation_id"]}
+            message.payload = {"success": True, "result": {}, "error": None}
+            self.client.on_response(message)
+            mock_time.monotonic.return_value += timeout
+            raise socket.timeout()
+
+        self.connection.drain_events = drain_events
+        responses = self.client.call_many(["feeder1", "feeder2"], "health", timeout=5)
+        self.assertTrue(responses["feeder1"]["success"])
+        self.assertEqual(responses["feeder2"],
+                         {"success": False, "result": None,
+                          "error": {"error_message": "No response from 'feeder2' within 5 seconds"}})
+        self.assertEqual(self.client.pending, {})
+
+    @patch('kombu.Producer')
+    @patch('kombu.Consumer')
+    def test_call_timeout_sets_deadline(self, mock_consumer, mock_producer):
+        self.connection.drain_events = self.mock_drain
+        self.client.call("health", timeout=10)
+        publish_kwargs = mock_producer.return_value.publish.call_args[1]
+        self.assertEqual(publish_kwargs["expiration"], 10)
+        self.assertAlmostEqual(publish_kwargs["headers"]["x-deadline"], time.time() + 10, delta=1)
+
+    @patch('kombu.Producer')
+    @patch('kombu.Consumer')
+    def test_call_sends_accept_header(self, mock_consumer, mock_producer):
+        self.connection.drain_events = self.mock_drain
+        self.client.call("health")
+        publish_kwargs = mock_producer.return_value.publish.call_args[1]
+        self.assertIn("application/x-gzip", publish_kwargs["headers"]["x-accept"])
+        self.assertNotIn("expiration", publish_kwargs)
+
+    @patch('feeder_utilities.feeder_rpc_client.time')
+    @patch('kombu.Producer')
+    @patch('kombu.Consumer')
+    def test_call_timeout(self, mock_consumer, mock_producer, mock_time):
+        mock_time.monotonic.return_value = 100
+        mock_time.time.return_value = 1000
+
+        def drain_events(timeout=None):
+            mock_time.monotonic.return_value += timeout
+            raise socket.timeout()
+
+        self.connection.drain_events = drain_events
+        with self.assertRaises(RpcTimeoutException) as exc:
+            self.client.call("health", timeout=3)
+        self.assertIn("within 3 seconds", str(exc.exception))
+        self.assertEqual(self.client.pending, {})
+
+    @patch('kombu.Producer')
+    @patch('kombu.Consumer')
+    def test_send_wait(self, mock_consumer, mock_producer):
+        self.connection.drain_events = self.mock_drain
+        future = self.client.send("health")
+        self.assertFalse(future.done())
+        self.assertEqual(self.client.wait([future]), set())
+        self.assertEqual(future.result(), {"a": "payload"})
+
+    @patch('feeder_utilities.feeder_rpc_client.time')
+    @patch('kombu.Producer')
+    @patch('kombu.Consumer')
+    def test_send_wait_timeout(self, mock_consumer, mock_producer, mock_time):
+        mock_time.monotonic.return_value = 100
+        mock_time.time.return_value = 1000
+
+        def drain_events(timeout=None):
+            self.assertEqual(timeout, 3)
+            mock_time.monotonic.return_value += timeout
+            raise socket.timeout()
+
+        self.connection.drain_events = drain_events
+        future = self.client.send("health", timeout=3)
+        self.assertEqual(self.client.wait([future]), set())
+        with self.assertRaises(RpcTimeoutException) as exc:
+            future.result()
+        self.assertIn("within 3 seconds", str(exc.exception))
+        self.assertEqual(self.client.pending, {})
+
+    @patch('feeder_utilities.feeder_rpc_client.time')
+    @patch('kombu.Producer')
+    @patch('kombu.Consumer')
+    def test_send_timeout_while_waiting_for_another(self, mock_consumer, mock_producer, mock_time):
+        mock_time.monotonic.return_value = 100
+        mock_time.time.return_value = 1000
+
+        def drain_events(timeout=None):
+            mock_time.monotonic.return_value += timeout
+            raise socket.timeout()
+
+        self.connection.drain_events = drain_events
+        sent = self.client.send("health", timeout=1)
+        with self.assertRaises(RpcTimeoutException):
+            self.client.call("health", timeout=3)
+        self.assertIsInstance(sent.exception(timeout=0), RpcTimeoutException)
+        self.assertEqual(self.client.pending, {})
+
 
 class TestFeederRpcClientMain(TestCase):
 
     @patch('feeder_utilities.feeder_rpc_client.FeederRpcClient')
-    @patch('feeder_utilities.feeder_rpc_client.Connection')
+    @patch('kombu.Connection')
     @patch("feeder_utilities.feeder_rpc_client.argparse.ArgumentParser")
     def test_main_ok(self, mock_arg_parse, mock_connection, mock_rpc_client):
         mock_rpc_client.return_value.call.return_value = {"a": "response", "success": True}
         mock_arg_parse.return_value.parse_args.return_valye.method = "health"
+        mock_arg_parse.return_value.parse_args.return_value.fleet = None
         feeder_rpc_client.main()
         mock_rpc_client.return_value.call.assert_called()
 
     @patch('feeder_utilities.feeder_rpc_client.FeederRpcClient')
-    @patch('feeder_utilities.feeder_rpc_client.Connection')
+    @patch('kombu.Connection')
     @patch("feeder_utilities.feeder_rpc_client.argparse.ArgumentParser")
     def test_main_fail(self, mock_arg_parse, mock_connection, mock_rpc_client):
         mock_rpc_client.return_value.call.return_value = {"a": "response", "success": False}
         mock_arg_parse.return_value.parse_args.return_value.method = "health"
+        mock_arg_parse.return_value.parse_args.return_value.fleet = None
         with self.assertRaises(SystemExit) as cm:
             feeder_rpc_client.main()
         self.assertEqual(cm.exception.code, 1)
         mock_rpc_client.return_value.call.assert_called()
 
     @patch('feeder_utilities.feeder_rpc_client.FeederRpcClient')
-    @patch('feeder_utilities.feeder_rpc_client.Connection')
+    @patch('kombu.Connection')
+    @patch("feeder_utilities.feeder_rpc_client.argparse.ArgumentParser")
+    def test_main_feeder_method(self, mock_arg_parse, mock_connection, mock_rpc_client):
+        mock_rpc_client.return_value.call.return_value = {"success": True, "result": {}}
+        args = mock_arg_parse.return_value.parse_args.return_value
+        args.method = "reindex"
+        args.fleet = None
+        args.timeout = 5
+        feeder_rpc_client.main()
+        mock_rpc_client.return_value.discover_methods.assert_not_called()
+        mock_rpc_client.return_value.call.assert_called_once_with("reindex", timeout=5)
+
+    @patch('feeder_utilities.feeder_rpc_client.FeederRpcClient')
+    @patch('kombu.Connection')
+    @patch("feeder_utilities.feeder_rpc_client.argparse.ArgumentParser")
+    def test_main_timeout(self, mock_arg_parse, mock_connection, mock_rpc_client):
+        mock_rpc_client.return_value.call.side_effect = RpcTimeoutException("No response")
+        mock_arg_parse.return_value.parse_args.return_value.timeout = 5
+        mock_arg_parse.return_value.parse_args.return_value.fleet = None
+        with self.assertRaises(SystemExit) as cm:
+            feeder_rpc_client.main()
+        self.assertEqual(cm.exception.code, 124)
+        self.assertEqual(mock_rpc_client.return_value.call.call_args[1]["timeout"], 5)
+
+    @patch("sys.stderr", new_callable=io.StringIO)
+    @patch("sys.argv", ["feeder-rpc-client", "-m", "health", "-c", "amqp://"])
+    def test_main_usage_error_not_timeout_code(self, mock_stderr):
+        with self.assertRaises(SystemExit) as cm:
+            feeder_rpc_client.main()
+        self.assertEqual(cm.exception.code, 2)
+        self.assertNotEqual(cm.exception.code, feeder_rpc_client.TIMEOUT_EXIT_CODE)
+
+    @patch('feeder_utilities.feeder_rpc_client.FeederRpcClient')
+    @patch('kombu.Connection')
     @patch("feeder_utilities.feeder_rpc_client.argparse.ArgumentParser")
     def test_main_health_fail(self, mock_arg_parse, mock_connection, mock_rpc_client):
         mock_rpc_client.return_value.call.return_value = {
             "a": "response", "success": True, "result": {"status": "BAD"}}
         mock_arg_parse.return_value.parse_args.return_value.method = "health"
+        mock_arg_parse.return_value.parse_args.return_value.fleet = None
         with self.assertRaises(SystemExit) as cm:
             feeder_rpc_client.main()
         self.assertEqual(cm.exception.code, 1)
         mock_rpc_client.return_value.call.assert_called()
+
+
+class TestFeederRpcClientFleet(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.client = MagicMock()
+        self.client._call_many.return_value = OrderedDict([
+            (("feeders", "feeder-a"), ({"success": True, "result": {"status": "OK"}, "error": None}, 0.0123)),
+            (("feeders", "feeder-b"), ({"success": True, "result": {"status": "BAD"}, "error": None}, 0.5)),
+            (("other", "feeder-c"), ({"success": False, "result": None,
+                                      "error": {"error_message": "No response"}}, None))])
+
+    def test_read_fleet(self):
+        fleet_file = io.StringIO("# feeders\nfeeders feeder-a\n\n  other feeder-c  # legacy\n")
+        self.assertEqual(feeder_rpc_client.read_fleet(fleet_file), [("feeders", "feeder-a"), ("other", "feeder-c")])
+
+    def test_read_fleet_invalid(self):
+        with self.assertRaises(ValueError) as exc:
+            feeder_rpc_client.read_fleet(io.StringIO("feeders feeder-a\nfeeder-b\n"))
+        self.assertEqual(str(exc.exception), "Line 2 of fleet file should be 'exchange routing_key', got 'feeder-b'")
+
+    def test_call_fleet(self):
+        feeders = [("feeders", "feeder-a"), ("feeders", "feeder-b"), ("other", "feeder-c")]
+        summaries = feeder_rpc_client.call_fleet(self.client, feeders, "health", timeout=5)
+        self.client._call_many.assert_called_once_with(feeders, "health", 5, {})
+        self.assertEqual(summaries[0], {"exchange": "feeders", "routing_key": "feeder-a", "success": True,
+                                        "timed_out": False, "elapsed_seconds": 0.012, "status": "OK",
+                                        "error": None, "result": {"status": "OK"}})
+        self.assertEqual(summaries[2], {"exchange": "other", "routing_key": "feeder-c", "success": False,
+                                        "timed_out": True, "elapsed_seconds": None, "status": None,
+                                        "error": "No response", "result": None})
+        self.assertEqual(feeder_rpc_client.fleet_exit_code(summaries, "health"), 1)
+        self.assertEqual(feeder_rpc_client.format_fleet_table(summaries),
+                         "EXCHANGE  ROUTING KEY  OK   SECONDS  STATUS / ERROR\n"
+                         "feeders   feeder-a     yes  0.012    OK\n"
+                         "feeders   feeder-b     yes  0.500    BAD\n"
+                         "other     feeder-c     no   -        No response")
+
+    def test_fleet_exit_code_timeouts(self):
+        summaries = feeder_rpc_client.call_fleet(self.client, list(self.client._call_many.return_value), "health")
+        self.assertEqual(feeder_rpc_client.fleet_exit_code(summaries[:1], "health"), 0)
+        self.assertEqual(feeder_rpc_client.fleet_exit_code([summaries[0], summaries[2]], "health"), 124)
+
+    @patch('feeder_utilities.feeder_rpc_client.call_fleet')
+    @patch('feeder_utilities.feeder_rpc_client.FeederRpcClient')
+    @patch('kombu.Connection')
+    @patch("feeder_utilities.feeder_rpc_client.argparse.ArgumentParser")
+    def test_main_fleet_timeouts(self, mock_arg_parse, mock_connection, mock_rpc_client, mock_call_fleet):
+        args = mock_arg_parse.return_value.parse_args.return_value
+        args.fleet = io.StringIO("feeders feeder-a\n")
+        args.method = "health"
+        args.output = "json"
+        args.params = []
+        mock_call_fleet.return_value = [{"success": False, "timed_out": True, "status": None}]
+        with patch('sys.stdout', new_callable=io.StringIO):
+            with self.assertRaises(SystemExit) as cm:
+                feeder_rpc_client.main()
+        self.assertEqual(cm.exception.code, feeder_rpc_client.TIMEOUT_EXIT_CODE)
+        self.assertNotEqual(cm.exception.code, 2)
+
+    @patch('feeder_utilities.feeder_rpc_client.call_fleet')
+    @patch('feeder_utilities.feeder_rpc_client.FeederRpcClient')
+    @patch('kombu.Connection')
+    @patch("feeder_utilities.feeder_rpc_client.argparse.ArgumentParser")
+    def test_main_fleet_json(self, mock_arg_parse, mock_connection, mock_rpc_client, mock_call_fleet):
+        args = mock_arg_parse.return_value.parse_args.return_value
+        args.fleet = io.StringIO("feeders feeder-a\n")
+        args.method = "integrity_check"
+        args.output = "json"
+        args.timeout = 0
+        args.params = [("full", True)]
+        mock_call_fleet.return_value = [{"success": True, "timed_out": False, "status": None}]
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            with self.assertRaises(SystemExit) as cm:
+                feeder_rpc_client.main()
+        self.assertEqual(cm.exception.code, 0)
+        mock_call_fleet.assert_called_once_with(mock_rpc_client.return_value.__enter__.return_value,
+                                                [("feeders", "feeder-a")], "integrity_check", timeout=None,
+                                                full=True)
+        self.assertEqual(json.loads(stdout.getvalue()), {"success": True, "timed_out": False, "status": None})
@@ -0,0 +1,39 @@
+import subprocess
+import sys
+from unittest import TestCase
+
+# Modules used from cron jobs and probes, which must not pull in the broker and HTTP client libraries at import time
+LIGHT_MODULES = ['feeder_utilities.feeder_rpc_client', 'feeder_utilities.rpc_message_processor',
+                 'feeder_utilities.health']
+HEAVY_DEPENDENCIES = ['kombu', 'amqp', 'requests', 'urllib3']
+# Cumulative import time budget for each of the light modules, in microseconds
+IMPORT_TIME_BUDGET = 100000
+
+
+def import_times(module):
+    """Import module in a fresh interpreter, returning {module name: cumulative microseconds} of what it imported."""
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+class TestImportTime(TestCase):
+
+    def test_no_heavy_dependencies(self):
+        for module in LIGHT_MODULES:
+            imported = import_times(module)
+            heavy = [name for name in imported if name.split('.')[0] in HEAVY_DEPENDENCIES]
+            self.assertEqual(heavy, [], "{} imports {}".format(module, heavy))
+
+    def test_import_time_budget(self):
+        for module in LIGHT_MODULES:
+            # Best of three, to keep a busy machine from failing the test
+            elapsed = min(import_times(module)[module] for _ in range(3))
+            self.assertLess(elapsed, IMPORT_TIME_BUDGET, "{} took {}us to import".format(module, elapsed))
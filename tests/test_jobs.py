@@ -0,0 +1,47 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+from feeder_utilities import jobs
+
+
+class TestJobManager(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.manager = jobs.JobManager(MagicMock(), max_workers=1, max_finished=2)
+        self.addCleanup(self.manager.shutdown)
+
+    def test_job_succeeds(self):
+        running = []
+
+        def work(a, b):
+            running.append(jobs.current_job())
+            jobs.report_progress(done=1)
+            return a + b
+
+        job = self.manager.submit("add", work, 1, 2)
+        self.manager.shutdown()
+        self.assertEqual(running, [job])
+        self.assertEqual((job.status, job.result, job.progress), (jobs.Job.SUCCEEDED, 3, {"done": 1}))
+        self.assertIsNotNone(job.finished_at)
+        self.assertIs(self.manager.get(job.job_id), job)
+        self.assertIsNone(jobs.current_job())
+
+    def test_job_fails(self):
+        def work():
+            raise ValueError("broken")
+
+        job = self.manager.submit("broken", work)
+        self.manager.shutdown()
+        json = job.to_json()
+        self.assertEqual(json["status"], "failed")
+        self.assertEqual(json["error"], {"error_message": "Exception occured: ValueError('broken')"})
+        self.manager.logger.exception.assert_called_once()
+
+    def test_forgets_oldest_finished(self):
+        submitted = [self.manager.submit("job", lambda: None) for _ in range(3)]
+        self.manager.shutdown()
+        self.assertIsNone(self.manager.get(submitted[0].job_id))
+        self.assertEqual(self.manager.list(), submitted[1:])
+
+    def test_report_progress_outside_job(self):
+        jobs.report_progress(done=1)
@@ -0,0 +1,75 @@
+import urllib.request
+from unittest import TestCase
+from feeder_utilities import metrics
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        counter = metrics.counter("messages_total", "Messages", ["consumer"], registry=self.registry)
+        counter.labels("main").inc()
+        counter.labels(consumer="main").inc(2)
+        counter.labels("rpc").inc()
+        self.assertEqual(self.registry.expose(),
+                         '# HELP messages_total Messages\n'
+                         '# TYPE messages_total counter\n'
+                         'messages_total{consumer="main"} 3\n'
+                         'messages_total{consumer="rpc"} 1\n')
+
+    def test_gauge(self):
+        gauge = metrics.gauge("in_flight", "In flight", registry=self.registry)
+        gauge.inc(3)
+        gauge.dec()
+        self.assertEqual(gauge.to_json()["samples"], [{"labels": {}, "value": 2}])
+        gauge.set(0.5)
+        self.assertIn("in_flight 0.5\n", self.registry.expose())
+
+    def test_histogram(self):
+        histogram = metrics.histogram("latency_seconds", "Latency", buckets=(0.1, 1), registry=self.registry)
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.expose()[2:],
+                         ['latency_seconds_bucket{le="0.1"} 2',
+                          'latency_seconds_bucket{le="1"} 3',
+                          'latency_seconds_bucket{le="+Inf"} 4',
+                          'latency_seconds_sum 3.65',
+                          'latency_seconds_count 4'])
+        self.assertEqual(histogram.to_json()["samples"],
+                         [{"labels": {}, "buckets": [["0.1", 2], ["1", 3], ["+Inf", 4]], "sum": 3.65, "count": 4}])
+
+    def test_histogram_time(self):
+        histogram = metrics.histogram("op_seconds", "Op", ["op"], registry=self.registry)
+        with histogram.labels("drain").time():
+            pass
+        self.assertEqual(histogram.labels("drain").count, 1)
+
+    def test_label_escaping(self):
+        counter = metrics.counter("errors_total", "Errors", ["message"], registry=self.registry)
+        counter.labels('say "hi"\n').inc()
+        self.assertIn('errors_total{message="say \\"hi\\"\\n"} 1', self.registry.expose())
+
+    def test_labels_required(self):
+        counter = metrics.counter("labelled_total", "Labelled", ["consumer"], registry=self.registry)
+        with self.assertRaises(ValueError):
+            counter.inc()
+        with self.assertRaises(ValueError):
+            counter.labels("main", "extra")
+
+    def test_get_or_create(self):
+        counter = metrics.counter("shared_total", "Shared", registry=self.registry)
+        self.assertIs(metrics.counter("shared_total", "Shared", registry=self.registry), counter)
+        with self.assertRaises(ValueError):
+            metrics.gauge("shared_total", "Shared", registry=self.registry)
+
+    def test_http_server(self):
+        metrics.counter("served_total", "Served", registry=self.registry).inc()
+        server = metrics.start_http_server(0, registry=self.registry)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        with urllib.request.urlopen("http://127.0.0.1:{}/metrics".format(server.server_address[1])) as response:
+            self.assertEqual(response.headers["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+            self.assertIn("served_total 1\n", response.read().decode("utf-8"))
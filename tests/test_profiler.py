@@ -0,0 +1,79 @@
+import os
+import pstats
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+from feeder_utilities.profiler import SamplingProfiler
+
+
+class TestSamplingProfiler(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def dumps(self):
+        return sorted(os.listdir(self.directory.name))
+
+    def test_disabled_by_default(self):
+        profiler = SamplingProfiler(self.directory.name, every=1)
+        func = MagicMock(return_value="result")
+        self.assertEqual(profiler.run("trace", func, "body"), "result")
+        func.assert_called_once_with("body")
+        self.assertEqual(self.dumps(), [])
+
+    def test_every_nth(self):
+        profiler = SamplingProfiler(self.directory.name, every=2, enabled=True)
+        for _ in range(5):
+            profiler.run("trace", sum, [1, 2])
+        self.assertEqual(len(self.dumps()), 2)
+        self.assertEqual(profiler.status()["dumps"], 2)
+        stats = pstats.Stats(os.path.join(self.directory.name, self.dumps()[0]))
+        self.assertTrue(any(func[2] == "<built-in method builtins.sum>" for func in stats.stats))
+
+    def test_threshold(self):
+        profiler = SamplingProfiler(self.directory.name, threshold=60, enabled=True)
+        profiler.run("fast", sum, [1, 2])
+        self.assertEqual(self.dumps(), [])
+        profiler.configure(threshold=0.000001)
+        profiler.run("slow", sum, range(1000))
+        self.assertEqual(len(self.dumps()), 1)
+        self.assertIn("-slow-", self.dumps()[0])
+
+    def test_max_dumps(self):
+        profiler = SamplingProfiler(self.directory.name, every=1, max_dumps=2, enabled=True)
+        for _ in range(4):
+            profiler.run("trace", sum, [1, 2])
+        self.assertEqual(len(self.dumps()), 2)
+        # Raising max_dumps starts counting again
+        profiler.configure(max_dumps=1)
+        profiler.run("trace", sum, [1, 2])
+        self.assertEqual(len(self.dumps()), 3)
+
+    def test_exception_still_dumped(self):
+        profiler = SamplingProfiler(self.directory.name, every=1, enabled=True)
+        with self.assertRaises(ValueError):
+            profiler.run("trace", MagicMock(side_effect=ValueError("bad")))
+        self.assertEqual(len(self.dumps()), 1)
+
+    def test_name_sanitised(self):
+        profiler = SamplingProfiler(self.directory.name, every=1, enabled=True)
+        profiler.run("abc/../../x", sum, [1, 2])
+        self.assertEqual(len(self.dumps()), 1)
+        self.assertIn("-abc_.._.._x-", self.dumps()[0])
+
+    def test_dump_error_logged(self):
+        logger = MagicMock()
+        path = os.path.join(self.directory.name, "file")
+        open(path, "w").close()
+        # The directory can't be created as a file is in the way
+        profiler = SamplingProfiler(os.path.join(path, "profiles"), every=1, enabled=True, logger=logger)
+        self.assertEqual(profiler.run("trace", sum, [1, 2]), 3)
+        logger.exception.assert_called_once()
+        self.assertEqual(profiler.dumps, 0)
+
+    def test_configure(self):
+        profiler = SamplingProfiler(self.directory.name, every=5)
+        self.assertEqual(profiler.configure(enabled=True, every=0, threshold=0.5),
+                         {"enabled": True, "every": None, "threshold": 0.5, "directory": self.directory.name,
+                          "max_dumps": 100, "dumps": 0})
@@ -0,0 +1,39 @@
+from unittest import TestCase
+from unittest.mock import patch
+from feeder_utilities.rate_limit import TokenBucket
+
+
+class TestTokenBucket(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        patcher = patch("feeder_utilities.rate_limit.time")
+        self.mock_time = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_time.monotonic.return_value = 100
+        self.sleeps = []
+        self.mock_time.sleep.side_effect = self.sleep
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.mock_time.monotonic.return_value += seconds
+
+    def test_burst_then_waits(self):
+        bucket = TokenBucket(2, capacity=2)
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual(self.sleeps, [])
+        bucket.acquire()
+        self.assertEqual(self.sleeps, [0.5])
+
+    def test_refills_up_to_capacity(self):
+        bucket = TokenBucket(10, capacity=5)
+        for _ in range(5):
+            bucket.acquire()
+        self.mock_time.monotonic.return_value = 200
+        for _ in range(5):
+            bucket.acquire()
+        self.assertEqual(self.sleeps, [])
+        bucket.acquire()
+        self.assertEqual(len(self.sleeps), 1)
+        self.assertAlmostEqual(self.sleeps[0], 0.1)
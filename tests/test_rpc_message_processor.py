@@ -1,6 +1,9 @@
+import threading
+import time
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
-from feeder_utilities import rpc_message_processor
+from feeder_utilities import jobs, metrics, rpc_message_processor
+from feeder_utilities.entry_ranges import EntryRangeSet
 from feeder_utilities.exceptions import RpcMessageProcessingException
 
 
@@ -20,15 +23,41 @@ class TestRpcMessageProcessor(TestCase):
         proc.process_rpc_message({}, mock_message, MagicMock())
         mock_message.reject.assert_called()
 
-    @patch("feeder_utilities.rpc_message_processor.rabbitmq")
-    def test_process_rpc_message_no_method(self, mock_rabbit):
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_deadline_passed(self, mock_publish):
         mock_logger = MagicMock()
         proc = rpc_message_processor.RpcMessageProcessor(mock_logger, "app_name", "integrity_check", "rabbitmq_url",
                                                          "queue_name", "rpc_queue_name", "error_queue_name",
                                                          "register_url", "routing_key")
         mock_message = MagicMock()
         mock_message.properties.get.side_effect = ["reply-to", "correlation"]
-        mock_rabbit.publish_message = self.save_message
+        mock_message.headers = {"x-deadline": time.time() - 5}
+        proc.process_rpc_message({"method": "health"}, mock_message, MagicMock())
+        mock_message.ack.assert_called_once_with()
+        mock_publish.assert_not_called()
+
+    @patch("feeder_utilities.rpc_message_processor.FeederHealth")
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_deadline_not_passed(self, mock_publish, mock_health):
+        mock_logger = MagicMock()
+        proc = rpc_message_processor.RpcMessageProcessor(mock_logger, "app_name", "integrity_check", "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key")
+        mock_message = MagicMock()
+        mock_message.properties.get.side_effect = ["reply-to", "correlation"]
+        mock_message.headers = {"x-deadline": time.time() + 60}
+        proc.process_rpc_message({"method": "health"}, mock_message, MagicMock())
+        mock_publish.assert_called_once()
+
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_no_method(self, mock_publish):
+        mock_logger = MagicMock()
+        proc = rpc_message_processor.RpcMessageProcessor(mock_logger, "app_name", "integrity_check", "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key")
+        mock_message = MagicMock()
+        mock_message.properties.get.side_effect = ["reply-to", "correlation"]
+        mock_publish.side_effect = self.save_message
         proc.process_rpc_message({}, mock_message, MagicMock())
         mock_message.reject.assert_called()
         self.assertEqual(self.rpc_response,
@@ -38,15 +67,15 @@ class TestRpcMessageProcessor(TestCase):
                                     "RpcMessageProcessingException('Message body must "
                                     "contain method name')"}})
 
-    @patch("feeder_utilities.rpc_message_processor.rabbitmq")
-    def test_process_rpc_message_unknown_method(self, mock_rabbit):
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_unknown_method(self, mock_publish):
         mock_logger = MagicMock()
         proc = rpc_message_processor.RpcMessageProcessor(mock_logger, "app_name", "integrity_check", "rabbitmq_url",
                                                          "queue_name", "rpc_queue_name", "error_queue_name",
                                                          "register_url", "routing_key")
         mock_message = MagicMock()
         mock_message.properties.get.side_effect = ["reply-to", "correlation"]
-        mock_rabbit.publish_message = self.save_message
+        mock_publish.side_effect = self.save_message
         proc.process_rpc_message({"method": "rhubarb"}, mock_message, MagicMock())
         mock_message.reject.assert_called()
         self.assertEqual(self.rpc_response,
@@ -57,15 +86,15 @@ class TestRpcMessageProcessor(TestCase):
                                     '\'rhubarb\'")'}})
 
     @patch("feeder_utilities.rpc_message_processor.FeederHealth")
-    @patch("feeder_utilities.rpc_message_processor.rabbitmq")
-    def test_process_rpc_message_health_ok(self, mock_rabbit, mock_health):
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_health_ok(self, mock_publish, mock_health):
         mock_logger = MagicMock()
         proc = rpc_message_processor.RpcMessageProcessor(mock_logger, "app_name", "integrity_check", "rabbitmq_url",
                                                          "queue_name", "rpc_queue_name", "error_queue_name",
                                                          "register_url", "routing_key")
         mock_message = MagicMock()
         mock_message.properties.get.side_effect = ["reply-to", "correlation"]
-        mock_rabbit.publish_message = self.save_message
+        mock_publish.side_effect = self.save_message
         mock_health.return_value.generate_health_msg.return_value = {"status": "OK"}
         proc.process_rpc_message({"method": "health"}, mock_message, MagicMock())
         self.assertEqual(self.rpc_response,
@@ -74,15 +103,15 @@ class TestRpcMessageProcessor(TestCase):
                           'error': None})
 
     @patch("feeder_utilities.rpc_message_processor.FeederHealth")
-    @patch("feeder_utilities.rpc_message_processor.rabbitmq")
-    def test_process_rpc_message_health_bad(self, mock_rabbit, mock_health):
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_health_bad(self, mock_publish, mock_health):
         mock_logger = MagicMock()
         proc = rpc_message_processor.RpcMessageProcessor(mock_logger, "app_name", "integrity_check", "rabbitmq_url",
                                                          "queue_name", "rpc_queue_name", "error_queue_name",
                                                          "register_url", "routing_key")
         mock_message = MagicMock()
         mock_message.properties.get.side_effect = ["reply-to", "correlation"]
-        mock_rabbit.publish_message = self.save_message
+        mock_publish.side_effect = self.save_message
         mock_health.return_value.generate_health_msg.return_value = {"status": "BAD"}
         proc.process_rpc_message({"method": "health"}, mock_message, MagicMock())
         self.assertEqual(self.rpc_response,
@@ -90,9 +119,24 @@ class TestRpcMessageProcessor(TestCase):
                           "result": {'status': 'BAD'},
                           'error': None})
 
-    @patch("feeder_utilities.rpc_message_processor.Register")
-    @patch("feeder_utilities.rpc_message_processor.rabbitmq")
-    def test_process_rpc_message_integrity_check(self, mock_rabbit, mock_register):
+    @patch("feeder_utilities.rpc_message_processor.FeederHealth")
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_health_reused(self, mock_publish, mock_health):
+        mock_logger = MagicMock()
+        proc = rpc_message_processor.RpcMessageProcessor(mock_logger, "app_name", "integrity_check", "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key", health_cache_ttl=5)
+        mock_health.return_value.generate_health_msg.return_value = {"status": "OK"}
+        for _ in range(2):
+            mock_message = MagicMock()
+            mock_message.properties.get.side_effect = ["reply-to", "correlation"]
+            proc.process_rpc_message({"method": "health"}, mock_message, MagicMock())
+        mock_health.assert_called_once_with("app_name", "rabbitmq_url", "queue_name", "rpc_queue_name",
+                                            "error_queue_name", cache_ttl=5, stale_ttl=0, throttle=None)
+
+    @patch("feeder_utilities.dependencies.register.Register")
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_integrity_check(self, mock_publish, mock_register):
         mock_logger = MagicMock()
         mock_integrity = MagicMock()
         proc = rpc_message_processor.RpcMessageProcessor(mock_logger, "app_name", mock_integrity, "rabbitmq_url",
@@ -100,18 +144,18 @@ class TestRpcMessageProcessor(TestCase):
                                                          "register_url", "routing_key")
         mock_message = MagicMock()
         mock_message.properties.get.side_effect = ["reply-to", "correlation"]
-        mock_rabbit.publish_message = self.save_message
+        mock_publish.side_effect = self.save_message
         mock_register.return_value.max_entry.return_value = 2
-        mock_integrity.check_integrity.return_value = [1, 2]
+        mock_integrity.check_integrity.return_value = [1, 2, 5]
         proc.process_rpc_message({"method": "integrity_check"}, mock_message, MagicMock())
         self.assertEqual(self.rpc_response,
                          {"success": True,
-                          "result": {'missing_entries': [1, 2]},
+                          "result": {'missing_entries': {'ranges': [[1, 2], [5, 5]], 'count': 3}},
                           'error': None})
 
-    @patch("feeder_utilities.rpc_message_processor.Register")
-    @patch("feeder_utilities.rpc_message_processor.rabbitmq")
-    def test_process_rpc_message_integrity_fix(self, mock_rabbit, mock_register):
+    @patch("feeder_utilities.dependencies.register.Register")
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_integrity_fix(self, mock_publish, mock_register):
         mock_logger = MagicMock()
         mock_integrity = MagicMock()
         proc = rpc_message_processor.RpcMessageProcessor(mock_logger, "app_name", mock_integrity, "rabbitmq_url",
@@ -119,20 +163,49 @@ class TestRpcMessageProcessor(TestCase):
                                                          "register_url", "routing_key")
         mock_message = MagicMock()
         mock_message.properties.get.side_effect = ["reply-to", "correlation"]
-        mock_rabbit.publish_message = self.save_message
+        mock_publish.side_effect = self.save_message
         mock_register.return_value.max_entry.return_value = 2
         mock_register.return_value.republish_entries.return_value = {
-            "entries_not_found": [], "republished_entries": [1, 2]}
+            "entries_not_found": EntryRangeSet(), "republished_entries": EntryRangeSet([(1, 2)])}
         mock_integrity.check_integrity.return_value = [1, 2]
         proc.process_rpc_message({"method": "integrity_fix"}, mock_message, MagicMock())
+        mock_register.return_value.republish_entries.assert_called_once_with(EntryRangeSet([(1, 2)]))
         self.assertEqual(self.rpc_response,
                          {"success": True,
-                          "result": {'entries_not_found': [], 'republished_entries': [1, 2]},
+                          "result": {'entries_not_found': {'ranges': [], 'count': 0},
+                                     'republished_entries': {'ranges': [[1, 2]], 'count': 2}},
                           'error': None})
 
-    @patch("feeder_utilities.rpc_message_processor.Register")
-    @patch("feeder_utilities.rpc_message_processor.rabbitmq")
-    def test_process_rpc_message_integrity_fix_none(self, mock_rabbit, mock_register):
+    @patch("feeder_utilities.dependencies.register.Register")
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_integrity_fix_chunked(self, mock_publish, mock_register):
+        mock_logger = MagicMock()
+        mock_integrity = MagicMock()
+        proc = rpc_message_processor.RpcMessageProcessor(mock_logger, "app_name", mock_integrity, "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key",
+                                                         republish_options={"chunk_size": 2, "rate_limit": 1})
+        mock_message = MagicMock()
+        mock_message.properties.get.side_effect = ["reply-to", "correlation"]
+        mock_publish.side_effect = self.save_message
+        mock_register.return_value.max_entry.return_value = 4
+        mock_register.return_value.republish_entries.return_value = {
+            "entries_not_found": EntryRangeSet(), "republished_entries": EntryRangeSet([(1, 2)]),
+            "failed_entries": EntryRangeSet([(3, 4)]), "chunks": [{"index": 0}, {"index": 1}]}
+        mock_integrity.check_integrity.return_value = [1, 2, 3, 4]
+        proc.process_rpc_message({"method": "integrity_fix"}, mock_message, MagicMock())
+        mock_register.return_value.republish_entries.assert_called_once_with(EntryRangeSet([(1, 4)]), chunk_size=2,
+                                                                             rate_limit=1)
+        self.assertEqual(self.rpc_response["result"],
+                         {'entries_not_found': {'ranges': [], 'count': 0},
+                          'republished_entries': {'ranges': [[1, 2]], 'count': 2},
+                          'failed_entries': {'ranges': [[3, 4]], 'count': 2},
+                          'chunks': [{"index": 0}, {"index": 1}]})
+        mock_logger.error.assert_any_call("Failed to republish 2 missing_entries: 3-4")
+
+    @patch("feeder_utilities.dependencies.register.Register")
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_integrity_fix_none(self, mock_publish, mock_register):
         mock_logger = MagicMock()
         mock_integrity = MagicMock()
         proc = rpc_message_processor.RpcMessageProcessor(mock_logger, "app_name", mock_integrity, "rabbitmq_url",
@@ -140,25 +213,44 @@ class TestRpcMessageProcessor(TestCase):
                                                          "register_url", "routing_key")
         mock_message = MagicMock()
         mock_message.properties.get.side_effect = ["reply-to", "correlation"]
-        mock_rabbit.publish_message = self.save_message
+        mock_publish.side_effect = self.save_message
         mock_register.return_value.max_entry.return_value = 2
         mock_integrity.check_integrity.return_value = []
         proc.process_rpc_message({"method": "integrity_fix"}, mock_message, MagicMock())
         self.assertEqual(self.rpc_response,
                          {"success": True,
-                          "result": {'entries_not_found': [], 'republished_entries': []},
+                          "result": {'entries_not_found': {'ranges': [], 'count': 0},
+                                     'republished_entries': {'ranges': [], 'count': 0}},
                           'error': None})
 
-    @patch("feeder_utilities.rpc_message_processor.ErrorQueueClient")
-    @patch("feeder_utilities.rpc_message_processor.rabbitmq")
-    def test_process_rpc_message_dump_error_queue(self, mock_rabbit, mock_err_client):
+    @patch("feeder_utilities.dependencies.register.Register")
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_integrity_check_range_set(self, mock_publish, mock_register):
+        mock_logger = MagicMock()
+        mock_integrity = MagicMock()
+        proc = rpc_message_processor.RpcMessageProcessor(mock_logger, "app_name", mock_integrity, "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key")
+        mock_message = MagicMock()
+        mock_message.properties.get.side_effect = ["reply-to", "correlation"]
+        mock_publish.side_effect = self.save_message
+        mock_register.return_value.max_entry.return_value = 5000000
+        mock_integrity.check_integrity.return_value = EntryRangeSet([(1, 4000000)])
+        proc.process_rpc_message({"method": "integrity_check"}, mock_message, MagicMock())
+        self.assertEqual(self.rpc_response["result"],
+                         {'missing_entries': {'ranges': [[1, 4000000]], 'count': 4000000}})
+        mock_logger.error.assert_called_once_with("Detected 4000000 missing_entries: 1-4000000")
+
+    @patch("feeder_utilities.dependencies.rabbitmq.ErrorQueueClient")
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_dump_error_queue(self, mock_publish, mock_err_client):
         mock_logger = MagicMock()
         proc = rpc_message_processor.RpcMessageProcessor(mock_logger, "app_name", "integrity_check", "rabbitmq_url",
                                                          "queue_name", "rpc_queue_name", "error_queue_name",
                                                          "register_url", "routing_key")
         mock_message = MagicMock()
         mock_message.properties.get.side_effect = ["reply-to", "correlation"]
-        mock_rabbit.publish_message = self.save_message
+        mock_publish.side_effect = self.save_message
         mock_err_client.return_value.retrieve_messages.return_value = []
         proc.process_rpc_message({"method": "dump_error_queue"}, mock_message, MagicMock())
         self.assertEqual(self.rpc_response,
@@ -166,16 +258,69 @@ class TestRpcMessageProcessor(TestCase):
                           "result": {'error_messages': []},
                           'error': None})
 
-    @patch("feeder_utilities.rpc_message_processor.ErrorQueueClient")
-    @patch("feeder_utilities.rpc_message_processor.rabbitmq")
-    def test_process_rpc_message_requeue_errors(self, mock_rabbit, mock_err_client):
+    @patch("feeder_utilities.dependencies.rabbitmq.ErrorQueueClient")
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_dump_error_queue_page(self, mock_publish, mock_err_client):
+        mock_logger = MagicMock()
+        proc = rpc_message_processor.RpcMessageProcessor(mock_logger, "app_name", "integrity_check", "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key")
+        mock_message = MagicMock()
+        mock_message.properties.get.side_effect = ["reply-to", "correlation"]
+        mock_publish.side_effect = self.save_message
+        mock_err_client.return_value.iter_messages.return_value = iter([{"body": 1}, {"body": 2}])
+        proc.process_rpc_message({"method": "dump_error_queue", "offset": 4, "limit": 2}, mock_message, MagicMock())
+        mock_err_client.return_value.iter_messages.assert_called_once_with(4, 2)
+        self.assertEqual(self.rpc_response,
+                         {"success": True,
+                          "result": {'error_messages': [{"body": 1}, {"body": 2}], "offset": 4, "next_offset": 6},
+                          'error': None})
+
+    @patch("feeder_utilities.dependencies.rabbitmq.ErrorQueueClient")
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_dump_error_queue_chunked(self, mock_publish, mock_err_client):
         mock_logger = MagicMock()
         proc = rpc_message_processor.RpcMessageProcessor(mock_logger, "app_name", "integrity_check", "rabbitmq_url",
                                                          "queue_name", "rpc_queue_name", "error_queue_name",
                                                          "register_url", "routing_key")
         mock_message = MagicMock()
         mock_message.properties.get.side_effect = ["reply-to", "correlation"]
-        mock_rabbit.publish_message = self.save_message
+        mock_err_client.return_value.iter_messages.return_value = iter([{"body": 1}, {"body": 2}, {"body": 3}])
+        proc.process_rpc_message({"method": "dump_error_queue", "chunk_size": 2}, mock_message, MagicMock())
+        responses = [call[0][1] for call in mock_publish.call_args_list]
+        self.assertEqual(responses,
+                         [{"success": True, "result": {"error_messages": [{"body": 1}, {"body": 2}]}, "error": None,
+                           "chunk": {"index": 0, "last": False}},
+                          {"success": True, "result": {"error_messages": [{"body": 3}]}, "error": None,
+                           "chunk": {"index": 1, "last": True}}])
+        mock_message.ack.assert_called_once()
+
+    @patch("feeder_utilities.dependencies.rabbitmq.ErrorQueueClient")
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_dump_error_queue_chunked_empty(self, mock_publish, mock_err_client):
+        mock_logger = MagicMock()
+        proc = rpc_message_processor.RpcMessageProcessor(mock_logger, "app_name", "integrity_check", "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key")
+        mock_message = MagicMock()
+        mock_message.properties.get.side_effect = ["reply-to", "correlation"]
+        mock_publish.side_effect = self.save_message
+        mock_err_client.return_value.iter_messages.return_value = iter([])
+        proc.process_rpc_message({"method": "dump_error_queue", "chunk_size": 2}, mock_message, MagicMock())
+        self.assertEqual(self.rpc_response,
+                         {"success": True, "result": {"error_messages": []}, "error": None,
+                          "chunk": {"index": 0, "last": True}})
+
+    @patch("feeder_utilities.dependencies.rabbitmq.ErrorQueueClient")
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_requeue_errors(self, mock_publish, mock_err_client):
+        mock_logger = MagicMock()
+        proc = rpc_message_processor.RpcMessageProcessor(mock_logger, "app_name", "integrity_check", "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key")
+        mock_message = MagicMock()
+        mock_message.properties.get.side_effect = ["reply-to", "correlation"]
+        mock_publish.side_effect = self.save_message
         mock_err_client.return_value.requeue_messages.return_value = []
         proc.process_rpc_message({"method": "requeue_errors"}, mock_message, MagicMock())
         self.assertEqual(self.rpc_response,
@@ -183,16 +328,35 @@ class TestRpcMessageProcessor(TestCase):
                           "result": {'requeued_messages': []},
                           'error': None})
 
-    @patch("feeder_utilities.rpc_message_processor.ErrorQueueClient")
-    @patch("feeder_utilities.rpc_message_processor.rabbitmq")
-    def test_process_rpc_message_delete_errors(self, mock_rabbit, mock_err_client):
+    @patch("feeder_utilities.dependencies.rabbitmq.ErrorQueueClient")
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_requeue_errors_bulk(self, mock_publish, mock_err_client):
+        mock_logger = MagicMock()
+        proc = rpc_message_processor.RpcMessageProcessor(mock_logger, "app_name", "integrity_check", "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key")
+        mock_message = MagicMock()
+        mock_message.properties.get.side_effect = ["reply-to", "correlation"]
+        mock_publish.side_effect = self.save_message
+        mock_err_client.return_value.bulk_requeue_messages.return_value = {"requeued_count": 3, "batches": 1}
+        proc.process_rpc_message({"method": "requeue_errors", "bulk": True, "batch_size": 100}, mock_message,
+                                 MagicMock())
+        mock_err_client.return_value.bulk_requeue_messages.assert_called_once_with(batch_size=100)
+        self.assertEqual(self.rpc_response,
+                         {"success": True,
+                          "result": {"requeued_count": 3, "batches": 1},
+                          'error': None})
+
+    @patch("feeder_utilities.dependencies.rabbitmq.ErrorQueueClient")
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_delete_errors(self, mock_publish, mock_err_client):
         mock_logger = MagicMock()
         proc = rpc_message_processor.RpcMessageProcessor(mock_logger, "app_name", "integrity_check", "rabbitmq_url",
                                                          "queue_name", "rpc_queue_name", "error_queue_name",
                                                          "register_url", "routing_key")
         mock_message = MagicMock()
         mock_message.properties.get.side_effect = ["reply-to", "correlation"]
-        mock_rabbit.publish_message = self.save_message
+        mock_publish.side_effect = self.save_message
         mock_err_client.return_value.delete_messages.return_value = []
         proc.process_rpc_message({"method": "delete_errors"}, mock_message, MagicMock())
         self.assertEqual(self.rpc_response,
@@ -200,7 +364,7 @@ class TestRpcMessageProcessor(TestCase):
                           "result": {'deleted_messages': []},
                           'error': None})
 
-    @patch("feeder_utilities.rpc_message_processor.Register")
+    @patch("feeder_utilities.dependencies.register.Register")
     def test_startup_integrity_check(self, mock_register):
         mock_logger = MagicMock()
         mock_integrity = MagicMock()
@@ -213,3 +377,248 @@ class TestRpcMessageProcessor(TestCase):
         mock_integrity.check_integrity.return_value = [1, 2]
         result = proc.startup_integrity_check(MagicMock())
         self.assertEqual(result, {'entries_not_found': [], 'republished_entries': [1, 2]})
+
+    def incremental_processor(self, mock_integrity, checkpoint):
+        mock_store = MagicMock()
+        mock_store.get.return_value = checkpoint
+        proc = rpc_message_processor.RpcMessageProcessor(MagicMock(), "app_name", mock_integrity, "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key", checkpoint_store=mock_store)
+        return proc, mock_store
+
+    @patch("feeder_utilities.dependencies.register.Register")
+    def test_find_missing_entries_incremental(self, mock_register):
+        mock_integrity = MagicMock()
+        proc, mock_store = self.incremental_processor(mock_integrity, 100)
+        mock_register.return_value.max_entry.return_value = 150
+        mock_integrity.check_integrity_range.return_value = []
+        self.assertEqual(proc.find_missing_entries(MagicMock()), EntryRangeSet())
+        mock_integrity.check_integrity_range.assert_called_once_with(101, 150)
+        mock_integrity.check_integrity.assert_not_called()
+        mock_store.set.assert_called_once_with(150)
+
+    @patch("feeder_utilities.dependencies.register.Register")
+    def test_find_missing_entries_incremental_gap(self, mock_register):
+        mock_integrity = MagicMock()
+        proc, mock_store = self.incremental_processor(mock_integrity, 100)
+        mock_register.return_value.max_entry.return_value = 150
+        mock_integrity.check_integrity_range.return_value = [120, 121, 140]
+        self.assertEqual(proc.find_missing_entries(MagicMock()), EntryRangeSet([(120, 121), (140, 140)]))
+        mock_store.set.assert_called_once_with(119)
+
+    @patch("feeder_utilities.dependencies.register.Register")
+    def test_find_missing_entries_up_to_date(self, mock_register):
+        mock_integrity = MagicMock()
+        proc, mock_store = self.incremental_processor(mock_integrity, 150)
+        mock_register.return_value.max_entry.return_value = 150
+        self.assertEqual(proc.find_missing_entries(MagicMock()), EntryRangeSet())
+        mock_integrity.check_integrity_range.assert_not_called()
+        mock_store.set.assert_not_called()
+
+    @patch("feeder_utilities.dependencies.register.Register")
+    def test_find_missing_entries_without_range_check(self, mock_register):
+        mock_integrity = MagicMock(spec=["check_integrity"])
+        proc, mock_store = self.incremental_processor(mock_integrity, 100)
+        mock_register.return_value.max_entry.return_value = 150
+        mock_integrity.check_integrity.return_value = []
+        proc.find_missing_entries(MagicMock())
+        mock_integrity.check_integrity.assert_called_once_with(150)
+        mock_store.set.assert_called_once_with(150)
+
+    @patch("feeder_utilities.dependencies.register.Register")
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_integrity_check_full(self, mock_publish, mock_register):
+        mock_integrity = MagicMock()
+        proc, mock_store = self.incremental_processor(mock_integrity, 100)
+        mock_message = MagicMock()
+        mock_message.properties.get.side_effect = ["reply-to", "correlation"]
+        mock_publish.side_effect = self.save_message
+        mock_register.return_value.max_entry.return_value = 150
+        mock_integrity.check_integrity.return_value = [5]
+        proc.process_rpc_message({"method": "integrity_check", "full": True}, mock_message, MagicMock())
+        mock_store.get.assert_not_called()
+        mock_integrity.check_integrity.assert_called_once_with(150)
+        mock_integrity.check_integrity_range.assert_not_called()
+        mock_store.set.assert_called_once_with(4)
+        self.assertEqual(self.rpc_response["result"], {'missing_entries': {'ranges': [[5, 5]], 'count': 1}})
+
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_list_methods(self, mock_publish):
+        proc = rpc_message_processor.RpcMessageProcessor(MagicMock(), "app_name", "integrity_check", "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key")
+        proc.register_method("reindex", lambda body, requests: {"reindexed": body["table"]})
+        mock_message = MagicMock()
+        mock_message.properties.get.side_effect = ["reply-to", "correlation"]
+        mock_publish.side_effect = self.save_message
+        proc.process_rpc_message({"method": "list_methods"}, mock_message, MagicMock())
+        self.assertEqual(self.rpc_response["result"],
+                         {"methods": ["delete_errors", "dump_error_queue", "health", "integrity_check",
+                                      "integrity_fix", "job_result", "job_status", "list_methods", "metrics",
+                                      "profiler", "reindex", "requeue_errors"]})
+
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_registered_function(self, mock_publish):
+        proc = rpc_message_processor.RpcMessageProcessor(MagicMock(), "app_name", "integrity_check", "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key")
+        mock_requests = MagicMock()
+        handler = MagicMock(return_value={"reindexed": "titles"})
+        proc.register_method("reindex", handler)
+        mock_message = MagicMock()
+        mock_message.properties.get.side_effect = ["reply-to", "correlation"]
+        mock_publish.side_effect = self.save_message
+        proc.process_rpc_message({"method": "reindex", "table": "titles"}, mock_message, mock_requests)
+        handler.assert_called_once_with({"method": "reindex", "table": "titles"}, mock_requests)
+        self.assertEqual(self.rpc_response, {"success": True, "result": {"reindexed": "titles"}, "error": None})
+
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_subclass_method(self, mock_publish):
+
+        class FeederRpcMessageProcessor(rpc_message_processor.RpcMessageProcessor):
+
+            @rpc_message_processor.rpc_method()
+            def reindex(self, body, requests):
+                return {"app": self.app_name}
+
+            @rpc_message_processor.rpc_method('health')
+            def feeder_health(self, body, requests):
+                return {"status": "OK"}
+
+        proc = FeederRpcMessageProcessor(MagicMock(), "app_name", "integrity_check", "rabbitmq_url", "queue_name",
+                                         "rpc_queue_name", "error_queue_name", "register_url", "routing_key")
+        mock_publish.side_effect = self.save_message
+        for method, result in [("reindex", {"app": "app_name"}), ("health", {"status": "OK"})]:
+            mock_message = MagicMock()
+            mock_message.properties.get.side_effect = ["reply-to", "correlation"]
+            proc.process_rpc_message({"method": method}, mock_message, MagicMock())
+            self.assertEqual(self.rpc_response["result"], result)
+
+    @patch("feeder_utilities.dependencies.rabbitmq.ErrorQueueClient")
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_error_queue_client_reused(self, mock_publish, mock_err_client):
+        proc = rpc_message_processor.RpcMessageProcessor(MagicMock(), "app_name", "integrity_check", "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key")
+        for method in ["dump_error_queue", "requeue_errors", "delete_errors"]:
+            mock_message = MagicMock()
+            mock_message.properties.get.side_effect = ["reply-to", "correlation"]
+            proc.process_rpc_message({"method": method}, mock_message, MagicMock())
+        mock_err_client.assert_called_once_with(proc.logger, "rabbitmq_url", "queue_name", "error_queue_name")
+
+    def call(self, proc, body):
+        mock_message = MagicMock()
+        mock_message.properties.get.side_effect = ["reply-to", "correlation"]
+        proc.process_rpc_message(body, mock_message, MagicMock())
+        return self.rpc_response
+
+    @patch("feeder_utilities.dependencies.rabbitmq.ErrorQueueClient")
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_background(self, mock_publish, mock_err_client):
+        proc = rpc_message_processor.RpcMessageProcessor(MagicMock(), "app_name", "integrity_check", "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key")
+        self.addCleanup(proc.jobs.shutdown)
+        mock_publish.side_effect = self.save_message
+        started = threading.Event()
+        release = threading.Event()
+
+        def bulk_requeue_messages(batch_size=None):
+            jobs.report_progress(requeued_count=5)
+            started.set()
+            release.wait(5)
+            return {"requeued_count": 10}
+
+        mock_err_client.return_value.bulk_requeue_messages.side_effect = bulk_requeue_messages
+        response = self.call(proc, {"method": "requeue_errors", "bulk": True, "background": True})
+        job_id = response["result"]["job_id"]
+        self.assertTrue(response["success"])
+
+        started.wait(5)
+        status = self.call(proc, {"method": "job_status", "job_id": job_id})["result"]
+        self.assertEqual((status["method"], status["status"], status["progress"]),
+                         ("requeue_errors", "running", {"requeued_count": 5}))
+        self.assertEqual(self.call(proc, {"method": "job_result", "job_id": job_id})["result"]["result"], None)
+
+        release.set()
+        proc.jobs.shutdown()
+        result = self.call(proc, {"method": "job_result", "job_id": job_id})["result"]
+        self.assertEqual((result["status"], result["result"]), ("succeeded", {"requeued_count": 10}))
+        self.assertEqual([job["job_id"] for job in self.call(proc, {"method": "job_status"})["result"]["jobs"]],
+                         [job_id])
+
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_background_not_allowed(self, mock_publish):
+        proc = rpc_message_processor.RpcMessageProcessor(MagicMock(), "app_name", "integrity_check", "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key")
+        mock_publish.side_effect = self.save_message
+        response = self.call(proc, {"method": "dump_error_queue", "background": True})
+        self.assertFalse(response["success"])
+        self.assertIn("can't be run in the background", response["error"]["error_message"])
+
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_unknown_job(self, mock_publish):
+        proc = rpc_message_processor.RpcMessageProcessor(MagicMock(), "app_name", "integrity_check", "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key")
+        mock_publish.side_effect = self.save_message
+        response = self.call(proc, {"method": "job_result", "job_id": "nope"})
+        self.assertFalse(response["success"])
+        self.assertIn("Unknown job 'nope'", response["error"]["error_message"])
+
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_metrics(self, mock_publish):
+        proc = rpc_message_processor.RpcMessageProcessor(MagicMock(), "app_name", "integrity_check", "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key")
+        mock_publish.side_effect = self.save_message
+        metrics.counter("test_rpc_metrics_total", "Counted by the metrics RPC test").inc()
+        result = self.call(proc, {"method": "metrics"})["result"]
+        self.assertEqual(result["test_rpc_metrics_total"],
+                         {"type": "counter", "help": "Counted by the metrics RPC test",
+                          "samples": [{"labels": {}, "value": 1}]})
+
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_profiler(self, mock_publish):
+        profiler = MagicMock()
+        profiler.configure.return_value = {"enabled": True}
+        proc = rpc_message_processor.RpcMessageProcessor(MagicMock(), "app_name", "integrity_check", "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key", profiler=profiler)
+        mock_publish.side_effect = self.save_message
+        result = self.call(proc, {"method": "profiler", "enabled": True, "every": 10, "directory": "/"})["result"]
+        self.assertEqual(result, {"enabled": True})
+        profiler.configure.assert_called_once_with(enabled=True, every=10, threshold=None, max_dumps=None)
+
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_no_profiler(self, mock_publish):
+        proc = rpc_message_processor.RpcMessageProcessor(MagicMock(), "app_name", "integrity_check", "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key")
+        mock_publish.side_effect = self.save_message
+        self.assertIn("No profiler configured", self.call(proc, {"method": "profiler"})["error"]["error_message"])
+
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_negotiated_reply(self, mock_publish):
+        proc = rpc_message_processor.RpcMessageProcessor(MagicMock(), "app_name", "integrity_check", "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key", reply_serializer="msgpack",
+                                                         reply_compress_threshold=1000)
+        mock_message = MagicMock()
+        mock_message.properties.get.side_effect = ["reply-to", "correlation"]
+        mock_message.headers = {"x-accept": "application/json, application/x-gzip"}
+        proc.process_rpc_message({"method": "list_methods"}, mock_message, MagicMock())
+        self.assertEqual(mock_publish.call_args[1], {"correlation_id": "correlation", "compression": "zlib",
+                                                     "compress_threshold": 1000})
+
+    @patch("feeder_utilities.dependencies.rabbitmq.publish_message")
+    def test_process_rpc_message_old_client_plain_reply(self, mock_publish):
+        proc = rpc_message_processor.RpcMessageProcessor(MagicMock(), "app_name", "integrity_check", "rabbitmq_url",
+                                                         "queue_name", "rpc_queue_name", "error_queue_name",
+                                                         "register_url", "routing_key", reply_serializer="msgpack")
+        mock_message = MagicMock()
+        mock_message.properties.get.side_effect = ["reply-to", "correlation"]
+        mock_message.headers = {}
+        proc.process_rpc_message({"method": "list_methods"}, mock_message, MagicMock())
+        self.assertEqual(mock_publish.call_args[1], {"correlation_id": "correlation"})
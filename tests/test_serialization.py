@@ -0,0 +1,68 @@
+import importlib.util
+import json
+import unittest
+import zlib
+from unittest import TestCase
+from kombu.serialization import dumps, loads, register_json
+from feeder_utilities import serialization
+
+
+class TestNegotiate(TestCase):
+
+    def test_no_header_plain_json(self):
+        self.assertEqual(serialization.negotiate(None, 'msgpack', 'zlib'), ('json', None))
+
+    def test_accepted(self):
+        accept = "application/x-msgpack, application/json, application/x-gzip"
+        self.assertEqual(serialization.negotiate(accept, 'msgpack', 'zlib'), ('msgpack', 'zlib'))
+
+    def test_not_accepted(self):
+        self.assertEqual(serialization.negotiate("application/json, application/x-bz2", 'msgpack', 'zlib'),
+                         ('json', None))
+
+    def test_accept_header(self):
+        accept = serialization.accept_header().split(', ')
+        self.assertIn('application/json', accept)
+        self.assertIn('application/x-gzip', accept)
+
+
+class TestEncode(TestCase):
+
+    def test_small_not_compressed(self):
+        payload, options = serialization.encode({"a": 1}, compression='zlib', compress_threshold=100)
+        self.assertEqual(json.loads(payload.decode('utf-8')), {"a": 1})
+        self.assertEqual(options, {'content_type': 'application/json', 'content_encoding': 'utf-8'})
+
+    def test_large_compressed(self):
+        payload, options = serialization.encode({"a": "x" * 200}, compression='zlib', compress_threshold=100)
+        self.assertEqual(options['compression'], 'zlib')
+
+    def test_default_threshold(self):
+        body = {"a": "x" * serialization.DEFAULT_COMPRESS_THRESHOLD}
+        self.assertNotIn('compression', serialization.encode({"a": 1}, compression='zlib')[1])
+        self.assertIn('compression', serialization.encode(body, compression='zlib')[1])
+
+
+class TestDecodeJson(TestCase):
+
+    def test_plain(self):
+        self.assertEqual(serialization.decode_json(b'{"a": 1}', {}), {"a": 1})
+
+    def test_compressed(self):
+        body = zlib.compress(b'{"a": 1}')
+        self.assertEqual(serialization.decode_json(body, {'compression': 'application/x-gzip'}), {"a": 1})
+
+    def test_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            serialization.decode_json(b'', {'compression': 'application/x-unknown'})
+
+
+@unittest.skipUnless(importlib.util.find_spec('orjson'), "orjson not installed")
+class TestInstallFastJson(TestCase):
+
+    def test_round_trip(self):
+        self.addCleanup(register_json)
+        self.assertTrue(serialization.install_fast_json())
+        content_type, content_encoding, payload = dumps({"a": [1, 2], 3: "three"}, serializer='json')
+        self.assertEqual(content_type, 'application/json')
+        self.assertEqual(loads(payload, content_type, content_encoding), {"a": [1, 2], "3": "three"})
@@ -0,0 +1,53 @@
+from unittest import TestCase
+from unittest.mock import patch
+from feeder_utilities.throttle import AdaptiveThrottle
+
+
+class TestAdaptiveThrottle(TestCase):
+
+    def record(self, throttle, count, seconds=0.1, errors=0):
+        for i in range(count):
+            throttle.record(seconds, i < errors)
+
+    def test_increase_per_window(self):
+        throttle = AdaptiveThrottle(0.5, initial_limit=4, window=10)
+        self.record(throttle, 9)
+        self.assertEqual(throttle.limit, 4)
+        self.record(throttle, 1)
+        self.assertEqual(throttle.limit, 5)
+        self.assertAlmostEqual(throttle.latency, 0.1)
+        self.assertEqual(throttle.error_rate, 0)
+
+    def test_decrease_when_slow(self):
+        throttle = AdaptiveThrottle(0.5, initial_limit=8, window=10)
+        self.record(throttle, 10, seconds=1)
+        self.assertEqual(throttle.limit, 4)
+
+    def test_decrease_on_errors(self):
+        throttle = AdaptiveThrottle(0.5, initial_limit=8, window=10)
+        self.record(throttle, 10, errors=2)
+        self.assertEqual(throttle.limit, 4)
+        self.assertFalse(throttle.paused)
+
+    def test_limits(self):
+        throttle = AdaptiveThrottle(0.5, min_limit=2, max_limit=3, initial_limit=3, window=1)
+        self.record(throttle, 1)
+        self.assertEqual(throttle.limit, 3)
+        self.record(throttle, 3, seconds=1)
+        self.assertEqual(throttle.limit, 2)
+
+    @patch('feeder_utilities.throttle.time')
+    def test_pause(self, mock_time):
+        mock_time.monotonic.return_value = 100
+        throttle = AdaptiveThrottle(0.5, initial_limit=8, window=10, pause_seconds=10)
+        self.record(throttle, 10, errors=5)
+        self.assertEqual(throttle.limit, 1)
+        self.assertTrue(throttle.paused)
+        self.assertTrue(throttle.status()["paused"])
+        mock_time.monotonic.return_value = 110
+        self.assertFalse(throttle.paused)
+
+    def test_status(self):
+        throttle = AdaptiveThrottle(0.5, max_limit=10)
+        self.assertEqual(throttle.status(), {"limit": 1, "min_limit": 1, "max_limit": 10, "paused": False,
+                                             "latency": None, "error_rate": None})